@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.documents import Document
+
+
+@dataclass
+class CacheEntry:
+    question: str
+    embedding: np.ndarray
+    answer: str
+    collection: str
+    # Corpus documents (``doc_hash``) the answer was generated from
+    doc_hashes: FrozenSet[str]
+    created_at: float
+
+
+@dataclass(frozen=True)
+class CacheHit:
+    entry: CacheEntry
+    similarity: float
+
+
+class SemanticAnswerCache:
+    """Answer cache keyed by query embedding.
+
+    A lookup hits when an earlier question against the same collection has a
+    cosine similarity of at least ``threshold``. Entries expire after
+    ``ttl_seconds``, the least recently used entry is dropped once
+    ``max_entries`` is reached, and ``invalidate_documents`` drops every
+    entry answered from a retired document. Collections are keyed by the set
+    of granted documents, so a session whose grants change moves to another
+    collection.
+    """
+
+    def __init__(self, threshold: float = 0.95, ttl_seconds: float = 3600, max_entries: int = 1024) -> None:
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, CacheEntry]" = OrderedDict()
+        self._by_collection: Dict[str, List[int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(embedding: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id, None)
+        if entry is not None:
+            ids = self._by_collection.get(entry.collection, [])
+            ids.remove(entry_id)
+            if not ids:
+                self._by_collection.pop(entry.collection, None)
+
+    def _expire(self, now: float) -> None:
+        expired = [i for i, e in self._entries.items() if now - e.created_at > self.ttl_seconds]
+        for entry_id in expired:
+            self._remove(entry_id)
+
+    def lookup(
+        self, embedding: Sequence[float], collection: str, doc_hashes: Optional[Iterable[str]] = None
+    ) -> Optional[CacheHit]:
+        """Best entry of ``collection`` above the threshold. With ``doc_hashes``,
+        only entries answered from those documents alone are considered."""
+        query = self._normalize(embedding)
+        allowed = set(doc_hashes) if doc_hashes is not None else None
+        with self._lock:
+            self._expire(time.monotonic())
+            ids = self._by_collection.get(collection)
+            if ids and allowed is not None:
+                ids = [i for i in ids if self._entries[i].doc_hashes <= allowed]
+            if not ids:
+                self.misses += 1
+                return None
+            matrix = np.stack([self._entries[i].embedding for i in ids])
+            similarities = matrix @ query
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < self.threshold:
+                self.misses += 1
+                return None
+            entry_id = ids[best]
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            return CacheHit(self._entries[entry_id], similarity)
+
+    def store(
+        self,
+        question: str,
+        embedding: Sequence[float],
+        answer: str,
+        collection: str,
+        documents: Sequence[Document] = (),
+    ) -> None:
+        if not answer:
+            return
+        entry = CacheEntry(
+            question=question,
+            embedding=self._normalize(embedding),
+            answer=answer,
+            collection=collection,
+            doc_hashes=frozenset(d.metadata["doc_hash"] for d in documents if d.metadata.get("doc_hash")),
+            created_at=time.monotonic(),
+        )
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = entry
+            self._by_collection.setdefault(collection, []).append(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_documents(self, doc_hashes: Sequence[str]) -> int:
+        retired = set(doc_hashes)
+        with self._lock:
+            ids = [i for i, e in self._entries.items() if e.doc_hashes & retired]
+            for entry_id in ids:
+                self._remove(entry_id)
+        return len(ids)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
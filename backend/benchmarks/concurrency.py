@@ -0,0 +1,85 @@
+"""Concurrency benchmark for ``/uploadMessage/``.
+
+Fires ``--concurrency`` chat requests at a running server at once while a
+probe keeps calling ``GET /transactions/``. If the chat pipeline blocked the
+event loop, the batch would take roughly ``concurrency x single latency`` and
+the probe latency would climb to the length of a whole chat call.
+
+Usage (from ``backend/``, with the API running)::
+
+    python -m benchmarks.concurrency --url http://localhost:8000 --concurrency 32
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List
+
+import httpx
+
+
+async def _chat(client: httpx.AsyncClient, message: str, session_id: str) -> float:
+    start = time.perf_counter()
+    response = await client.post(
+        "/uploadMessage/", json={"message": message, "session_id": session_id}
+    )
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+
+async def _probe(client: httpx.AsyncClient, stop: asyncio.Event, samples: List[float]) -> None:
+    while not stop.is_set():
+        start = time.perf_counter()
+        response = await client.get("/transactions/", params={"limit": 1})
+        response.raise_for_status()
+        samples.append(time.perf_counter() - start)
+        await asyncio.sleep(0.1)
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def main(url: str, concurrency: int, message: str) -> None:
+    timeout = httpx.Timeout(600.0)
+    limits = httpx.Limits(max_connections=concurrency + 2)
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+        # Single request first to get the baseline latency of one chat call
+        single = await _chat(client, message, "bench-warmup")
+
+        probe_samples: List[float] = []
+        stop = asyncio.Event()
+        probe = asyncio.create_task(_probe(client, stop, probe_samples))
+
+        start = time.perf_counter()
+        latencies = await asyncio.gather(
+            *(_chat(client, message, f"bench-{i}") for i in range(concurrency))
+        )
+        wall = time.perf_counter() - start
+        stop.set()
+        await probe
+
+    serial_estimate = single * concurrency
+    print(f"single request latency : {single:.2f}s")
+    print(f"concurrent requests    : {concurrency}")
+    print(f"wall time              : {wall:.2f}s (serial estimate {serial_estimate:.2f}s)")
+    print(f"effective parallelism  : {serial_estimate / wall:.1f}x")
+    print(f"chat latency p50/p99   : {statistics.median(latencies):.2f}s / {_percentile(latencies, 99):.2f}s")
+    print(
+        f"/transactions/ probe   : n={len(probe_samples)} "
+        f"p50={_percentile(probe_samples, 50) * 1000:.1f}ms "
+        f"max={max(probe_samples, default=0) * 1000:.1f}ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--message", default="吃太多鹽對健康有什麼影響？")
+    args = parser.parse_args()
+    asyncio.run(main(args.url, args.concurrency, args.message))
@@ -0,0 +1,144 @@
+"""Embedding backend benchmark: throughput, latency and recall drift.
+
+Loads the fp32 model and a variant (``--backend torch-int8|onnx|onnx-int8``)
+and, for each, reports:
+
+* corpus throughput of ``embed_documents`` in batches of ``--batch-size``;
+* p50/p99 latency and throughput of ``--requests`` single-text queries sent
+  from ``--concurrency`` threads, straight to the model and through the
+  micro-batching service;
+* for the variant, recall@k of its nearest neighbours against the fp32
+  ones, and the mean cosine between the fp32 and variant vectors of the
+  same text.
+
+The corpus is a text file with one passage per line, or a PDF split the way
+ingestion splits it. Queries default to a sample of the passages.
+
+Usage (from ``backend/``)::
+
+    python -m benchmarks.embeddings --corpus data/ncd_watch_may_2023_chin.pdf --backend torch-int8
+"""
+import argparse
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from embedding_service import EMBEDDING_BACKENDS, MicroBatchingEmbeddings, load_embedding_model
+
+
+def load_passages(path: str) -> List[str]:
+    if path.lower().endswith(".pdf"):
+        from langchain_text_splitters import CharacterTextSplitter
+
+        from ingest import iter_pdf_pages, normalize_documents, split_documents
+
+        splitter = CharacterTextSplitter(chunk_size=500, chunk_overlap=100, separator=" ")
+        documents = normalize_documents(split_documents(iter_pdf_pages(path), splitter))
+        return [doc.page_content for doc in documents if doc.page_content]
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def embed_corpus(model: Embeddings, passages: List[str], batch_size: int) -> tuple:
+    start = time.perf_counter()
+    vectors = []
+    for i in range(0, len(passages), batch_size):
+        vectors.extend(model.embed_documents(passages[i:i + batch_size]))
+    return np.asarray(vectors, dtype=np.float32), time.perf_counter() - start
+
+
+def query_latency(model: Embeddings, queries: List[str], concurrency: int) -> tuple:
+    def timed(text: str) -> float:
+        start = time.perf_counter()
+        model.embed_query(text)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(timed, queries))
+    return latencies, time.perf_counter() - start
+
+
+def top_k(queries: np.ndarray, corpus: np.ndarray, k: int) -> np.ndarray:
+    def normalize(v: np.ndarray) -> np.ndarray:
+        return v / np.maximum(np.linalg.norm(v, axis=1, keepdims=True), 1e-12)
+
+    scores = normalize(queries) @ normalize(corpus).T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def report(name: str, model: Embeddings, passages: List[str], queries: List[str], args) -> tuple:
+    corpus, seconds = embed_corpus(model, passages, args.batch_size)
+    print(f"[{name}] corpus: {len(passages)} passages in {seconds:.2f}s ({len(passages) / seconds:.1f}/s)")
+
+    batcher = MicroBatchingEmbeddings(model, args.max_batch_size, args.max_wait_ms)
+    for mode, embeddings in (("direct", model), ("micro-batched", batcher)):
+        latencies, wall = query_latency(embeddings, queries, args.concurrency)
+        print(
+            f"[{name}] queries {mode:<13}: {len(queries) / wall:7.1f}/s "
+            f"p50={statistics.median(latencies) * 1000:.1f}ms p99={_percentile(latencies, 99) * 1000:.1f}ms"
+        )
+    stats = batcher.stats()
+    batcher.close()
+    print(f"[{name}] micro-batches: {stats['batches']} (avg {stats['avg_batch_texts']:.1f} texts)")
+    query_vectors = np.asarray(model.embed_documents(queries[: args.recall_queries]), dtype=np.float32)
+    return corpus, query_vectors
+
+
+def main(args) -> None:
+    passages = load_passages(args.corpus)
+    if not passages:
+        raise SystemExit(f"No passages in {args.corpus}")
+    rng = random.Random(0)
+    queries = [rng.choice(passages)[: args.query_chars] for _ in range(args.requests)]
+    if args.queries:
+        queries = load_passages(args.queries)
+
+    baseline = load_embedding_model(args.model, "torch")
+    base_corpus, base_queries = report("torch", baseline, passages, queries, args)
+    if args.backend == "torch":
+        return
+
+    variant = load_embedding_model(args.model, args.backend, onnx_file=args.onnx_file)
+    corpus, query_vectors = report(args.backend, variant, passages, queries, args)
+
+    if corpus.shape[1] != base_corpus.shape[1]:
+        raise SystemExit(f"dimension changed: {base_corpus.shape[1]} -> {corpus.shape[1]}")
+    k = min(args.k, len(passages))
+    expected = top_k(base_queries, base_corpus, k)
+    found = top_k(query_vectors, corpus, k)
+    recall = np.mean([len(set(e) & set(f)) / k for e, f in zip(expected, found)])
+    cosine = np.mean(
+        np.sum(base_corpus * corpus, axis=1)
+        / np.maximum(np.linalg.norm(base_corpus, axis=1) * np.linalg.norm(corpus, axis=1), 1e-12)
+    )
+    print(f"[{args.backend}] recall@{k} vs fp32: {recall:.3f}, mean cosine to fp32 vectors: {cosine:.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", required=True, help="text file (one passage per line) or PDF")
+    parser.add_argument("--queries", default="", help="optional text file of queries, one per line")
+    parser.add_argument("--model", default="BAAI/bge-m3")
+    parser.add_argument("--backend", default="torch-int8", choices=EMBEDDING_BACKENDS)
+    parser.add_argument("--onnx-file", default=None)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--query-chars", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--recall-queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    main(parser.parse_args())
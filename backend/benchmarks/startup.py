@@ -0,0 +1,103 @@
+"""Import-time profile of the API module.
+
+Imports ``main`` in a fresh interpreter with ``python -X importtime`` and
+reports the wall time of the import and the slowest modules, by cumulative
+and by self time. Heavy resources (embedding model, LLM clients, vector
+stores) are built by the warm-up after startup, so they should not show up
+here; a regression usually means a heavy package moved back to a top-level
+import. With ``--url`` it also measures how long a running server takes to
+answer ``/ready`` with 200.
+
+Usage (from ``backend/``, with ``DATABASE_URL`` set)::
+
+    python -m benchmarks.startup --top 15 --max-seconds 5
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from typing import List, NamedTuple
+
+import httpx
+
+
+class ImportTime(NamedTuple):
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def parse_importtime(stderr: str) -> List[ImportTime]:
+    # Lines look like "import time:       412 |      1024 |   package.module"
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        stripped = name.lstrip()
+        depth = (len(name) - len(stripped) - 1) // 2
+        rows.append(ImportTime(stripped, int(fields[0]), int(fields[1]), depth))
+    return rows
+
+
+def profile_import(module: str) -> tuple:
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        capture_output=True,
+        text=True,
+    )
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        tail = "\n".join(result.stderr.splitlines()[-20:])
+        raise SystemExit(f"import {module} failed:\n{tail}")
+    return wall, parse_importtime(result.stderr)
+
+
+def wait_ready(url: str, timeout: float) -> float:
+    start = time.perf_counter()
+    with httpx.Client(base_url=url, timeout=5.0) as client:
+        while time.perf_counter() - start < timeout:
+            try:
+                if client.get("/ready").status_code == 200:
+                    return time.perf_counter() - start
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.5)
+    raise SystemExit(f"{url}/ready did not return 200 within {timeout:.0f}s")
+
+
+def main(module: str, top: int, max_seconds: float, url: str, ready_timeout: float) -> None:
+    wall, rows = profile_import(module)
+    print(f"import {module}: {wall:.2f}s wall, {len(rows)} modules")
+
+    print(f"\nslowest imports made by {module} (cumulative):")
+    for row in sorted((r for r in rows if r.depth == 1), key=lambda r: -r.cumulative_us)[:top]:
+        print(f"  {row.cumulative_us / 1e6:8.3f}s  {row.module}")
+
+    print("\nslowest modules (self):")
+    for row in sorted(rows, key=lambda r: -r.self_us)[:top]:
+        print(f"  {row.self_us / 1e6:8.3f}s  {row.module}")
+
+    if url:
+        print(f"\ntime to ready: {wait_ready(url, ready_timeout):.2f}s")
+
+    if max_seconds and wall > max_seconds:
+        raise SystemExit(f"import took {wall:.2f}s, over the {max_seconds:.2f}s budget")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--max-seconds", type=float, default=0.0, help="exit non-zero above this import time")
+    parser.add_argument("--url", default="", help="also time /ready of a server that was just started")
+    parser.add_argument("--ready-timeout", type=float, default=300.0)
+    args = parser.parse_args()
+    main(args.module, args.top, args.max_seconds, args.url, args.ready_timeout)
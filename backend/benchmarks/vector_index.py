@@ -0,0 +1,151 @@
+"""ANN index benchmark: recall@k against exact search as the table grows.
+
+Fills a scratch table (``bench_vector_index``) with vectors in steps of
+``--sizes``. At each size it builds an HNSW or IVFFlat index (cosine ops)
+and runs ``--queries`` searches exactly (index scans off) and through the
+index for each ``--ef-search`` (HNSW) or ``--probes`` (IVFFlat) value. It
+reports recall@k and p50/p99 latency per setting, next to the exact-search
+latency, which grows linearly with the table. Vectors are random clusters,
+or with ``--source corpus`` copies of the stored corpus embeddings. The
+scratch table is dropped at the end.
+
+Usage (from ``backend/``, with ``DATABASE_URL`` set)::
+
+    python -m benchmarks.vector_index --sizes 10000,50000,100000 --kind hnsw
+"""
+import argparse
+import statistics
+import time
+from typing import List
+
+import numpy as np
+from sqlalchemy import text
+
+import models
+from database import engine
+from vector_index import ivfflat_lists
+
+TABLE = "bench_vector_index"
+
+
+def _literal(vector: np.ndarray) -> str:
+    return "[" + ",".join(f"{x:.6f}" for x in vector) + "]"
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def random_vectors(rng: np.random.Generator, n: int, dim: int, centers: np.ndarray) -> np.ndarray:
+    # Clustered like real embeddings, where ANN recall is more telling than on uniform noise
+    vectors = centers[rng.integers(len(centers), size=n)] + 0.3 * rng.normal(size=(n, dim))
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def grow(conn, table: str, rng, target: int, dim: int, centers: np.ndarray, source: str) -> None:
+    current = conn.execute(text(f"SELECT count(*) FROM {table}")).scalar()
+    missing = target - current
+    if missing <= 0:
+        return
+    if source == "corpus":
+        conn.execute(
+            text(
+                f"INSERT INTO {table} (embedding) SELECT embedding FROM langchain_pg_embedding "
+                f"WHERE vector_dims(embedding) = :dim ORDER BY id OFFSET :offset LIMIT :limit"
+            ),
+            {"dim": dim, "offset": current, "limit": missing},
+        )
+        return
+    for start in range(0, missing, 1000):
+        batch = random_vectors(rng, min(1000, missing - start), dim, centers)
+        conn.execute(
+            text(f"INSERT INTO {table} (embedding) VALUES (CAST(:v AS vector))"),
+            [{"v": _literal(v)} for v in batch],
+        )
+
+
+def search(conn, table: str, queries: List[str], k: int, settings: List[str]) -> tuple:
+    ids, latencies = [], []
+    for query in queries:
+        with conn.begin():
+            for setting in settings:
+                conn.execute(text(setting))
+            start = time.perf_counter()
+            rows = conn.execute(
+                text(f"SELECT id FROM {table} ORDER BY embedding <=> CAST(:q AS vector) LIMIT :k"),
+                {"q": query, "k": k},
+            ).scalars().all()
+            latencies.append(time.perf_counter() - start)
+        ids.append(set(rows))
+    return ids, latencies
+
+
+def main(args) -> None:
+    rng = np.random.default_rng(0)
+    dim = args.dim
+    centers = rng.normal(size=(64, dim))
+    sizes = [int(s) for s in args.sizes.split(",")]
+    values = [int(v) for v in (args.ef_search if args.kind == "hnsw" else args.probes).split(",")]
+    param = "hnsw.ef_search" if args.kind == "hnsw" else "ivfflat.probes"
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+        conn.execute(text(f"CREATE TABLE {TABLE} (id bigserial PRIMARY KEY, embedding vector({dim}))"))
+    try:
+        print(f"{'rows':>9} {'setting':>22} {'recall@' + str(args.k):>10} {'p50 ms':>8} {'p99 ms':>8}")
+        for size in sizes:
+            with engine.begin() as conn:
+                grow(conn, TABLE, rng, size, dim, centers, args.source)
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                rows = conn.execute(text(f"SELECT count(*) FROM {TABLE}")).scalar()
+                conn.execute(text(f"DROP INDEX IF EXISTS {TABLE}_ann"))
+                if args.kind == "hnsw":
+                    params = f"m = {args.m}, ef_construction = {args.ef_construction}"
+                else:
+                    params = f"lists = {args.lists or ivfflat_lists(rows)}"
+                start = time.perf_counter()
+                conn.execute(
+                    text(
+                        f"CREATE INDEX {TABLE}_ann ON {TABLE} "
+                        f"USING {args.kind} (embedding vector_cosine_ops) WITH ({params})"
+                    )
+                )
+                build = time.perf_counter() - start
+                conn.execute(text(f"ANALYZE {TABLE}"))
+
+            queries = [_literal(v) for v in random_vectors(rng, args.queries, dim, centers)]
+            with engine.connect() as conn:
+                exact, latencies = search(conn, TABLE, queries, args.k, ["SET LOCAL enable_indexscan = off"])
+                print(
+                    f"{rows:>9} {'exact':>22} {1.0:>10.3f} "
+                    f"{statistics.median(latencies) * 1000:>8.2f} {_percentile(latencies, 99) * 1000:>8.2f}"
+                )
+                for value in values:
+                    found, latencies = search(conn, TABLE, queries, args.k, [f"SET LOCAL {param} = {value}"])
+                    recall = np.mean([len(e & f) / max(len(e), 1) for e, f in zip(exact, found)])
+                    print(
+                        f"{rows:>9} {f'{param}={value}':>22} {recall:>10.3f} "
+                        f"{statistics.median(latencies) * 1000:>8.2f} {_percentile(latencies, 99) * 1000:>8.2f}"
+                    )
+            print(f"{rows:>9} {args.kind} index built in {build:.1f}s ({params})")
+    finally:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10000,50000,100000")
+    parser.add_argument("--kind", default="hnsw", choices=["hnsw", "ivfflat"])
+    parser.add_argument("--source", default="random", choices=["random", "corpus"])
+    parser.add_argument("--dim", type=int, default=models.N_DIM)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--m", type=int, default=16)
+    parser.add_argument("--ef-construction", type=int, default=64)
+    parser.add_argument("--lists", type=int, default=None)
+    parser.add_argument("--ef-search", default="10,20,40,80,160")
+    parser.add_argument("--probes", default="1,5,10,20,40")
+    main(parser.parse_args())
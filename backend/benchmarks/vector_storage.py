@@ -0,0 +1,121 @@
+"""Compact storage benchmark: index size, recall and latency per storage mode.
+
+Fills a scratch table (``bench_vector_storage``) with ``--rows`` vectors and,
+for each of ``--storage`` (full, halfvec, binary), builds the HNSW index the
+API would use (see ``vector_index.index_expression``). It reports the index
+size, then recall@k against exact float32 search and p50/p99 latency of the
+quantized first pass re-ranked on the float32 vectors, for each
+``--rerank-factors`` value. Vectors are random clusters, or with
+``--source corpus`` copies of the stored corpus embeddings. The scratch table
+is dropped at the end.
+
+Usage (from ``backend/``, with ``DATABASE_URL`` set)::
+
+    python -m benchmarks.vector_storage --rows 100000 --rerank-factors 1,2,4,8
+"""
+import argparse
+import statistics
+import time
+from typing import List
+
+import numpy as np
+from sqlalchemy import text
+
+import models
+from benchmarks import vector_index as bench
+from database import engine
+from vector_index import STORAGE_MODES, index_expression
+
+TABLE = "bench_vector_storage"
+
+
+def first_pass(storage: str, dim: int) -> str:
+    # Same expressions as vector_storage.first_pass_distance
+    if storage == "halfvec":
+        return f"embedding::halfvec({dim}) <=> CAST(:q AS halfvec({dim}))"
+    if storage == "binary":
+        return f"binary_quantize(embedding)::bit({dim}) <~> binary_quantize(CAST(:q AS vector({dim})))"
+    return "embedding <=> CAST(:q AS vector)"
+
+
+def search(conn, queries: List[str], k: int, limit: int, storage: str, dim: int, ef_search: int) -> tuple:
+    ids, latencies = [], []
+    statement = text(
+        f"SELECT id FROM (SELECT id, embedding FROM {TABLE} ORDER BY {first_pass(storage, dim)} LIMIT :limit) c "
+        f"ORDER BY embedding <=> CAST(:q AS vector) LIMIT :k"
+    )
+    for query in queries:
+        with conn.begin():
+            # Enough candidates for the largest re-rank window
+            conn.execute(text(f"SET LOCAL hnsw.ef_search = {max(ef_search, limit)}"))
+            start = time.perf_counter()
+            rows = conn.execute(statement, {"q": query, "limit": limit, "k": k}).scalars().all()
+            latencies.append(time.perf_counter() - start)
+        ids.append(set(rows))
+    return ids, latencies
+
+
+def main(args) -> None:
+    rng = np.random.default_rng(0)
+    dim = args.dim
+    centers = rng.normal(size=(64, dim))
+    factors = [int(f) for f in args.rerank_factors.split(",")]
+    storages = args.storage.split(",")
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+        conn.execute(text(f"CREATE TABLE {TABLE} (id bigserial PRIMARY KEY, embedding vector({dim}))"))
+    try:
+        with engine.begin() as conn:
+            bench.grow(conn, TABLE, rng, args.rows, dim, centers, args.source)
+        queries = [bench._literal(v) for v in bench.random_vectors(rng, args.queries, dim, centers)]
+        with engine.connect() as conn:
+            rows = conn.execute(text(f"SELECT count(*) FROM {TABLE}")).scalar()
+            exact, latencies = bench.search(conn, TABLE, queries, args.k, ["SET LOCAL enable_indexscan = off"])
+        print(f"{rows} rows, {dim} dimensions, k={args.k}")
+        print(f"{'storage':>8} {'index MB':>9} {'rerank':>7} {'recall@' + str(args.k):>10} {'p50 ms':>8} {'p99 ms':>8}")
+        print(
+            f"{'exact':>8} {'-':>9} {'-':>7} {1.0:>10.3f} "
+            f"{statistics.median(latencies) * 1000:>8.2f} {bench._percentile(latencies, 99) * 1000:>8.2f}"
+        )
+        for storage in storages:
+            expression, opclass = index_expression("embedding", storage, dim)
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                conn.execute(text(f"DROP INDEX IF EXISTS {TABLE}_ann"))
+                start = time.perf_counter()
+                conn.execute(
+                    text(
+                        f"CREATE INDEX {TABLE}_ann ON {TABLE} USING hnsw ({expression} {opclass}) "
+                        f"WITH (m = {args.m}, ef_construction = {args.ef_construction})"
+                    )
+                )
+                build = time.perf_counter() - start
+                conn.execute(text(f"ANALYZE {TABLE}"))
+                size = conn.execute(text(f"SELECT pg_relation_size('{TABLE}_ann')")).scalar()
+            with engine.connect() as conn:
+                for factor in factors if storage != "full" else [1]:
+                    found, latencies = search(conn, queries, args.k, args.k * factor, storage, dim, args.ef_search)
+                    recall = np.mean([len(e & f) / max(len(e), 1) for e, f in zip(exact, found)])
+                    print(
+                        f"{storage:>8} {size / 2**20:>9.1f} {factor:>7} {recall:>10.3f} "
+                        f"{statistics.median(latencies) * 1000:>8.2f} {bench._percentile(latencies, 99) * 1000:>8.2f}"
+                    )
+            print(f"{storage:>8} index built in {build:.1f}s")
+    finally:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--storage", default=",".join(STORAGE_MODES))
+    parser.add_argument("--source", default="random", choices=["random", "corpus"])
+    parser.add_argument("--dim", type=int, default=models.N_DIM)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--m", type=int, default=16)
+    parser.add_argument("--ef-construction", type=int, default=64)
+    parser.add_argument("--ef-search", type=int, default=40)
+    parser.add_argument("--rerank-factors", default="1,2,4,8")
+    main(parser.parse_args())
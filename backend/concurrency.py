@@ -0,0 +1,32 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+
+T = TypeVar("T")
+
+# Upper bound on threads used for blocking work (vector store queries, PDF
+# ingestion, DB-backed stores) so a burst of chat requests cannot spawn an
+# unbounded number of threads or open an unbounded number of DB connections.
+BLOCKING_POOL_SIZE = int(os.getenv("BLOCKING_POOL_SIZE", "32"))
+
+_executor = ThreadPoolExecutor(
+    max_workers=BLOCKING_POOL_SIZE,
+    thread_name_prefix="blocking",
+)
+
+
+async def run_blocking(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking callable on the shared bounded executor.
+
+    Use this for libraries that only offer a synchronous API (e.g. ``PGVector``
+    in sync mode, ``SQLDocStore``, ``PyPDFLoader``) so the event loop keeps
+    serving other requests while the call is in progress.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+def shutdown_executor() -> None:
+    _executor.shutdown(wait=False, cancel_futures=True)
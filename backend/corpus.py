@@ -0,0 +1,476 @@
+import contextlib
+import hashlib
+import threading
+from collections import defaultdict
+from dataclasses import dataclass, field
+from itertools import groupby
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_text_splitters import TextSplitter
+from sqlalchemy import delete, func, literal, select, text, update
+from sqlalchemy.dialects.postgresql import JSONB, insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+import models
+from ingest import pipelined
+from sql import SQLDocStore
+from vector_index import VECTOR_STORAGE, search_params
+from vector_storage import quantized_search
+
+if TYPE_CHECKING:
+    from langchain.retrievers import ParentDocumentRetriever
+    from langchain_postgres.vectorstores import PGVector
+
+CORPUS_COLLECTION = "corpus_chunks"
+CORPUS_PARENT_COLLECTION = "corpus_parents"
+ID_KEY = "doc_id"
+
+
+def text_sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def parent_id(doc_hash: str, index: int, text: str) -> str:
+    """Deterministic ID of a parent chunk, namespaced by its document."""
+    return hashlib.sha256(f"{doc_hash}\0{index}\0{text}".encode("utf-8")).hexdigest()
+
+
+def child_id(parent: str, index: int) -> str:
+    return hashlib.sha256(f"{parent}\0{index}".encode("utf-8")).hexdigest()
+
+
+@dataclass
+class PageChunks:
+    """Manifest entry of one page and, until written, its new chunks."""
+
+    page_number: int
+    page_hash: str
+    parent_ids: List[str]
+    reused: bool = False
+    parents: List[Tuple[str, Document, List[Document]]] = field(default_factory=list)
+
+
+class DocumentCorpus:
+    """Content-addressed document corpus shared by every session.
+
+    Each distinct file (by SHA-256 of its bytes) is split, embedded and stored
+    once, in a single vector collection and a single parent docstore. Sessions
+    only hold grants (``session_documents`` rows); retrieval is restricted to
+    the granted documents with a ``doc_hash`` metadata filter. Identical chunks
+    in different files are stored per file but embedded once through the
+    embedding cache.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        engine: Engine,
+        session_factory: Callable[[], Session],
+        child_splitter: TextSplitter,
+        parent_splitter: TextSplitter,
+        k: int = 3,
+        embed_batch_size: int = 32,
+    ) -> None:
+        self.embeddings = embeddings
+        self.session_factory = session_factory
+        self.child_splitter = child_splitter
+        self.parent_splitter = parent_splitter
+        self.k = k
+        self.embed_batch_size = embed_batch_size
+        self.engine = engine
+        # Both stores create their tables and collections when built, so they
+        # are built on first use instead of at import time
+        self._vectorstore: Optional["PGVector"] = None
+        self._docstore: Optional[SQLDocStore] = None
+        self._stores_lock = threading.Lock()
+        # Called with the doc_hash of each retired document, e.g. to drop cached answers
+        self.on_retire: Optional[Callable[[str], None]] = None
+
+    @property
+    def vectorstore(self) -> "PGVector":
+        if self._vectorstore is None:
+            with self._stores_lock:
+                if self._vectorstore is None:
+                    from langchain_postgres.vectorstores import PGVector
+
+                    self._vectorstore = PGVector(
+                        embeddings=self.embeddings,
+                        collection_name=CORPUS_COLLECTION,
+                        connection=self.engine,
+                        embedding_length=models.N_DIM,
+                        use_jsonb=True,
+                    )
+        return self._vectorstore
+
+    @property
+    def docstore(self) -> SQLDocStore:
+        if self._docstore is None:
+            with self._stores_lock:
+                if self._docstore is None:
+                    self._docstore = SQLDocStore(
+                        connection_string=self.engine.url.render_as_string(hide_password=False),
+                        collection_name=CORPUS_PARENT_COLLECTION,
+                        engine=self.engine,
+                    )
+        return self._docstore
+
+    @staticmethod
+    def search_filter(doc_hashes: List[str]) -> dict:
+        return {"doc_hash": {"$in": doc_hashes}}
+
+    @staticmethod
+    def scope_key(doc_hashes: List[str]) -> str:
+        """Identifier of a set of granted documents, used to scope cached answers."""
+        joined = ",".join(sorted(doc_hashes))
+        return "corpus:" + hashlib.sha1(joined.encode("utf-8")).hexdigest()
+
+    def retriever_for(self, doc_hashes: List[str]) -> "ParentDocumentRetriever":
+        # Documents are split, embedded and stored by ``add_documents``; the
+        # retriever is only used for lookups.
+        from langchain.retrievers import ParentDocumentRetriever
+
+        return ParentDocumentRetriever(
+            vectorstore=self.vectorstore,
+            docstore=self.docstore,
+            child_splitter=self.child_splitter,
+            id_key=ID_KEY,
+            search_kwargs={"k": self.k, "filter": self.search_filter(doc_hashes)},
+        )
+
+    def has_document(self, doc_hash: str) -> bool:
+        with self.session_factory() as db:
+            return db.get(models.CorpusDocument, doc_hash) is not None
+
+    def granted(self, session_id: str) -> List[str]:
+        with self.session_factory() as db:
+            rows = (
+                db.query(models.SessionDocument.doc_hash)
+                .filter(models.SessionDocument.session_id == session_id)
+                .all()
+            )
+        return [row[0] for row in rows]
+
+    def grant(self, session_id: str, doc_hash: str) -> None:
+        stmt = insert(models.SessionDocument).values(
+            session_id=session_id, doc_hash=doc_hash
+        ).on_conflict_do_nothing()
+        with self.session_factory() as db:
+            db.execute(stmt)
+            db.commit()
+
+    def _collection_filter(self):
+        EmbeddingStore = self.vectorstore.EmbeddingStore
+        CollectionStore = self.vectorstore.CollectionStore
+        collection = select(CollectionStore.uuid).where(CollectionStore.name == CORPUS_COLLECTION)
+        return EmbeddingStore.collection_id == collection.scalar_subquery()
+
+    def _page_batches(
+        self,
+        doc_hash: str,
+        documents: Iterable[Document],
+        reusable: Dict[str, List[List[str]]],
+    ) -> Iterator[List[PageChunks]]:
+        """Group ``documents`` by page and split new pages into parents and
+        children, as a stream of batches of at least ``embed_batch_size``
+        children. Pages whose hash is in ``reusable`` keep their stored chunks.
+        """
+        batch: List[PageChunks] = []
+        size = 0
+        index = 0
+        pages = groupby(documents, key=lambda d: d.metadata.get("page"))
+        for page_number, (_, sections) in enumerate(pages):
+            sections = list(sections)
+            page_hash = text_sha256("\0".join(s.page_content for s in sections))
+            candidates = reusable.get(page_hash)
+            if candidates:
+                batch.append(PageChunks(page_number, page_hash, candidates.pop(), reused=True))
+                continue
+            page = PageChunks(page_number, page_hash, [])
+            for parent in self.parent_splitter.split_documents(sections):
+                parent.metadata["doc_hash"] = doc_hash
+                pid = parent_id(doc_hash, index, parent.page_content)
+                index += 1
+                children = self.child_splitter.split_documents([parent])
+                for child in children:
+                    child.metadata[ID_KEY] = pid
+                page.parent_ids.append(pid)
+                page.parents.append((pid, parent, children))
+                size += len(children)
+            batch.append(page)
+            if size >= self.embed_batch_size:
+                yield batch
+                batch, size = [], 0
+        if batch:
+            yield batch
+
+    def _reusable_pages(self, doc_hash: str) -> Dict[str, List[List[str]]]:
+        reusable: Dict[str, List[List[str]]] = defaultdict(list)
+        with self.session_factory() as db:
+            rows = (
+                db.query(models.CorpusPage.page_hash, models.CorpusPage.parent_ids)
+                .filter(models.CorpusPage.doc_hash == doc_hash)
+                .all()
+            )
+        for page_hash, parent_ids in rows:
+            reusable[page_hash].append(parent_ids)
+        return reusable
+
+    def add_documents(
+        self,
+        doc_hash: str,
+        file_name: str,
+        documents: Iterable[Document],
+        progress: Optional[Callable[..., None]] = None,
+        previous: Optional[str] = None,
+    ) -> int:
+        """Embed and store ``documents`` (e.g. a page stream) under ``doc_hash``.
+
+        Documents are consumed lazily, so only a few batches are held in
+        memory. Embedding a batch overlaps with writing the previous one to
+        the vector store and docstore.
+
+        If ``previous`` is an earlier version of the same file, pages whose
+        content hash is unchanged are not split or embedded again: their
+        chunks are moved over to ``doc_hash`` when the new version is
+        recorded. The chunks left on ``previous`` are removed when it is
+        retired.
+        """
+        reusable = self._reusable_pages(previous) if previous else {}
+        pages: List[PageChunks] = []
+
+        def embed(batch):
+            children = [child for page in batch for _, _, kids in page.parents for child in kids]
+            vectors = self.embeddings.embed_documents([c.page_content for c in children])
+            return batch, children, vectors
+
+        def write(prepared) -> None:
+            batch, children, vectors = prepared
+            if children:
+                self.vectorstore.add_embeddings(
+                    texts=[c.page_content for c in children],
+                    embeddings=vectors,
+                    metadatas=[c.metadata for c in children],
+                    ids=[
+                        child_id(pid, i)
+                        for page in batch
+                        for pid, _, kids in page.parents
+                        for i in range(len(kids))
+                    ],
+                )
+            parents = [(pid, parent) for page in batch for pid, parent, _ in page.parents]
+            if parents:
+                self.docstore.mset(parents)
+            for page in batch:
+                # Only the manifest entry is kept once the page is written
+                page.parents = []
+                pages.append(page)
+            if progress is not None:
+                progress(chunks=len(parents))
+
+        pipelined(self._page_batches(doc_hash, documents, reusable), embed, write)
+
+        reused_ids = [pid for page in pages if page.reused for pid in page.parent_ids]
+        parent_count = sum(len(page.parent_ids) for page in pages)
+        EmbeddingStore = self.vectorstore.EmbeddingStore
+        with self.session_factory() as db:
+            db.add(models.CorpusDocument(doc_hash=doc_hash, file_name=file_name, parent_count=parent_count))
+            db.flush()
+            db.add_all(
+                models.CorpusPage(
+                    doc_hash=doc_hash,
+                    page_number=page.page_number,
+                    page_hash=page.page_hash,
+                    parent_ids=page.parent_ids,
+                )
+                for page in pages
+            )
+            if reused_ids:
+                db.execute(
+                    update(EmbeddingStore)
+                    .where(self._collection_filter(), EmbeddingStore.cmetadata[ID_KEY].astext.in_(reused_ids))
+                    .values(
+                        cmetadata=EmbeddingStore.cmetadata.op("||")(literal({"doc_hash": doc_hash}, JSONB))
+                    )
+                )
+            db.commit()
+        if reused_ids:
+            # Parents carry doc_hash too: retrieval results and cached answers
+            # are attributed to the document through it
+            parents = [(pid, parent) for pid, parent in zip(reused_ids, self.docstore.mget(reused_ids)) if parent]
+            for _, parent in parents:
+                parent.metadata["doc_hash"] = doc_hash
+            self.docstore.mset(parents)
+        if previous:
+            reused = sum(page.reused for page in pages)
+            print(f"{file_name} ({doc_hash[:12]}): reused {reused}/{len(pages)} pages of {previous[:12]}")
+        return parent_count
+
+    def retire(self, doc_hash: str) -> None:
+        """Delete a document, its chunks and its parents from the corpus."""
+        EmbeddingStore = self.vectorstore.EmbeddingStore
+        owned = self._collection_filter(), EmbeddingStore.cmetadata["doc_hash"].astext == doc_hash
+        with self.session_factory() as db:
+            parent_ids = [
+                row[0]
+                for row in db.execute(select(EmbeddingStore.cmetadata[ID_KEY].astext).where(*owned).distinct())
+                if row[0]
+            ]
+            db.execute(delete(EmbeddingStore).where(*owned))
+            # Cascades to the document's pages, grants and file entries
+            db.execute(delete(models.CorpusDocument).where(models.CorpusDocument.doc_hash == doc_hash))
+            db.commit()
+        if parent_ids:
+            self.docstore.mdelete(parent_ids)
+        print(f"Retired {doc_hash[:12]}: {len(parent_ids)} parent chunks")
+        if self.on_retire is not None:
+            self.on_retire(doc_hash)
+
+    def release(self, session_id: str, doc_hash: str) -> None:
+        """Revoke a grant, retiring the document once no session holds it."""
+        with self.session_factory() as db:
+            db.execute(
+                delete(models.SessionDocument).where(
+                    models.SessionDocument.session_id == session_id,
+                    models.SessionDocument.doc_hash == doc_hash,
+                )
+            )
+            remaining = db.query(models.SessionDocument).filter(models.SessionDocument.doc_hash == doc_hash).count()
+            db.commit()
+        if not remaining:
+            self.retire(doc_hash)
+
+    def grant_count(self, doc_hash: str) -> int:
+        with self.session_factory() as db:
+            return db.query(models.SessionDocument).filter(models.SessionDocument.doc_hash == doc_hash).count()
+
+    def file_version(self, session_id: str, file_name: str) -> Optional[str]:
+        with self.session_factory() as db:
+            entry = db.get(models.SessionFile, (session_id, file_name))
+            return entry.doc_hash if entry is not None else None
+
+    def _record_file(self, session_id: str, file_name: str, doc_hash: str) -> None:
+        stmt = insert(models.SessionFile).values(session_id=session_id, file_name=file_name, doc_hash=doc_hash)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[models.SessionFile.session_id, models.SessionFile.file_name],
+            set_={"doc_hash": stmt.excluded.doc_hash, "updated_at": func.now()},
+        )
+        with self.session_factory() as db:
+            db.execute(stmt)
+            db.commit()
+
+    @contextlib.contextmanager
+    def _lock_for(self, key: str) -> Iterator[None]:
+        """Hold a Postgres advisory lock on ``key`` for the block.
+
+        Shared by every API worker, unlike a thread lock. The lock belongs to
+        a transaction on a connection of its own, so it is released when the
+        block ends, or when the connection dies.
+        """
+        with self.engine.begin() as conn:
+            conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"), {"key": f"corpus-ingest:{key}"})
+            yield
+
+    def ingest(
+        self,
+        file_path: str,
+        file_name: str,
+        session_id: str,
+        load_documents: Callable[[str], Iterable[Document]],
+        progress: Optional[Callable[..., None]] = None,
+    ) -> Tuple[str, bool]:
+        """Store a file once and grant it to ``session_id``.
+
+        A file uploaded again under the same name by the same session replaces
+        its earlier version: when that version is held by this session only,
+        unchanged pages are carried over instead of re-embedded, and the rest
+        of the old version is deleted once no session holds it.
+
+        ``progress``, if given, is called with ``chunks=<n>`` as parent chunks
+        are stored. Returns the document hash and whether the file was new to
+        the corpus.
+        """
+        doc_hash = file_sha256(file_path)
+        created = False
+        with self._lock_for(f"{session_id}\0{file_name}"):
+            previous = self.file_version(session_id, file_name)
+            if previous == doc_hash:
+                previous = None
+            with self._lock_for(doc_hash):
+                if not self.has_document(doc_hash):
+                    # Pages of a version other sessions still use are not moved
+                    base = previous if previous and self.grant_count(previous) <= 1 else None
+                    count = self.add_documents(
+                        doc_hash, file_name, load_documents(file_path), progress, previous=base
+                    )
+                    print(f"Ingested {file_name} ({doc_hash[:12]}): {count} parent chunks")
+                    created = True
+                else:
+                    print(f"{file_name} ({doc_hash[:12]}) already in corpus, granting only")
+            self.grant(session_id, doc_hash)
+            self._record_file(session_id, file_name, doc_hash)
+            if previous:
+                self.release(session_id, previous)
+        return doc_hash, created
+
+    def similarity_search(
+        self,
+        query: str,
+        doc_hashes: List[str],
+        k: int = 4,
+        embedding: Optional[List[float]] = None,
+        ef_search: Optional[int] = None,
+        probes: Optional[int] = None,
+    ) -> List[Document]:
+        """Best matching child chunks; ``ef_search``/``probes`` override the
+        ANN index defaults for this search."""
+        if not doc_hashes:
+            return []
+        with search_params(ef_search, probes):
+            if VECTOR_STORAGE != "full":
+                if embedding is None:
+                    embedding = self.embeddings.embed_query(query)
+                EmbeddingStore = self.vectorstore.EmbeddingStore
+                where = [self._collection_filter(), EmbeddingStore.cmetadata["doc_hash"].astext.in_(doc_hashes)]
+                with self.session_factory() as db:
+                    return quantized_search(db, EmbeddingStore, embedding, k, where)
+            if embedding is not None:
+                return self.vectorstore.similarity_search_by_vector(
+                    embedding, k=k, filter=self.search_filter(doc_hashes)
+                )
+            return self.vectorstore.similarity_search(query, k=k, filter=self.search_filter(doc_hashes))
+
+    def get_relevant_documents(
+        self,
+        query: str,
+        doc_hashes: List[str],
+        embedding: Optional[List[float]] = None,
+        ef_search: Optional[int] = None,
+        probes: Optional[int] = None,
+    ) -> List[Document]:
+        """Parent documents of the best matching child chunks.
+
+        With a precomputed ``embedding`` the child search runs by vector, and
+        the parents are resolved the way ``ParentDocumentRetriever`` does.
+        """
+        if not doc_hashes:
+            return []
+        if embedding is None and VECTOR_STORAGE == "full":
+            with search_params(ef_search, probes):
+                return self.retriever_for(doc_hashes).invoke(query)
+        children = self.similarity_search(
+            query, doc_hashes, k=self.k, embedding=embedding, ef_search=ef_search, probes=probes
+        )
+        ids = list(dict.fromkeys(c.metadata[ID_KEY] for c in children if ID_KEY in c.metadata))
+        return [doc for doc in self.docstore.mget(ids) if doc is not None]
+
@@ -5,18 +5,29 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
-logging.basicConfig()
-logging.getLogger("sqlalchemy.engine").setLevel(logging.INFO)
-
 load_dotenv()
 
+# Statement logging formats every query on the request path; opt in when debugging
+if os.getenv("SQL_ECHO", "").lower() in ("1", "true", "yes"):
+    logging.basicConfig()
+    logging.getLogger("sqlalchemy.engine").setLevel(logging.INFO)
+
 # Prefer DATABASE_URL, fall back to legacy DB_CONNECTION for backward compatibility
 DATABASE_URL = os.getenv("DATABASE_URL") or os.getenv("DB_CONNECTION")
 
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL or DB_CONNECTION environment variable must be set")
 
-engine = create_engine(DATABASE_URL)
+# One pooled engine per process, shared by the ORM, the vector stores and the
+# parent docstore. Connections are borrowed per operation, so the pool bounds the
+# number of Postgres connections a worker can hold.
+engine = create_engine(
+    DATABASE_URL,
+    pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
+    max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "20")),
+    pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+    pool_pre_ping=True,
+)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -0,0 +1,178 @@
+import hashlib
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+import models
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    return _WHITESPACE_RE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def text_hash(model_name: str, text: str) -> str:
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper backed by a content-hash cache.
+
+    Texts are normalized (NFC, collapsed whitespace) and keyed by
+    ``sha256(model_name, text)``. Lookups go to an in-process LRU first, then
+    to the ``embedding_cache`` table, and only the remaining texts are sent to
+    the wrapped model, once per distinct text. New vectors are written back to
+    both layers. Queries and documents share one key space because the
+    wrapped model (bge-m3) embeds both the same way.
+
+    A failing cache table never fails the embedding call: the error is logged
+    and the texts are embedded directly.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        session_factory: Callable[[], Session],
+        model_name: str,
+        lru_size: int = 10000,
+    ) -> None:
+        self.embeddings = embeddings
+        self.session_factory = session_factory
+        self.model_name = model_name
+        self.lru_size = lru_size
+        self._lru: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def _lru_get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._lru.get(key)
+            if vector is not None:
+                self._lru.move_to_end(key)
+            return vector
+
+    def _lru_put(self, key: str, vector: np.ndarray) -> None:
+        with self._lock:
+            self._lru[key] = vector
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def _db_get(self, keys: Sequence[str]) -> Dict[str, np.ndarray]:
+        Cache = models.EmbeddingCache
+        try:
+            with self.session_factory() as db:
+                rows = (
+                    db.query(Cache.text_hash, Cache.embedding)
+                    .filter(Cache.model == self.model_name, Cache.text_hash.in_(keys))
+                    .all()
+                )
+        except Exception as e:
+            print(f"Embedding cache lookup failed: {e}")
+            return {}
+        return {key: np.asarray(embedding, dtype=np.float32) for key, embedding in rows}
+
+    def _db_put(self, vectors: Dict[str, np.ndarray]) -> None:
+        Cache = models.EmbeddingCache
+        stmt = insert(Cache).values(
+            [
+                {"model": self.model_name, "text_hash": key, "embedding": vector}
+                for key, vector in vectors.items()
+            ]
+        ).on_conflict_do_nothing(index_elements=[Cache.model, Cache.text_hash])
+        try:
+            with self.session_factory() as db:
+                db.execute(stmt)
+                db.commit()
+        except Exception as e:
+            print(f"Embedding cache write failed: {e}")
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        normalized = [normalize_text(t) for t in texts]
+        keys = [text_hash(self.model_name, t) for t in normalized]
+        found: Dict[str, np.ndarray] = {}
+
+        for key in set(keys):
+            vector = self._lru_get(key)
+            if vector is not None:
+                found[key] = vector
+        self.hits += len(found)
+
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        if missing:
+            from_db = self._db_get(missing)
+            self.db_hits += len(from_db)
+            for key, vector in from_db.items():
+                self._lru_put(key, vector)
+            found.update(from_db)
+
+        # Embed each distinct uncached text once
+        pending = {key: text for key, text in zip(keys, normalized) if key not in found}
+        if pending:
+            self.misses += len(pending)
+            computed = self.embeddings.embed_documents(list(pending.values()))
+            new_vectors = {
+                key: np.asarray(vector, dtype=np.float32)
+                for key, vector in zip(pending.keys(), computed)
+            }
+            for key, vector in new_vectors.items():
+                self._lru_put(key, vector)
+            self._db_put(new_vectors)
+            found.update(new_vectors)
+
+        return [found[key].tolist() for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._lru)
+        return {
+            "model": self.model_name,
+            "lru_entries": size,
+            "lru_hits": self.hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+        }
+
+
+class LazyEmbeddings(Embeddings):
+    """Embeddings whose model is built by ``factory`` on first use.
+
+    Loading a sentence-transformers model takes seconds and gigabytes, so it
+    is deferred until the first embedding call or an explicit ``load`` (the
+    warm-up step). Concurrent first calls build the model once.
+    """
+
+    def __init__(self, factory: Callable[[], Embeddings]) -> None:
+        self.factory = factory
+        self._embeddings: Optional[Embeddings] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._embeddings is not None
+
+    def load(self) -> Embeddings:
+        if self._embeddings is None:
+            with self._lock:
+                if self._embeddings is None:
+                    self._embeddings = self.factory()
+        return self._embeddings
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.load().embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.load().embed_query(text)
@@ -0,0 +1,299 @@
+import json
+import queue
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Deque, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+# Quantized export of the ONNX model, as written by sentence-transformers'
+# ``export_dynamic_quantized_onnx_model(model, "avx512_vnni", ...)``
+DEFAULT_ONNX_INT8_FILE = "onnx/model_qint8_avx512_vnni.onnx"
+
+
+def cache_model_name(model_name: str, backend: str) -> str:
+    """Embedding cache key of a model variant.
+
+    Quantized variants produce slightly different vectors, so they get their
+    own cache entries; the fp32 model keeps the plain model name.
+    """
+    return model_name if backend == "torch" else f"{model_name}@{backend}"
+
+
+def load_embedding_model(
+    model_name: str,
+    backend: str = "torch",
+    onnx_file: Optional[str] = None,
+    dimension: Optional[int] = None,
+) -> Embeddings:
+    """Load a CPU sentence-transformers model in one of ``EMBEDDING_BACKENDS``.
+
+    ``torch`` is the fp32 model. ``torch-int8`` applies dynamic int8
+    quantization to its linear layers. ``onnx`` and ``onnx-int8`` run the
+    model's ONNX export on onnxruntime; ``onnx_file`` selects the file inside
+    the model repository or directory. If ``dimension`` is given, a model
+    whose output size differs is rejected, since its vectors could not be
+    stored next to the existing ones.
+    """
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend {backend!r}; expected one of {', '.join(EMBEDDING_BACKENDS)}")
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    model_kwargs = {"device": "cpu"}
+    if backend.startswith("onnx"):
+        model_kwargs["backend"] = "onnx"
+        file_name = onnx_file or (DEFAULT_ONNX_INT8_FILE if backend == "onnx-int8" else None)
+        if file_name:
+            model_kwargs["model_kwargs"] = {"file_name": file_name}
+    embeddings = HuggingFaceEmbeddings(model_name=model_name, model_kwargs=model_kwargs)
+
+    if backend == "torch-int8":
+        import torch
+
+        torch.quantization.quantize_dynamic(embeddings.client, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+    if dimension is not None:
+        size = embeddings.client.get_sentence_embedding_dimension()
+        if size != dimension:
+            raise ValueError(f"{model_name} ({backend}) produces {size}-dimensional vectors, expected {dimension}")
+    return embeddings
+
+
+class _Request:
+    __slots__ = ("texts", "future")
+
+    def __init__(self, texts: List[str]) -> None:
+        self.texts = texts
+        self.future: Future = Future()
+
+
+class MicroBatchingEmbeddings(Embeddings):
+    """Embeddings wrapper that merges concurrent calls into micro-batches.
+
+    Calls from any thread are queued; a single dispatcher thread waits up to
+    ``max_wait_ms`` for more texts to arrive, then embeds up to
+    ``max_batch_size`` texts in one model call and hands each caller its own
+    vectors. Queries are dispatched ahead of document batches so a large
+    ingestion does not delay chat requests. A request is never split, so a
+    call with more than ``max_batch_size`` texts forms a batch of its own.
+
+    Queries and documents are embedded the same way, which holds for bge-m3
+    (it uses no query instruction).
+    """
+
+    def __init__(self, embeddings: Embeddings, max_batch_size: int = 32, max_wait_ms: float = 5.0) -> None:
+        self.embeddings = embeddings
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._queries: Deque[_Request] = deque()
+        self._documents: Deque[_Request] = deque()
+        self._pending_texts = 0
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self.batches = 0
+        self.texts = 0
+        self.requests = 0
+
+    def _submit(self, texts: List[str], query: bool) -> List[List[float]]:
+        request = _Request(list(texts))
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Embedding service is closed")
+            (self._queries if query else self._documents).append(request)
+            self._pending_texts += len(request.texts)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return request.future.result()
+
+    def _take_batch(self) -> List[_Request]:
+        with self._cond:
+            while not (self._queries or self._documents) and not self._closed:
+                self._cond.wait()
+            if not (self._queries or self._documents):
+                return []
+            # Give concurrent callers a short window to join the batch
+            deadline = time.monotonic() + self.max_wait
+            while self._pending_texts < self.max_batch_size and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch: List[_Request] = []
+            size = 0
+            for pending in (self._queries, self._documents):
+                while pending and (not batch or size + len(pending[0].texts) <= self.max_batch_size):
+                    request = pending.popleft()
+                    batch.append(request)
+                    size += len(request.texts)
+            self._pending_texts -= size
+            return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return
+            texts = [text for request in batch for text in request.texts]
+            try:
+                vectors = self.embeddings.embed_documents(texts)
+            except BaseException as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            offset = 0
+            for request in batch:
+                request.future.set_result(vectors[offset:offset + len(request.texts)])
+                offset += len(request.texts)
+            with self._cond:
+                self.batches += 1
+                self.texts += len(texts)
+                self.requests += len(batch)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self._submit(texts, query=False)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._submit([text], query=True)[0]
+
+    def close(self) -> None:
+        """Embed what is already queued, then stop the dispatcher."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            batches, texts, requests = self.batches, self.texts, self.requests
+            queued = self._pending_texts
+        return {
+            "batches": batches,
+            "requests": requests,
+            "texts": texts,
+            "avg_batch_texts": texts / batches if batches else 0.0,
+            "queued_texts": queued,
+        }
+
+
+# Sidecar protocol: every message is a 4-byte big-endian length and a payload.
+# A request is one JSON frame ({"op": "embed", "texts": [...], "query": bool}
+# or {"op": "stats"}); the reply is a JSON frame and, for embeddings that
+# succeeded, a second frame with the float32 vectors.
+FRAME_HEADER = struct.Struct(">I")
+
+
+def send_frame(sock: socket.socket, payload: bytes) -> None:
+    sock.sendall(FRAME_HEADER.pack(len(payload)) + payload)
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("Embedding sidecar closed the connection")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def recv_frame(sock: socket.socket) -> bytes:
+    (size,) = FRAME_HEADER.unpack(_recv_exact(sock, FRAME_HEADER.size))
+    return _recv_exact(sock, size)
+
+
+class SidecarEmbeddings(Embeddings):
+    """Client of the embedding sidecar (``embedding_sidecar.py``) over a Unix socket.
+
+    The model is loaded once in the sidecar, which micro-batches the requests
+    of every API worker together. Connections are pooled per client; a
+    request that fails on a pooled connection is retried once on a fresh one,
+    so a restarted sidecar is picked up without errors.
+    """
+
+    def __init__(self, socket_path: str, timeout: float = 60.0, max_idle_connections: int = 16) -> None:
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[socket.socket]" = queue.LifoQueue(maxsize=max_idle_connections)
+
+    def _connect(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        return sock
+
+    def _request(self, request: dict) -> tuple:
+        payload = json.dumps(request).encode("utf-8")
+        for attempt in range(2):
+            try:
+                sock = self._idle.get_nowait()
+                pooled = True
+            except queue.Empty:
+                sock = self._connect()
+                pooled = False
+            try:
+                send_frame(sock, payload)
+                reply = json.loads(recv_frame(sock))
+                body = recv_frame(sock) if "dim" in reply else b""
+            except (OSError, ConnectionError):
+                sock.close()
+                if pooled and attempt == 0:
+                    continue
+                raise
+            try:
+                self._idle.put_nowait(sock)
+            except queue.Full:
+                sock.close()
+            if "error" in reply:
+                raise RuntimeError(f"Embedding sidecar error: {reply['error']}")
+            return reply, body
+
+    def _embed(self, texts: List[str], query: bool) -> List[List[float]]:
+        reply, body = self._request({"op": "embed", "texts": texts, "query": query})
+        vectors = np.frombuffer(body, dtype=np.float32).reshape(reply["count"], reply["dim"])
+        return vectors.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self._embed(list(texts), query=False)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text], query=True)[0]
+
+    def wait_until_available(self, timeout: float = 300.0, interval: float = 1.0) -> None:
+        """Block until the sidecar answers; it may still be loading the model."""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self._request({"op": "stats"})
+                return
+            except OSError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(interval)
+
+    def stats(self) -> dict:
+        try:
+            reply, _ = self._request({"op": "stats"})
+        except Exception as e:
+            return {"sidecar": self.socket_path, "error": str(e)}
+        return {"sidecar": self.socket_path, **reply}
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
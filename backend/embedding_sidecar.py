@@ -0,0 +1,127 @@
+"""Embedding sidecar: hosts the embedding model once for every API worker.
+
+Listens on a Unix socket and serves ``SidecarEmbeddings`` clients (see
+``embedding_service.py`` for the protocol). Requests from all connections go
+through one ``MicroBatchingEmbeddings``, so concurrent queries from different
+uvicorn workers share model calls. The model and batching settings are read
+from the same environment variables as the API (``EMBEDDING_MODEL``,
+``EMBEDDING_BACKEND``, ``EMBEDDING_ONNX_FILE``, ``EMBED_MICRO_BATCH_SIZE``,
+``EMBED_MICRO_BATCH_WAIT_MS``).
+
+Usage (from ``backend/``)::
+
+    python embedding_sidecar.py --socket /run/embeddings/embeddings.sock
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from dotenv import load_dotenv
+
+from embedding_service import FRAME_HEADER, MicroBatchingEmbeddings, load_embedding_model
+
+load_dotenv()
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "BAAI/bge-m3")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE") or None
+EMBED_MICRO_BATCH_SIZE = int(os.getenv("EMBED_MICRO_BATCH_SIZE", "32"))
+EMBED_MICRO_BATCH_WAIT_MS = float(os.getenv("EMBED_MICRO_BATCH_WAIT_MS", "5"))
+# Same as models.N_DIM; not imported to keep the sidecar free of the database settings
+N_DIM = 1024
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> bytes:
+    (size,) = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+    return await reader.readexactly(size)
+
+
+def _write_frame(writer: asyncio.StreamWriter, payload: bytes) -> None:
+    writer.write(FRAME_HEADER.pack(len(payload)) + payload)
+
+
+class EmbeddingSidecar:
+    def __init__(self, embeddings: MicroBatchingEmbeddings, threads: int = 64) -> None:
+        self.embeddings = embeddings
+        # Callers block in the batcher until their batch is embedded, so each
+        # in-flight request holds a thread, not a model copy
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="sidecar")
+        self.connections = 0
+
+    async def _reply(self, request: dict, writer: asyncio.StreamWriter) -> None:
+        loop = asyncio.get_running_loop()
+        op = request.get("op")
+        if op == "stats":
+            reply = {"model": EMBEDDING_MODEL, "backend": EMBEDDING_BACKEND, "connections": self.connections}
+            _write_frame(writer, json.dumps({**reply, **self.embeddings.stats()}).encode("utf-8"))
+            return
+        if op != "embed":
+            _write_frame(writer, json.dumps({"error": f"unknown op {op!r}"}).encode("utf-8"))
+            return
+        texts = request.get("texts") or []
+        try:
+            if request.get("query") and len(texts) == 1:
+                vectors = [await loop.run_in_executor(self.executor, self.embeddings.embed_query, texts[0])]
+            else:
+                vectors = await loop.run_in_executor(self.executor, self.embeddings.embed_documents, texts)
+        except Exception as e:
+            _write_frame(writer, json.dumps({"error": str(e)}).encode("utf-8"))
+            return
+        array = np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1) if texts else np.zeros((0, 0), np.float32)
+        _write_frame(writer, json.dumps({"count": array.shape[0], "dim": array.shape[1]}).encode("utf-8"))
+        _write_frame(writer, array.tobytes())
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    request = json.loads(await _read_frame(reader))
+                except asyncio.IncompleteReadError:
+                    return
+                await self._reply(request, writer)
+                await writer.drain()
+        except (ConnectionError, ValueError) as e:
+            print(f"Embedding sidecar connection error: {e}")
+        finally:
+            self.connections -= 1
+            writer.close()
+
+
+async def serve(socket_path: str, threads: int) -> None:
+    start = time.perf_counter()
+    model = load_embedding_model(EMBEDDING_MODEL, EMBEDDING_BACKEND, onnx_file=EMBEDDING_ONNX_FILE, dimension=N_DIM)
+    embeddings = MicroBatchingEmbeddings(model, EMBED_MICRO_BATCH_SIZE, EMBED_MICRO_BATCH_WAIT_MS)
+    embeddings.embed_query("預熱")
+    print(f"Loaded embedding model {EMBEDDING_MODEL} ({EMBEDDING_BACKEND}) in {time.perf_counter() - start:.1f}s")
+
+    sidecar = EmbeddingSidecar(embeddings, threads=threads)
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    os.makedirs(os.path.dirname(os.path.abspath(socket_path)), exist_ok=True)
+    server = await asyncio.start_unix_server(sidecar.handle, path=socket_path)
+    print(f"Embedding sidecar listening on {socket_path}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    async with server:
+        await stop.wait()
+    embeddings.close()
+    sidecar.executor.shutdown(wait=False, cancel_futures=True)
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--socket", default=os.getenv("EMBEDDING_SIDECAR_SOCKET", "/run/embeddings/embeddings.sock"))
+    parser.add_argument("--threads", type=int, default=64)
+    args = parser.parse_args()
+    asyncio.run(serve(args.socket, args.threads))
@@ -0,0 +1,164 @@
+import multiprocessing
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator, List, Optional, TypeVar
+
+from langchain_core.documents import Document
+from langchain_text_splitters import TextSplitter
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+PDF_PARSE_WORKERS = int(os.getenv("PDF_PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+PAGES_PER_TASK = 8
+
+_parse_pool: Optional[ProcessPoolExecutor] = None
+_parse_pool_lock = threading.Lock()
+_parse_pool_closed = False
+
+
+def get_parse_pool() -> ProcessPoolExecutor:
+    """Process pool shared by every ingestion job, created on first use.
+
+    Workers are spawned, not forked: the pool is created from an executor
+    thread of a process that already runs other threads (torch, the event
+    loop) and holds pooled database sockets, none of which a child should
+    inherit.
+    """
+    global _parse_pool
+    if _parse_pool is None:
+        with _parse_pool_lock:
+            # An ingest thread still running at shutdown must not start a new pool
+            if _parse_pool_closed:
+                raise RuntimeError("PDF parse pool is shut down")
+            if _parse_pool is None:
+                _parse_pool = ProcessPoolExecutor(
+                    max_workers=PDF_PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+                )
+    return _parse_pool
+
+
+def shutdown_parse_pool() -> None:
+    """Cancel queued parse tasks and wait for the worker processes to exit."""
+    global _parse_pool, _parse_pool_closed
+    with _parse_pool_lock:
+        _parse_pool_closed = True
+        pool, _parse_pool = _parse_pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def pdf_page_count(file_path: str) -> int:
+    from pypdf import PdfReader
+
+    return len(PdfReader(file_path).pages)
+
+
+def _extract_pages(file_path: str, start: int, stop: int) -> List[str]:
+    # Runs in a worker process; each task opens the file itself so only the
+    # page texts cross the process boundary
+    from pypdf import PdfReader
+
+    reader = PdfReader(file_path)
+    return [reader.pages[i].extract_text() for i in range(start, stop)]
+
+
+def iter_pdf_pages(
+    file_path: str,
+    executor: Optional[Executor] = None,
+    pages_per_task: int = PAGES_PER_TASK,
+    max_in_flight: Optional[int] = None,
+) -> Iterator[Document]:
+    """Yield the pages of a PDF in order, parsed in parallel.
+
+    Pages are extracted in ranges of ``pages_per_task`` on ``executor``
+    (the shared process pool by default). At most ``max_in_flight`` ranges
+    are pending at a time, so memory does not grow with the size of the file.
+    """
+    executor = executor or get_parse_pool()
+    total = pdf_page_count(file_path)
+    max_in_flight = max_in_flight or PDF_PARSE_WORKERS * 2
+    ranges = iter(range(0, total, pages_per_task))
+    pending = deque()
+
+    def submit_next() -> None:
+        start = next(ranges, None)
+        if start is not None:
+            stop = min(start + pages_per_task, total)
+            pending.append((start, executor.submit(_extract_pages, file_path, start, stop)))
+
+    for _ in range(max_in_flight):
+        submit_next()
+    while pending:
+        start, future = pending.popleft()
+        texts = future.result()
+        submit_next()
+        for offset, text in enumerate(texts):
+            yield Document(
+                page_content=text,
+                metadata={"source": file_path, "page": start + offset, "total_pages": total},
+            )
+
+
+def normalize_text(text: str) -> str:
+    """Drop line breaks and spaces, which PDF extraction inserts inside CJK text."""
+    return text.replace("\n", "").replace(" ", "")
+
+
+def split_documents(documents: Iterable[Document], splitter: TextSplitter) -> Iterator[Document]:
+    for document in documents:
+        yield from splitter.split_documents([document])
+
+
+def normalize_documents(documents: Iterable[Document]) -> Iterator[Document]:
+    for document in documents:
+        document.page_content = normalize_text(document.page_content)
+        yield document
+
+
+def pipelined(
+    batches: Iterable[T],
+    prepare: Callable[[T], R],
+    write: Callable[[R], None],
+    depth: int = 1,
+) -> int:
+    """Run ``prepare`` on each batch and hand the results to ``write`` on a
+    separate thread, so preparing batch N+1 overlaps with writing batch N.
+
+    At most ``depth`` prepared batches wait for the writer. The first writer
+    error stops the pipeline and is re-raised. Returns the number of batches.
+    """
+    handoff: "queue.Queue" = queue.Queue(maxsize=depth)
+    done = object()
+    errors: List[BaseException] = []
+
+    def writer() -> None:
+        while True:
+            item = handoff.get()
+            if item is done:
+                return
+            if errors:
+                continue
+            try:
+                write(item)
+            except BaseException as e:
+                errors.append(e)
+
+    thread = threading.Thread(target=writer, name="ingest-writer", daemon=True)
+    thread.start()
+    count = 0
+    try:
+        for batch in batches:
+            if errors:
+                break
+            handoff.put(prepare(batch))
+            count += 1
+    finally:
+        handoff.put(done)
+        thread.join()
+    if errors:
+        raise errors[0]
+    return count
@@ -0,0 +1,201 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+
+from sqlalchemy import or_, update
+from sqlalchemy.orm import Session
+
+import models
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class JobProgress:
+    """Progress reporter handed to the ingestion function.
+
+    Counters are kept in memory and flushed to the job row at most every
+    ``flush_interval`` seconds; the flush also serves as the job heartbeat.
+    """
+
+    def __init__(self, queue: "IngestJobQueue", job_id: str, flush_interval: float = 1.0) -> None:
+        self.queue = queue
+        self.job_id = job_id
+        self.flush_interval = flush_interval
+        self.pages_total: Optional[int] = None
+        self.pages_processed = 0
+        self.chunks_processed = 0
+        self._last_flush = 0.0
+        self._lock = threading.Lock()
+
+    def update(self, pages_total: Optional[int] = None, pages: int = 0, chunks: int = 0) -> None:
+        with self._lock:
+            if pages_total is not None:
+                self.pages_total = pages_total
+            self.pages_processed += pages
+            self.chunks_processed += chunks
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            values = {
+                "pages_total": self.pages_total,
+                "pages_processed": self.pages_processed,
+                "chunks_processed": self.chunks_processed,
+            }
+            self._last_flush = time.monotonic()
+        self.queue._update(self.job_id, **values)
+
+
+IngestFunction = Callable[[models.IngestJob, JobProgress], Optional[str]]
+
+
+class IngestJobQueue:
+    """Durable ingestion queue backed by the ``ingest_jobs`` table.
+
+    Jobs are inserted as ``queued`` and executed by a bounded thread pool.
+    Workers claim a job with a conditional ``UPDATE`` so that, with several
+    uvicorn workers, each job runs once. ``resume_pending`` re-submits queued
+    jobs and running jobs whose heartbeat went stale, e.g. after a restart.
+    The uploaded file is deleted once its job has succeeded or failed; jobs
+    interrupted by a restart keep it for their next run.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        ingest: IngestFunction,
+        workers: int = 2,
+        stale_after_seconds: float = 300,
+    ) -> None:
+        self.session_factory = session_factory
+        self.ingest = ingest
+        self.stale_after_seconds = stale_after_seconds
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest")
+
+    def _update(self, job_id: str, **values) -> None:
+        values["updated_at"] = datetime.now(timezone.utc)
+        with self.session_factory() as db:
+            db.execute(update(models.IngestJob).where(models.IngestJob.id == job_id).values(**values))
+            db.commit()
+
+    def submit(self, session_id: str, file_name: str, file_path: str) -> str:
+        job = models.IngestJob(
+            id=str(uuid.uuid4()),
+            session_id=session_id,
+            file_name=file_name,
+            file_path=file_path,
+            status=QUEUED,
+        )
+        with self.session_factory() as db:
+            db.add(job)
+            db.commit()
+            job_id = job.id
+        self._executor.submit(self._run, job_id)
+        return job_id
+
+    def _claim(self, job_id: str) -> Optional[models.IngestJob]:
+        now = datetime.now(timezone.utc)
+        with self.session_factory() as db:
+            claimed = db.execute(
+                update(models.IngestJob)
+                .where(models.IngestJob.id == job_id, models.IngestJob.status == QUEUED)
+                .values(status=RUNNING, started_at=now, updated_at=now)
+            ).rowcount
+            db.commit()
+            if not claimed:
+                return None
+            job = db.get(models.IngestJob, job_id)
+            db.expunge(job)
+            return job
+
+    def _run(self, job_id: str) -> None:
+        job = self._claim(job_id)
+        if job is None:
+            return
+        progress = JobProgress(self, job_id)
+        try:
+            doc_hash = self.ingest(job, progress)
+        except Exception as e:
+            print(f"Ingest job {job_id} ({job.file_name}) failed: {e}")
+            progress.flush()
+            self._update(job_id, status=FAILED, error=str(e), finished_at=datetime.now(timezone.utc))
+            remove_upload(job.file_path)
+            return
+        progress.flush()
+        self._update(job_id, status=SUCCEEDED, doc_hash=doc_hash, finished_at=datetime.now(timezone.utc))
+        remove_upload(job.file_path)
+
+    def resume_pending(self) -> int:
+        stale = datetime.now(timezone.utc) - timedelta(seconds=self.stale_after_seconds)
+        with self.session_factory() as db:
+            rows = db.execute(
+                update(models.IngestJob)
+                .where(
+                    or_(
+                        models.IngestJob.status == QUEUED,
+                        (models.IngestJob.status == RUNNING) & (models.IngestJob.updated_at < stale),
+                    )
+                )
+                .values(status=QUEUED, updated_at=datetime.now(timezone.utc))
+                .returning(models.IngestJob.id)
+            ).all()
+            db.commit()
+        for (job_id,) in rows:
+            self._executor.submit(self._run, job_id)
+        return len(rows)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self.session_factory() as db:
+            job = db.get(models.IngestJob, job_id)
+            if job is None:
+                return None
+            return job_status(job)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def remove_upload(file_path: str) -> None:
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"Could not remove upload {file_path}: {e}")
+
+
+def _as_utc(value: datetime) -> datetime:
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+
+def job_status(job: models.IngestJob) -> dict:
+    elapsed = None
+    if job.started_at is not None:
+        end = _as_utc(job.finished_at) if job.finished_at else datetime.now(timezone.utc)
+        elapsed = max((end - _as_utc(job.started_at)).total_seconds(), 0.0)
+    return {
+        "id": job.id,
+        "session_id": job.session_id,
+        "file_name": job.file_name,
+        "status": job.status,
+        "pages_total": job.pages_total,
+        "pages_processed": job.pages_processed,
+        "chunks_processed": job.chunks_processed,
+        "doc_hash": job.doc_hash,
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "elapsed_seconds": elapsed,
+        "pages_per_second": job.pages_processed / elapsed if elapsed else None,
+        "chunks_per_second": job.chunks_processed / elapsed if elapsed else None,
+    }
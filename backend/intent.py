@@ -0,0 +1,164 @@
+import math
+import re
+import threading
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from concurrency import run_blocking
+from menu import MenuCatalog
+from query_context import QueryContext
+
+# Score band in which neither the lexical nor the embedding tier is trusted
+INTENT_LOW = 0.35
+INTENT_HIGH = 0.65
+
+_QUANTITY_RE = re.compile(r"([0-9０-９]+|[一二兩两三四五六七八九十]+)\s*(個|个|份|盒|碗|客|套)")
+_ORDER_RE = re.compile(r"訂餐|訂便當|點餐|我要|我想要|我需要|幫我訂|幫我點|給我|外帶|來一|來兩|加點")
+_QUESTION_RE = re.compile(r"嗎|\?|？|什麼|甚麼|怎麼|如何|為什麼|為何|多少|哪|是否|推薦|建議")
+_HEALTH_RE = re.compile(r"健康|營養|熱量|卡路里|疾病|慢性|血壓|血糖|糖尿病|膽固醇|肥胖|癌|運動|飲食習慣")
+
+ORDER_EXAMPLES = [
+    "我需要3個椒麻雞飯1個鱈魚排飯",
+    "我要訂兩份便當",
+    "幫我點一個雞腿飯",
+    "外帶三個排骨飯",
+    "我想訂餐",
+    "請給我一份鹽酥雞飯和一份焢肉飯",
+    "中午要訂十個便當送到公司",
+]
+OTHER_EXAMPLES = [
+    "吃太多鹽對健康有什麼影響？",
+    "糖尿病患者應該注意什麼飲食？",
+    "今天天氣如何",
+    "你們的營業時間是幾點",
+    "椒麻雞飯會辣嗎",
+    "推薦我健康的吃法",
+    "台灣慢性病的盛行率是多少",
+]
+
+
+@dataclass(frozen=True)
+class IntentResult:
+    """Outcome of the order-intent classifier.
+
+    ``score`` is the estimated probability that the message is an order,
+    ``confidence`` its distance from the undecided midpoint scaled to [0, 1],
+    and ``tier`` the stage that made the decision: ``lexical``, ``embedding``
+    or ``llm``. The LLM grader only answers yes or no, so its decisions have
+    neither a score nor a confidence (``None``).
+    """
+
+    is_order: bool
+    score: Optional[float]
+    tier: str
+
+    @property
+    def confidence(self) -> Optional[float]:
+        if self.score is None:
+            return None
+        return round(abs(self.score - 0.5) * 2, 3)
+
+    def to_dict(self) -> dict:
+        return {
+            "is_order": self.is_order,
+            "score": round(self.score, 3) if self.score is not None else None,
+            "confidence": self.confidence,
+            "tier": self.tier,
+        }
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class IntentClassifier:
+    """Tiered order-intent classifier placed in front of the LLM grader.
+
+    1. Lexical rules and menu-name hits, microseconds.
+    2. Nearest-centroid over bge-m3 vectors of labelled example messages.
+    3. The LLM grader, only for messages still inside ``[low, high]``.
+    """
+
+    def __init__(
+        self,
+        catalog: MenuCatalog,
+        embeddings: Embeddings,
+        llm_grader: Callable[[str], Awaitable[str]],
+        low: float = INTENT_LOW,
+        high: float = INTENT_HIGH,
+        order_examples: Sequence[str] = ORDER_EXAMPLES,
+        other_examples: Sequence[str] = OTHER_EXAMPLES,
+    ) -> None:
+        self.catalog = catalog
+        self.embeddings = embeddings
+        self.llm_grader = llm_grader
+        self.low = low
+        self.high = high
+        self.order_examples = list(order_examples)
+        self.other_examples = list(other_examples)
+        self._centroids: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+    def _decided(self, score: float) -> bool:
+        return score <= self.low or score >= self.high
+
+    def lexical_score(self, text: str) -> float:
+        if self.catalog.match(text) is not None:
+            return 1.0
+        score = 0.5
+        if self.catalog.snapshot.matcher.find_longest(text.lower()):
+            score += 0.2
+        if _QUANTITY_RE.search(text):
+            score += 0.2
+        if _ORDER_RE.search(text):
+            score += 0.2
+        if _QUESTION_RE.search(text):
+            score -= 0.2
+        if _HEALTH_RE.search(text):
+            score -= 0.3
+        return min(max(score, 0.0), 1.0)
+
+    def _get_centroids(self) -> np.ndarray:
+        if self._centroids is None:
+            with self._lock:
+                if self._centroids is None:
+                    vectors = self.embeddings.embed_documents(self.order_examples + self.other_examples)
+                    vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+                    split = len(self.order_examples)
+                    centroids = np.stack([vectors[:split].mean(axis=0), vectors[split:].mean(axis=0)])
+                    self._centroids = _normalize(centroids)
+        return self._centroids
+
+    def warm_up(self) -> None:
+        """Embed the example sentences now instead of on the first ambiguous query."""
+        self._get_centroids()
+
+    def embedding_score(self, embedding: List[float]) -> float:
+        query = _normalize(np.asarray(embedding, dtype=np.float32))
+        order_sim, other_sim = self._get_centroids() @ query
+        # Logistic over the similarity margin; bge-m3 margins are small, hence the slope
+        return 1 / (1 + math.exp(-20 * float(order_sim - other_sim)))
+
+    async def classify(self, text: str, query: Optional[QueryContext] = None) -> IntentResult:
+        """Classify ``text``; with ``query``, its shared embedding is reused."""
+        score = self.lexical_score(text)
+        if self._decided(score):
+            return IntentResult(score >= self.high, score, "lexical")
+
+        try:
+            if query is not None:
+                embedding = await query.aembedding()
+            else:
+                embedding = await run_blocking(self.embeddings.embed_query, text)
+            score = await run_blocking(self.embedding_score, embedding)
+            if self._decided(score):
+                return IntentResult(score >= self.high, score, "embedding")
+        except Exception as e:
+            print(f"Embedding intent tier failed, falling back to LLM: {e}")
+
+        is_order = await self.llm_grader(text) == "yes"
+        return IntentResult(is_order, None, "llm")
@@ -1,32 +1,58 @@
-from fastapi import FastAPI, HTTPException, Depends, File, UploadFile, Form
-from typing import Annotated, List, Dict, Optional
+from fastapi import FastAPI, HTTPException, Depends, File, UploadFile, Form, Query, Request, Response
+from typing import TYPE_CHECKING, Annotated, Any, List, Dict, Iterator, Optional
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from pydantic import BaseModel
-from database import SessionLocal, engine, DATABASE_URL
-from rag import RAGService
-from langchain_community.document_loaders import PyPDFLoader
+from pydantic import BaseModel, ValidationError
+from database import SessionLocal, engine
 import models
 import os
-import json
-from langchain_community.embeddings import OllamaEmbeddings
-from langchain_postgres.vectorstores import PGVector
 from fastapi.middleware.cors import CORSMiddleware
-from langchain_community.llms import Ollama
+from fastapi.responses import StreamingResponse
 from langchain_core.documents import Document
-from langchain_core.tools import tool
-from langchain_groq import ChatGroq
+from langchain_core.embeddings import Embeddings
 from langchain_core.output_parsers import JsonOutputParser
-from langchain.prompts import PromptTemplate
-from langchain_core.messages import HumanMessage
-from langchain_experimental.llms.ollama_functions import OllamaFunctions
-from langchain_core.runnables import RunnableLambda
-from langchain.text_splitter import CharacterTextSplitter
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain.retrievers import ParentDocumentRetriever
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from sql import SQLDocStore
+from langchain_core.prompts import PromptTemplate
+from langchain_text_splitters import CharacterTextSplitter, RecursiveCharacterTextSplitter
+from concurrency import run_blocking, shutdown_executor
+from pricing import QuantityDiscount, price_order
+from menu import MenuCatalog
+from intent import IntentClassifier, IntentResult
+from answer_cache import SemanticAnswerCache
+from embedding_cache import CachedEmbeddings, LazyEmbeddings
+from embedding_service import MicroBatchingEmbeddings, SidecarEmbeddings, cache_model_name, load_embedding_model
+from corpus import DocumentCorpus
+from sessions import ChatHistory, SessionRegistry, query_key
+from query_context import QueryContext
+from transactions import (
+    BULK_CONTENT_TYPES,
+    BulkInserter,
+    iter_records,
+    list_transactions,
+    record_rollups,
+    summarize,
+)
+from ingest_jobs import IngestJobQueue, JobProgress, remove_upload
+from ingest import iter_pdf_pages, normalize_documents, shutdown_parse_pool, split_documents
+from readiness import Readiness
+from schema import create_schema
+from vector_index import VECTOR_STORAGE, create_vector_indexes, install_search_params, search_params
+from vector_storage import quantized_search
 from dotenv import load_dotenv
 from pathlib import Path
+import datetime
+import json
+import threading
+import asyncio
+import time
+import traceback
+import uuid
+from functools import cached_property
+
+# langgraph, langchain_community, langchain_postgres and the model clients are
+# imported where they are first used, so importing this module stays fast
+if TYPE_CHECKING:
+    from langchain_postgres.vectorstores import PGVector
+    from rag import RAGService
 
 # Load environment variables
 load_dotenv()
@@ -34,10 +60,74 @@ load_dotenv()
 # Configuration
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://ollama:11434")
+BULK_DISCOUNT_MIN_QUANTITY = int(os.getenv("BULK_DISCOUNT_MIN_QUANTITY", "0"))
+BULK_DISCOUNT_PERCENT = int(os.getenv("BULK_DISCOUNT_PERCENT", "0"))
+MENU_REFRESH_INTERVAL = float(os.getenv("MENU_REFRESH_INTERVAL", "30"))
+# Intent scores inside [INTENT_LOW, INTENT_HIGH] are escalated to the next classifier tier
+INTENT_LOW = float(os.getenv("INTENT_LOW", "0.35"))
+INTENT_HIGH = float(os.getenv("INTENT_HIGH", "0.65"))
+GRADING_CONCURRENCY = int(os.getenv("GRADING_CONCURRENCY", "4"))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1024"))
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "BAAI/bge-m3")
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+# torch (fp32), torch-int8, onnx or onnx-int8; all keep the 1024-dimensional output
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE") or None
+EMBED_MICRO_BATCH_SIZE = int(os.getenv("EMBED_MICRO_BATCH_SIZE", "32"))
+EMBED_MICRO_BATCH_WAIT_MS = float(os.getenv("EMBED_MICRO_BATCH_WAIT_MS", "5"))
+# When set, the model is hosted by embedding_sidecar.py and shared by all workers
+EMBEDDING_SIDECAR_SOCKET = os.getenv("EMBEDDING_SIDECAR_SOCKET")
+SESSION_TTL = float(os.getenv("SESSION_TTL", "1800"))
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "500"))
+SESSION_MEMORY_BUDGET_MB = int(os.getenv("SESSION_MEMORY_BUDGET_MB", "0"))
+CHAT_HISTORY_LIMIT = int(os.getenv("CHAT_HISTORY_LIMIT", "50"))
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", "60"))
+HISTORY_WRITE_QUEUE_SIZE = int(os.getenv("HISTORY_WRITE_QUEUE_SIZE", "1000"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_JOB_STALE_SECONDS = float(os.getenv("INGEST_JOB_STALE_SECONDS", "300"))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+BULK_INSERT_BATCH_SIZE = int(os.getenv("BULK_INSERT_BATCH_SIZE", "1000"))
+BULK_MAX_REPORTED_ERRORS = 100
+# Schema creation is normally a separate step (``python schema.py``)
+CREATE_SCHEMA_ON_STARTUP = os.getenv("CREATE_SCHEMA_ON_STARTUP", "false").lower() in ("1", "true", "yes")
+# Also send one prompt to Ollama during warm-up so the model is resident before the first chat
+WARMUP_LLM = os.getenv("WARMUP_LLM", "false").lower() in ("1", "true", "yes")
+
+order_discounts = (
+    [QuantityDiscount("團購優惠", BULK_DISCOUNT_MIN_QUANTITY, BULK_DISCOUNT_PERCENT)]
+    if BULK_DISCOUNT_MIN_QUANTITY and BULK_DISCOUNT_PERCENT
+    else []
+)
+
+def load_embeddings() -> Embeddings:
+    start = time.perf_counter()
+    model = load_embedding_model(
+        EMBEDDING_MODEL, EMBEDDING_BACKEND, onnx_file=EMBEDDING_ONNX_FILE, dimension=models.N_DIM
+    )
+    print(f"Loaded embedding model {EMBEDDING_MODEL} ({EMBEDDING_BACKEND}) in {time.perf_counter() - start:.1f}s")
+    return model
 
 # Initialize Models & Embeddings (Stateless resources)
-huggingface_embedding = HuggingFaceEmbeddings(model_name="BAAI/bge-m3")
-llm = Ollama(model="llama3", base_url=OLLAMA_BASE_URL)
+# Concurrent embedding calls from all requests and ingestion jobs are merged
+# into micro-batches, in the sidecar if there is one. An in-process model is
+# loaded by the warm-up or on first use.
+if EMBEDDING_SIDECAR_SOCKET:
+    embedding_service = SidecarEmbeddings(EMBEDDING_SIDECAR_SOCKET)
+else:
+    embedding_service = MicroBatchingEmbeddings(
+        LazyEmbeddings(load_embeddings),
+        max_batch_size=EMBED_MICRO_BATCH_SIZE,
+        max_wait_ms=EMBED_MICRO_BATCH_WAIT_MS,
+    )
+# Every embedding call goes through the content-hash cache (LRU in front of Postgres)
+huggingface_embedding = CachedEmbeddings(
+    embedding_service,
+    SessionLocal,
+    model_name=cache_model_name(EMBEDDING_MODEL, EMBEDDING_BACKEND),
+    lru_size=EMBEDDING_CACHE_SIZE,
+)
 
 app = FastAPI(title="Meal Order RAG API")
 
@@ -48,7 +138,8 @@ app.add_middleware(
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=['*'],
-    allow_headers=['*']
+    allow_headers=['*'],
+    expose_headers=['X-Next-Cursor']
 )
 
 DATA_DIR = Path(__file__).resolve().parent / "data"
@@ -58,67 +149,145 @@ ALLOWED_CONTENT_TYPES = {"application/pdf"}
 # Text Splitters (Stateless)
 parent_splitter = RecursiveCharacterTextSplitter(chunk_size=300, chunk_overlap=100)
 child_splitter = RecursiveCharacterTextSplitter(chunk_size=100, chunk_overlap=30)
+page_splitter = CharacterTextSplitter(chunk_size=500, chunk_overlap=100, separator=' ')
+
+# Shared, content-addressed document corpus
+corpus = DocumentCorpus(
+    huggingface_embedding,
+    engine,
+    SessionLocal,
+    child_splitter=child_splitter,
+    parent_splitter=parent_splitter,
+    embed_batch_size=EMBED_BATCH_SIZE,
+)
+
+# RAG service holds no per-session state, so one instance is built on first use and shared
+_rag_service: Optional["RAGService"] = None
+_rag_service_lock = threading.Lock()
+
+def get_rag_service() -> "RAGService":
+    global _rag_service
+    if _rag_service is None:
+        with _rag_service_lock:
+            if _rag_service is None:
+                start = time.perf_counter()
+                from rag import RAGService
+
+                _rag_service = RAGService(
+                    groq_api_key=GROQ_API_KEY,
+                    tavily_api_key=os.getenv("TAVILY_API_KEY"),
+                    grading_concurrency=GRADING_CONCURRENCY,
+                )
+                session_manager.record_component_build("rag_service", time.perf_counter() - start)
+    return _rag_service
 
 # Session Management
 class SessionState:
     def __init__(self, session_id: str):
         self.session_id = session_id
-        self.chat_history: List[tuple[str, str]] = []
-        
-        # Initialize RAG Service
-        self.rag_service = RAGService(
-            groq_api_key=GROQ_API_KEY,
-            tavily_api_key=os.getenv("TAVILY_API_KEY")
-        )
+        self.chat_history = ChatHistory(CHAT_HISTORY_LIMIT)
         
-        # Initialize Vector Store
-        # Using a unique collection name for each session
-        self.vectorstore = PGVector(
+        # Documents live in the shared corpus; the session only keeps its grants.
+        # They are reloaded on every request (aget_session), since an upload
+        # handled by another worker changes them
+        self.doc_hashes: List[str] = []
+
+    @property
+    def rag_service(self) -> "RAGService":
+        return get_rag_service()
+
+    @cached_property
+    def user_query_vectorstore(self) -> "PGVector":
+        # Built on first use; shares the application's engine and connection pool
+        start = time.perf_counter()
+        from langchain_postgres.vectorstores import PGVector
+
+        vectorstore = PGVector(
             embeddings=huggingface_embedding,
-            collection_name=f"docs_{session_id}",
-            connection=DATABASE_URL,
+            collection_name=f"user_query_{self.session_id}",
+            connection=engine,
+            embedding_length=models.N_DIM,
             use_jsonb=True,
         )
-        
-        # Initialize User Query Vector Store (for memory)
-        self.user_query_vectorstore = PGVector(
-            embeddings=huggingface_embedding,
-            collection_name=f"user_query_{session_id}",
-            connection=DATABASE_URL,
-            use_jsonb=True,
+        session_manager.record_component_build("user_query_vectorstore", time.perf_counter() - start)
+        return vectorstore
+
+    def similar_queries(
+        self, embedding: List[float], k: int = 4, ef_search: Optional[int] = None
+    ) -> List[Document]:
+        with search_params(ef_search):
+            if VECTOR_STORAGE != "full":
+                vectorstore = self.user_query_vectorstore
+                collection = select(vectorstore.CollectionStore.uuid).where(
+                    vectorstore.CollectionStore.name == f"user_query_{self.session_id}"
+                )
+                where = [vectorstore.EmbeddingStore.collection_id == collection.scalar_subquery()]
+                with SessionLocal() as db:
+                    return quantized_search(db, vectorstore.EmbeddingStore, embedding, k, where)
+            return self.user_query_vectorstore.similarity_search_by_vector(embedding, k=k)
+
+    def remember_queries(self, queries: List[tuple[str, Optional[List[float]]]]) -> None:
+        # Keyed by query so a repeated question updates its row instead of adding one
+        keyed = {query_key(text): (text, embedding) for text, embedding in queries}
+        missing = [key for key, (_, embedding) in keyed.items() if embedding is None]
+        if missing:
+            vectors = huggingface_embedding.embed_documents([keyed[key][0] for key in missing])
+            for key, vector in zip(missing, vectors):
+                keyed[key] = (keyed[key][0], vector)
+        self.user_query_vectorstore.add_embeddings(
+            texts=[text for text, _ in keyed.values()],
+            embeddings=[embedding for _, embedding in keyed.values()],
+            metadatas=[{"session_id": self.session_id, "query_key": key} for key in keyed],
+            ids=list(keyed),
         )
 
-        # Initialize Doc Store for ParentDocumentRetriever
-        self.docstore = SQLDocStore(
-            connection_string=DATABASE_URL, 
-            collection_name=f"parent_docs_{session_id}"
-        )
-        
-        # Initialize Retriever
-        self.retriever = ParentDocumentRetriever(
-            vectorstore=self.vectorstore,
-            docstore=self.docstore,
-            child_splitter=child_splitter,
-            parent_splitter=parent_splitter,
-            search_kwargs={"k": 3},
-        )
+    def refresh_grants(self) -> None:
+        self.doc_hashes = corpus.granted(self.session_id)
 
-class SessionManager:
+    @property
+    def corpus_scope(self) -> str:
+        return DocumentCorpus.scope_key(self.doc_hashes)
+
+    def close(self) -> None:
+        # Drop lazily built components; pooled connections go back to the shared engine
+        self.__dict__.pop("user_query_vectorstore", None)
+        self.chat_history.clear()
+
+class SessionManager(SessionRegistry[SessionState]):
     def __init__(self):
-        self._sessions: Dict[str, SessionState] = {}
+        super().__init__(
+            SessionState,
+            ttl_seconds=SESSION_TTL,
+            max_sessions=MAX_SESSIONS,
+            memory_budget_bytes=SESSION_MEMORY_BUDGET_MB * 1024 * 1024,
+            on_evict=SessionState.close,
+        )
         
     def get_session(self, session_id: str) -> SessionState:
-        if session_id not in self._sessions:
-            self._sessions[session_id] = SessionState(session_id)
-        return self._sessions[session_id]
+        session = self.get(session_id)
+        # One indexed query per request keeps grants current across workers
+        session.refresh_grants()
+        return session
+
+    async def aget_session(self, session_id: str) -> SessionState:
+        return await run_blocking(self.get_session, session_id)
 
 session_manager = SessionManager()
 
+# Semantic answer cache shared by all sessions, scoped by vector-store collection
+answer_cache = SemanticAnswerCache(
+    threshold=ANSWER_CACHE_THRESHOLD,
+    ttl_seconds=ANSWER_CACHE_TTL,
+    max_entries=ANSWER_CACHE_MAX_ENTRIES,
+)
+# Answers generated from a retired document are stale in every collection
+corpus.on_retire = lambda doc_hash: answer_cache.invalidate_documents([doc_hash])
+
 # Pydantic Models
 class TransactionBase(BaseModel):
     amount: float
     category: str
-    date: str
+    date: datetime.date
 
 class Message(BaseModel):
     message: str
@@ -126,16 +295,35 @@ class Message(BaseModel):
 
 class TransactionModel(TransactionBase):
     id: int
+    # Rows whose legacy date was not an ISO date have no date, only date_legacy
+    date: Optional[datetime.date]
+    date_legacy: Optional[str] = None
+
+    class Config:
+        orm_mode = True
+
+class MenuItemBase(BaseModel):
+    name: str
+    price: int
+    aliases: List[str] = []
+    available: bool = True
+
+class MenuItemModel(MenuItemBase):
+    id: int
 
     class Config:
         orm_mode = True
 
 # Utility Functions
-def load_and_split_documents(filepath: str):
-    loader = PyPDFLoader(filepath)
-    documents = loader.load()
-    text_splitter = CharacterTextSplitter(chunk_size=500, chunk_overlap=100, separator=' ')
-    return text_splitter.split_documents(documents)
+def load_and_split_documents(filepath: str, progress: Optional[JobProgress] = None) -> Iterator[Document]:
+    # Pages are parsed in the shared process pool and split one at a time
+    def pages() -> Iterator[Document]:
+        for page in iter_pdf_pages(filepath):
+            if progress is not None:
+                progress.update(pages_total=page.metadata["total_pages"], pages=1)
+            yield page
+
+    return split_documents(pages(), page_splitter)
 
 def get_db():
     db = SessionLocal()
@@ -145,109 +333,348 @@ def get_db():
         db.close()
 
 db_dependency = Annotated[Session, Depends(get_db)]
-models.Base.metadata.create_all(bind=engine)
-
-def create_embedding_insert_db(file_name: str, retriever: ParentDocumentRetriever) -> None:
-    docs = load_and_split_documents(file_name)
-    for d in docs:
-        text = ''.join(d.page_content.split('\n'))
-        text = ''.join(text.split(' '))
-        d.page_content = text
-    retriever.add_documents(docs)
+# Applies VECTOR_EF_SEARCH / VECTOR_PROBES and per-search overrides to vector queries
+install_search_params(engine)
+
+# Menu catalog (loaded at startup, refreshed when menu_items changes)
+menu_catalog = MenuCatalog(SessionLocal)
+
+def load_normalized_documents(file_name: str, progress: Optional[JobProgress] = None) -> Iterator[Document]:
+    return normalize_documents(load_and_split_documents(file_name, progress))
+
+def create_embedding_insert_db(
+    file_name: str,
+    session_id: str,
+    display_name: Optional[str] = None,
+    progress: Optional[JobProgress] = None,
+) -> str:
+    # Files already in the corpus are only granted to the session, not re-embedded
+    doc_hash, _ = corpus.ingest(
+        file_name,
+        display_name or Path(file_name).name,
+        session_id,
+        lambda path: load_normalized_documents(path, progress),
+        progress=progress.update if progress is not None else None,
+    )
+    return doc_hash
+
+def run_ingest_job(job: models.IngestJob, progress: JobProgress) -> str:
+    # Every worker picks up the new grant on the session's next request; its
+    # cache scope changes with it, so answers for the old document set are not served
+    return create_embedding_insert_db(job.file_path, job.session_id, job.file_name, progress)
+
+# PDF ingestion runs on its own bounded pool, off the request path
+ingest_queue = IngestJobQueue(
+    SessionLocal,
+    run_ingest_job,
+    workers=INGEST_WORKERS,
+    stale_after_seconds=INGEST_JOB_STALE_SECONDS,
+)
 
 
 def resolve_session_id(session_id: Optional[str]) -> str:
     return session_id or "default"
 
-# Tools
-@tool
-def add(a: int, b: int) -> int:
-    """Adds a and b."""
-    return a + b
-
-@tool
-def multiply(a: int, b: int) -> int:
-    """Multiplies a and b."""
-    return a * b
-
-def grade_query(q: str) -> str:
-    prompt = PromptTemplate(
-        template="""<|begin_of_text|><|start_header_id|>system<|end_header_id|>你是一個評分者，你需要為使用者的問題進行打分給予'yes'或'no'問題只與訂餐或訂便當有關的給予'yes'無相關的給予'no'
+grade_query_prompt = PromptTemplate(
+    template="""<|begin_of_text|><|start_header_id|>system<|end_header_id|>你是一個評分者，你需要為使用者的問題進行打分給予'yes'或'no'問題只與訂餐或訂便當有關的給予'yes'無相關的給予'no'
         並且無需給予任何理由直接回傳JSON，裡面只能有score屬性。
         例如：我需要3個椒麻雞飯1個鱈魚排飯，請給yes。
         以下是使用者的問題:
         {question} 
         <|eot_id|><|start_header_id|>assistant<|end_header_id|>""",
-        input_variables=["question"],
-    )
-    answer_grader = prompt | llm | JsonOutputParser()
-    score = answer_grader.invoke({'question': q})
+    input_variables=["question"],
+)
+_query_grader: Optional[Any] = None
+_query_grader_lock = threading.Lock()
+
+def get_query_grader():
+    global _query_grader
+    if _query_grader is None:
+        with _query_grader_lock:
+            if _query_grader is None:
+                from langchain_community.llms import Ollama
+
+                llm = Ollama(model="llama3", base_url=OLLAMA_BASE_URL)
+                _query_grader = grade_query_prompt | llm | JsonOutputParser()
+    return _query_grader
+
+async def grade_query(q: str) -> str:
+    score = await get_query_grader().ainvoke({'question': q})
     return score['score']
 
-def parse_order(m: str) -> dict:
+intent_classifier = IntentClassifier(
+    menu_catalog, huggingface_embedding, grade_query, low=INTENT_LOW, high=INTENT_HIGH
+)
+
+async def parse_order(m: str) -> dict:
     if not GROQ_API_KEY:
         print("Warning: GROQ_API_KEY is not set.")
         return {}
 
+    from langchain_groq import ChatGroq
+
     groq_llm = ChatGroq(temperature=0, groq_api_key=GROQ_API_KEY, model_name="llama3-70b-8192")
 
     prompt = PromptTemplate(
         template="""<|begin_of_text|><|start_header_id|>system<|end_header_id|> 你是一個餐廳經理,你們餐廳提供以下菜單供顧客選擇
-                椒麻雞飯 價格100元,
-                炸排骨飯 價格120元,
-                炸雞腿飯 價格110元,
-                鱈魚排飯 價格118元,
-                炸紅糟肉飯 價格90元,
-                焢肉飯 價格90元,
-                玫瑰油雞飯 價格130元,
-                鹽酥雞飯  價格80元,
+                {menu}
                 你需要根據顧客的要求整理出JSON
                 例如：我需要3個椒麻雞飯1個鱈魚排飯
-                你需要整理出meal裡面包涵price, quantity的JSON
+                你需要整理出 {{"meal": [{{"name": "椒麻雞飯", "quantity": 3}}, {{"name": "鱈魚排飯", "quantity": 1}}]}}
+                name 必須是上面菜單裡的菜名，一字不差；quantity 必須是整數．不要提供價格，價格由系統計算．
                 如果顧客沒有提出任何根便當有關的需求，請回覆empty JSON．
                 現在根據上面的規則，提供以下敘述：
                 {question} 
-                Answer: 提供有著meal裡面包涵price, quantity的JSON
+                Answer: 提供有著meal裡面包涵name, quantity的JSON
                 <|eot_id|><|start_header_id|>assistant<|end_header_id|>
                 """,
-        input_variables=["question"],
+        input_variables=["question", "menu"],
     )
 
     custom_order_json_parser = prompt | groq_llm | JsonOutputParser()
-    result = custom_order_json_parser.invoke({"question": m})
+    result = await custom_order_json_parser.ainvoke({"question": m, "menu": menu_catalog.prompt_menu()})
     print(f"Order parsed: {result}")
     return result
 
-def create_text(order: dict) -> List[str]:
-    res = []
-    if 'meal' in order:
-        for item in order['meal']:
-            res.append(str(item['price']) + ' * ' + str(item['quantity']))
-    return res
+async def refresh_menu_periodically() -> None:
+    while True:
+        await asyncio.sleep(MENU_REFRESH_INTERVAL)
+        try:
+            await run_blocking(menu_catalog.refresh_if_changed)
+        except Exception as e:
+            print(f"Error refreshing menu catalog: {e}")
+
+# Queries waiting to be embedded into their session's query store
+history_writes: "asyncio.Queue[tuple[SessionState, QueryContext]]" = asyncio.Queue(maxsize=HISTORY_WRITE_QUEUE_SIZE)
+
+async def write_query_history() -> None:
+    while True:
+        batches: Dict[SessionState, List[tuple[str, Optional[List[float]]]]] = {}
+        session, query = await history_writes.get()
+        batches.setdefault(session, []).append((query.text, query.embedding))
+        # Drain whatever queued up meanwhile so each session is written in one call
+        while not history_writes.empty():
+            session, query = history_writes.get_nowait()
+            batches.setdefault(session, []).append((query.text, query.embedding))
+        for session, queries in batches.items():
+            try:
+                await run_blocking(session.remember_queries, queries)
+            except Exception as e:
+                print(f"Error indexing queries of {session.session_id}: {e}")
+
+async def evict_sessions_periodically() -> None:
+    while True:
+        await asyncio.sleep(SESSION_SWEEP_INTERVAL)
+        await run_blocking(session_manager.evict)
+
+# Heavy resources are loaded in the background after startup; /ready reports when they are
+readiness = Readiness(required=["embeddings", "intent", "corpus", "rag_service", "query_grader"])
+
+def warm_up_embeddings() -> None:
+    if isinstance(embedding_service, SidecarEmbeddings):
+        # The sidecar may be started alongside the API and still be loading
+        embedding_service.wait_until_available()
+    embedding_service.embed_query("預熱")
+
+def warm_up_steps() -> list:
+    steps = [
+        # Bypasses the embedding cache so the model really runs once
+        ("embeddings", warm_up_embeddings),
+        ("intent", intent_classifier.warm_up),
+        ("corpus", lambda: (corpus.vectorstore, corpus.docstore)),
+        # Indexes tables the stores have just created; never replaces or drops an existing index
+        ("vector_indexes", lambda: create_vector_indexes(engine, concurrently=True, retype=False)),
+        ("rag_service", get_rag_service),
+        ("query_grader", get_query_grader),
+    ]
+    if WARMUP_LLM:
+        steps.append(("llm", lambda: get_query_grader().invoke({"question": "我要一個便當"})))
+    return steps
 
 # Routes
+@app.on_event("startup")
+async def on_startup():
+    if CREATE_SCHEMA_ON_STARTUP:
+        await run_blocking(create_schema, engine)
+    await run_blocking(menu_catalog.seed_defaults)
+    await run_blocking(menu_catalog.load)
+    app.state.menu_refresh_task = asyncio.create_task(refresh_menu_periodically())
+    app.state.session_sweep_task = asyncio.create_task(evict_sessions_periodically())
+    app.state.history_write_task = asyncio.create_task(write_query_history())
+    resumed = await run_blocking(ingest_queue.resume_pending)
+    if resumed:
+        print(f"Resumed {resumed} pending ingest jobs")
+    app.state.warmup_task = asyncio.create_task(readiness.run(warm_up_steps()))
+
+@app.on_event("shutdown")
+def on_shutdown():
+    app.state.menu_refresh_task.cancel()
+    app.state.session_sweep_task.cancel()
+    app.state.history_write_task.cancel()
+    app.state.warmup_task.cancel()
+    ingest_queue.shutdown()
+    # After the ingest queue, so no job starts a new pool; waits for the parse processes to exit
+    shutdown_parse_pool()
+    embedding_service.close()
+    shutdown_executor()
+
+# Transaction routes use the blocking SQLAlchemy session, so they are plain
+# ``def`` handlers and run in FastAPI's threadpool instead of on the event loop.
 @app.post("/transactions/", response_model=TransactionModel)
-async def create_transaction(transaction: TransactionBase, db: db_dependency):
+def create_transaction(transaction: TransactionBase, db: db_dependency):
     db_transaction = models.Transcation(**transaction.model_dump())
     db.add(db_transaction)
+    record_rollups(db, [(transaction.date, transaction.category, transaction.amount)])
     db.commit()
     db.refresh(db_transaction)
     return db_transaction
 
+@app.post("/transactions/bulk")
+async def create_transactions_bulk(request: Request, db: db_dependency, atomic: bool = False):
+    """Insert many transactions from a JSON array, NDJSON or CSV body.
+
+    Rows are validated as the body streams in and written in batches inside
+    one database transaction. Invalid rows are skipped and reported, or with
+    ``atomic`` abort the whole request.
+    """
+    content_type = request.headers.get("content-type", "application/json").split(";")[0].strip().lower()
+    if content_type not in BULK_CONTENT_TYPES:
+        raise HTTPException(
+            status_code=415, detail=f"Content type must be one of {', '.join(BULK_CONTENT_TYPES)}"
+        )
+
+    inserter = BulkInserter(db)
+    errors = []
+    error_count = 0
+    batch = []
+    try:
+        async for row, record in iter_records(request.stream(), content_type):
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                batch.append(TransactionBase.model_validate(record).model_dump())
+            except (ValidationError, ValueError, TypeError) as e:
+                error_count += 1
+                if len(errors) < BULK_MAX_REPORTED_ERRORS:
+                    errors.append({"row": row, "error": str(e)})
+                continue
+            if len(batch) >= BULK_INSERT_BATCH_SIZE:
+                await run_blocking(inserter.write, batch)
+                batch = []
+        if atomic and error_count:
+            await run_blocking(inserter.rollback)
+        else:
+            await run_blocking(inserter.write, batch)
+            await run_blocking(inserter.commit)
+    except ValueError as e:
+        # A JSON body that is not an array of objects
+        await run_blocking(inserter.rollback)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception:
+        await run_blocking(inserter.rollback)
+        raise
+
+    return {
+        "inserted": inserter.inserted,
+        "first_id": inserter.first_id,
+        "last_id": inserter.last_id,
+        "error_count": error_count,
+        "errors": errors,
+    }
+
 @app.get("/transactions/", response_model=List[TransactionModel])
-async def read_transactions(db: db_dependency, skip: int = 0, limit: int = 100):
-    transactions = db.query(models.Transcation).offset(skip).limit(limit).all()
+def read_transactions(
+    db: db_dependency,
+    response: Response,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    start: Optional[datetime.date] = None,
+    end: Optional[datetime.date] = None,
+    category: Optional[str] = None,
+):
+    # Keyset pagination: pass the X-Next-Cursor header of a page as ``cursor``
+    # to get the next one; ``skip`` is only kept for older clients
+    try:
+        transactions, next_cursor = list_transactions(
+            db, limit=limit, cursor=cursor, start=start, end=end, category=category, skip=skip
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor {cursor!r}")
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return transactions
 
+@app.get("/transactions/summary")
+def read_transaction_summary(
+    db: db_dependency,
+    group_by: str = "category",
+    start: Optional[datetime.date] = None,
+    end: Optional[datetime.date] = None,
+    category: Optional[str] = None,
+    rollup: bool = True,
+):
+    try:
+        return summarize(db, group_by, start=start, end=end, category=category, use_rollup=rollup)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/ready")
+def read_readiness(response: Response):
+    # Liveness is any answer at all; readiness waits for the warm-up
+    status = readiness.status()
+    if not status["ready"]:
+        response.status_code = 503
+    return status
+
+@app.get("/metrics/sessions")
+def read_session_metrics():
+    return session_manager.metrics()
+
+@app.get("/cache/stats")
+def read_cache_stats():
+    return {
+        "answers": answer_cache.stats(),
+        "embeddings": huggingface_embedding.stats(),
+        "embedding_batches": embedding_service.stats(),
+    }
+
+@app.get("/menu/", response_model=List[MenuItemModel])
+def read_menu(db: db_dependency):
+    return db.query(models.MenuItem).order_by(models.MenuItem.id).all()
+
+@app.post("/menu/", response_model=MenuItemModel)
+def upsert_menu_item(item: MenuItemBase, db: db_dependency):
+    db_item = db.query(models.MenuItem).filter(models.MenuItem.name == item.name).first()
+    if db_item is None:
+        db_item = models.MenuItem(**item.model_dump())
+        db.add(db_item)
+    else:
+        for key, value in item.model_dump().items():
+            setattr(db_item, key, value)
+    db.commit()
+    db.refresh(db_item)
+    menu_catalog.load()
+    return db_item
+
+@app.delete("/menu/{item_id}")
+def delete_menu_item(item_id: int, db: db_dependency):
+    db_item = db.get(models.MenuItem, item_id)
+    if db_item is None:
+        raise HTTPException(status_code=404, detail=f"Menu item {item_id} not found")
+    db.delete(db_item)
+    db.commit()
+    menu_catalog.load()
+    return {"message": f"Deleted menu item {item_id}"}
+
 @app.post("/upload/")
 async def upload(
     files: List[UploadFile] = File(...),
     session_id: Optional[str] = Form(None)
 ):
     session_id = resolve_session_id(session_id)
-    session = session_manager.get_session(session_id)
     
-    uploaded_files = []
+    jobs = []
     for file in files:
         sanitized_name = file.filename.replace(" ", "-")
         if file.content_type not in ALLOWED_CONTENT_TYPES:
@@ -255,9 +682,10 @@ async def upload(
                 status_code=400,
                 detail=f"Unsupported file type for {sanitized_name}. Please upload PDF files.",
             )
+        # Unique on disk so a queued job never reads a later upload of the same name
+        file_path = DATA_DIR / f"{uuid.uuid4().hex}-{sanitized_name}"
         try:
             DATA_DIR.mkdir(parents=True, exist_ok=True)
-            file_path = DATA_DIR / sanitized_name
             print(f"Saving file to: {file_path}")
 
             bytes_written = 0
@@ -274,11 +702,13 @@ async def upload(
                         )
                     f.write(chunk)
 
-            create_embedding_insert_db(str(file_path), session.retriever)
-            uploaded_files.append(sanitized_name)
+            job_id = await run_blocking(ingest_queue.submit, session_id, sanitized_name, str(file_path))
+            jobs.append({"id": job_id, "file_name": sanitized_name})
         except HTTPException:
+            remove_upload(str(file_path))
             raise
         except Exception as e:
+            remove_upload(str(file_path))
             print(f"Error uploading {sanitized_name}: {e}")
             raise HTTPException(
                 status_code=500, detail=f"There was an error uploading {sanitized_name}"
@@ -286,110 +716,208 @@ async def upload(
         finally:
             await file.close()
 
-    return {"message": f"Successfully uploaded {uploaded_files}", "session_id": session_id}
+    return {
+        "message": f"Queued {[job['file_name'] for job in jobs]} for ingestion",
+        "jobs": jobs,
+        "session_id": session_id,
+    }
+
+@app.get("/upload/jobs/{job_id}")
+def read_ingest_job(job_id: str):
+    job = ingest_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Ingest job {job_id} not found")
+    return job
+
+def order_reply(intent: IntentResult, session_id: str, order: dict) -> dict:
+    quote = price_order(order, menu_catalog.prices, order_discounts)
+    print(f"Order quote: {quote.to_dict()}")
+    # A total is only quoted when every line matched a menu dish and quantity
+    if not quote.items or quote.unknown:
+        # Lines without a dish name are reported as their raw dict; only names are shown
+        unclear = "、".join(u for u in quote.unknown if not u.startswith("{")) or "您的餐點"
+        return {
+            "ai_message": f"抱歉，我無法確認 {unclear}，請告訴我菜單上的餐點名稱與數量．",
+            "order": None,
+            "unknown": quote.unknown,
+            "intent": intent.to_dict(),
+            "session_id": session_id,
+        }
+    return {
+        "ai_message": '您好總共需要跟您收 ＄' + str(quote.total),
+        "order": quote.to_dict(),
+        "intent": intent.to_dict(),
+        "session_id": session_id,
+    }
+
+async def parse_order_message(message: str) -> dict:
+    # Simple orders are parsed locally; the LLM only sees what the matcher cannot account for
+    return menu_catalog.match(message) or await parse_order(message)
+
+async def related_history(session: SessionState, query: QueryContext) -> List[tuple[str, str]]:
+    # Only turns still in the in-memory history can be replayed
+    if not session.chat_history:
+        return []
+
+    # Using session-specific user_query_vectorstore
+    # PGVector and SQLDocStore are sync-only here, so they run on the bounded executor
+    relative_query = await run_blocking(session.similar_queries, await query.aembedding(), k=4)
+
+    # Hits resolve to their turn through the query key; rows written before
+    # the key was stored in metadata fall back to hashing the text
+    for candidate in relative_query:
+        key = candidate.metadata.get("query_key") or query_key(candidate.page_content)
+        turn = session.chat_history.get(key)
+        if turn is not None:
+            return [turn]
+    return []
+
+async def cached_answer(session: SessionState, query: QueryContext, temp_history: List[tuple[str, str]]):
+    # Answers that depend on earlier turns are neither served from nor stored in the cache
+    if temp_history:
+        return None
+    # The cache is per worker and only sees this worker's retirements; grants
+    # are read per request, so they also reflect other workers' changes
+    cache_hit = answer_cache.lookup(await query.aembedding(), session.corpus_scope, session.doc_hashes)
+    if cache_hit:
+        print(f"Answer cache hit ({cache_hit.similarity:.3f}): {cache_hit.entry.question}")
+    return cache_hit
+
+async def retrieve_documents(session: SessionState, query: QueryContext) -> List[Document]:
+    # Retrieval is scoped to the documents granted to this session
+    embedding = await query.aembedding()
+    docs = await run_blocking(
+        corpus.get_relevant_documents, query.text, session.doc_hashes, embedding=embedding
+    )
+    if len(docs) == 0:
+        docs = await run_blocking(
+            corpus.similarity_search, query.text, session.doc_hashes, embedding=embedding
+        )
+    return docs
+
+def finish_turn(session: SessionState, query: QueryContext, ai_response: str) -> None:
+    # Update chat history
+    session.chat_history.append(query.text, ai_response)
+
+    # Storing the query (with the embedding computed for this request) happens
+    # after the reply, in write_query_history
+    try:
+        history_writes.put_nowait((session, query))
+    except asyncio.QueueFull:
+        print(f"Query history queue full, not indexing query of {session.session_id}")
 
 @app.post("/uploadMessage/")
 async def get_user_message(user_message: Message):
     print(f"Received message: {user_message.message}")
     session_id = resolve_session_id(user_message.session_id)
-    session = session_manager.get_session(session_id)
-    
-    history = session.chat_history
-    score = grade_query(user_message.message)
-    
-    if score == 'yes':
-        res = parse_order(user_message.message)
-        if res and res != {}:
-            model = OllamaFunctions(model="llama3", format="json", base_url=OLLAMA_BASE_URL)
-            model = model.bind_tools(
-                tools=[
-                    {
-                        "name": "add",
-                        "description": "Adds a and b",
-                        "parameters": {
-                            "type": "object",
-                            "properties": {
-                                "a": {"type": "int"},
-                                "b": {"type": "int"},
-                            },
-                            "required": ["a", "b"],
-                        },
-                    },
-                    {
-                        "name": "multiply",
-                        "description": "multiplies a and b",
-                        "parameters": {
-                            "type": "object",
-                            "properties": {
-                                "a": {"type": "int"},
-                                "b": {"type": "int"},
-                            },
-                            "required": ["a", "b"],
-                        },
-                    }
-                ]
-            )
-            functions = {"add": add, "multiply": multiply}
-            tool_output = 0
-            
-            for msg in create_text(res):
-                messages = [HumanMessage(content=msg)]
-                ai_msg = model.invoke(messages)
-                messages.append(ai_msg)
-                
-                if 'function_call' in ai_msg.additional_kwargs:
-                    function_call = ai_msg.additional_kwargs['function_call']
-                    print(f"Function call: {function_call}")
-                    
-                    arguments = json.loads(function_call['arguments'])
-                    function_name = function_call['name'].lower()
-                    
-                    if function_name == 'add':
-                        selected_tool = RunnableLambda(functions['add'])
-                    else:
-                        selected_tool = RunnableLambda(functions['multiply'])
-                    
-                    tool_output += int(selected_tool.invoke(arguments))
-                    print(f"Tool output: {tool_output}")
-            
-            return {"ai_message": '您好總共需要跟您收 ＄' + str(tool_output), "session_id": session_id} 
+    session = await session_manager.aget_session(session_id)
+    # The message is embedded at most once, on first use, for every lookup below
+    query = QueryContext(user_message.message, huggingface_embedding)
+
+    intent = await intent_classifier.classify(user_message.message, query)
+    print(f"Intent: {intent.to_dict()}")
+
+    if intent.is_order:
+        res = await parse_order_message(user_message.message)
+        if res:
+            return order_reply(intent, session_id, res)
     
     # Fallback to RAG
-    # Using session-specific retriever
-    docs = session.retriever.get_relevant_documents(user_message.message)
-    temp_history = []
-    
-    if len(docs) == 0:
-        docs = session.vectorstore.similarity_search(user_message.message)
-    
-    # Using session-specific user_query_vectorstore
-    relative_query = session.user_query_vectorstore.similarity_search(user_message.message, k=4)
-    
-    # Since vectorstore is now session-specific, we don't need to filter by session_id in metadata
-    if history and relative_query:
-        for candidate in relative_query:
-            # Metadata check redundant as collection is scoped, but keeping for safety if reusing objects
-            # candidate_session = candidate.metadata.get("session_id")
-            # if candidate_session and candidate_session != session_id:
-            #     continue
-            
-            for u, ai in reversed(history):
-                if str(candidate.page_content) == u:
-                    temp_history.append((u, ai))
-                    break
-            if temp_history:
-                break
+    temp_history = await related_history(session, query)
+    collection = session.corpus_scope
+    cache_hit = await cached_answer(session, query, temp_history)
+
+    if cache_hit:
+        ai_response = cache_hit.entry.answer
+    else:
+        docs = await retrieve_documents(session, query)
                 
-    # Use session.rag_service
-    # rag_service.run expects (message, documents, chat_history)
-    ai_response = session.rag_service.run(user_message.message, docs, temp_history)
-    
-    # Update user query history
-    session.user_query_vectorstore.add_documents(
-        [Document(page_content=user_message.message, metadata={"session_id": session_id})]
-    )
+        # Use session.rag_service
+        # rag_service.arun expects (message, documents, chat_history)
+        ai_response = await session.rag_service.arun(user_message.message, docs, temp_history)
+        if not temp_history:
+            answer_cache.store(user_message.message, query.embedding, ai_response, collection, docs)
     
-    # Update chat history
-    session.chat_history.append((user_message.message, ai_response))
+    finish_turn(session, query, ai_response)
     
     return {"ai_message": ai_response, "session_id": session_id}
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+@app.post("/uploadMessage/stream")
+async def stream_user_message(user_message: Message):
+    """Server-Sent Events variant of ``/uploadMessage/``.
+
+    Emits ``stage`` events as the pipeline progresses, ``token`` events while
+    the answer is generated and a final ``result`` event carrying the same
+    body as ``/uploadMessage/`` plus the verification outcome. A failure
+    part-way is reported as an ``error`` event followed by a ``result`` with
+    ``error: true``.
+    """
+    print(f"Received message (stream): {user_message.message}")
+    session_id = resolve_session_id(user_message.session_id)
+
+    async def events():
+        try:
+            async for event in pipeline_events():
+                yield event
+        except Exception as e:
+            # A terminal event, so the client can tell a failure from a dropped connection
+            print(f"Error streaming reply to {session_id}: {e!r}")
+            traceback.print_exc()
+            yield sse_event("error", {"message": "Failed to generate a reply"})
+            yield sse_event("result", {"ai_message": None, "session_id": session_id, "error": True})
+
+    async def pipeline_events():
+        message = user_message.message
+        session = await session_manager.aget_session(session_id)
+        query = QueryContext(message, huggingface_embedding)
+
+        yield sse_event("stage", {"stage": "intent", "status": "start"})
+        intent = await intent_classifier.classify(message, query)
+        yield sse_event("stage", {"stage": "intent", "status": "end", "intent": intent.to_dict()})
+        if intent.is_order:
+            res = await parse_order_message(message)
+            if res:
+                yield sse_event("result", order_reply(intent, session_id, res))
+                return
+
+        yield sse_event("stage", {"stage": "retrieval", "status": "start"})
+        temp_history = await related_history(session, query)
+        collection = session.corpus_scope
+        cache_hit = await cached_answer(session, query, temp_history)
+        if cache_hit:
+            ai_response = cache_hit.entry.answer
+            yield sse_event("stage", {"stage": "retrieval", "status": "end", "cached": True})
+            yield sse_event("token", {"text": ai_response})
+            finish_turn(session, query, ai_response)
+            yield sse_event("result", {"ai_message": ai_response, "session_id": session_id, "cached": True})
+            return
+
+        docs = await retrieve_documents(session, query)
+        yield sse_event("stage", {"stage": "retrieval", "status": "end", "documents": len(docs)})
+
+        ai_response = ""
+        verification = None
+        async for event in session.rag_service.astream(message, docs, temp_history):
+            kind = event.pop("event")
+            if kind == "result":
+                ai_response = event["answer"]
+                verification = event["verification"]
+            else:
+                yield sse_event(kind, event)
+
+        if not temp_history:
+            answer_cache.store(message, query.embedding, ai_response, collection, docs)
+        finish_turn(session, query, ai_response)
+        yield sse_event(
+            "result",
+            {"ai_message": ai_response, "session_id": session_id, "verification": verification},
+        )
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
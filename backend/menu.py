@@ -0,0 +1,288 @@
+import re
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+import models
+from pricing import MENU_PRICES
+
+# Aliases seeded together with ``pricing.MENU_PRICES`` when ``menu_items`` is empty
+DEFAULT_MENU_ALIASES: Dict[str, List[str]] = {
+    "椒麻雞飯": ["椒麻雞", "椒麻雞便當"],
+    "炸排骨飯": ["排骨飯", "炸排骨", "排骨便當"],
+    "炸雞腿飯": ["雞腿飯", "炸雞腿", "雞腿便當"],
+    "鱈魚排飯": ["鱈魚飯", "鱈魚排", "鱈魚便當"],
+    "炸紅糟肉飯": ["紅糟肉飯", "紅糟肉"],
+    "焢肉飯": ["控肉飯", "爌肉飯", "焢肉"],
+    "玫瑰油雞飯": ["油雞飯", "玫瑰油雞"],
+    "鹽酥雞飯": ["鹽酥雞"],
+}
+
+_FULLWIDTH_DIGITS = str.maketrans("０１２３４５６７８９ｘＸ＊", "0123456789xx*")
+
+_CHINESE_DIGITS = {
+    "零": 0, "〇": 0, "一": 1, "二": 2, "兩": 2, "两": 2, "三": 3, "四": 4,
+    "五": 5, "六": 6, "七": 7, "八": 8, "九": 9,
+}
+_CHINESE_UNITS = {"十": 10, "百": 100}
+
+_QUANTITY_RE = re.compile(
+    r"[x×*]?\s*(?P<number>[0-9]+|[零〇一二兩两三四五六七八九十百]+)\s*(?:個|个|份|盒|碗|客|套|組|组)?"
+)
+
+# Words that carry no order information; a message made only of dishes,
+# quantities and these words is fully accounted for by the matcher.
+_FILLER_WORDS = sorted(
+    [
+        "我", "們", "要", "想", "需要", "想要", "訂", "點", "買", "來", "給", "請", "幫",
+        "麻煩", "一下", "再", "還", "還有", "加", "和", "跟", "與", "及", "以及", "另外",
+        "外帶", "內用", "便當", "餐", "謝謝", "感謝", "你", "了", "的", "好", "喔", "哦",
+        "吧", "呢", "唷", "一起", "總共", "就", "先", "這樣", "老闆", "您好", "你好",
+    ],
+    key=len,
+    reverse=True,
+)
+_FILLER_RE = re.compile("|".join(map(re.escape, _FILLER_WORDS)) + r"|[\s,，、。.!！~～;；:：+&]")
+
+
+def parse_chinese_number(text: str) -> Optional[int]:
+    """Parse an arabic or Chinese numeral such as ``3``, ``兩``, ``十二`` or ``二十``.
+
+    A digit right after a unit counts in the next lower place, as in speech
+    (``一百二`` is 120); ``零`` keeps it in the ones place. Anything else,
+    such as two digits in a row, is not a numeral.
+
+    >>> parse_chinese_number("十二"), parse_chinese_number("二十三"), parse_chinese_number("兩百")
+    (12, 23, 200)
+    >>> parse_chinese_number("一百二"), parse_chinese_number("一百零二"), parse_chinese_number("三百五十")
+    (120, 102, 350)
+    >>> parse_chinese_number("二二") is None
+    True
+    """
+    if text.isdigit():
+        return int(text)
+    total = 0
+    current: Optional[int] = None
+    scale = 1
+    # Place value of the unit just before, if the previous character was one
+    last_unit: Optional[int] = None
+    for char in text:
+        if char in ("零", "〇") and total and current is None:
+            last_unit = None
+        elif char in _CHINESE_DIGITS:
+            if current is not None:
+                return None
+            current = _CHINESE_DIGITS[char]
+            scale = last_unit // 10 if last_unit else 1
+            last_unit = None
+        elif char in _CHINESE_UNITS:
+            total += (1 if current is None else current) * _CHINESE_UNITS[char]
+            current = None
+            last_unit = _CHINESE_UNITS[char]
+        else:
+            return None
+    return total + (current or 0) * scale
+
+
+def parse_quantity(text: str) -> Optional[int]:
+    """Return the quantity if ``text`` is exactly one quantity expression (``3個``, ``兩份``, ``x2``)."""
+    match = _QUANTITY_RE.fullmatch(text)
+    if not match:
+        return None
+    return parse_chinese_number(match.group("number"))
+
+
+class AhoCorasick:
+    """Aho-Corasick automaton mapping every keyword to a payload."""
+
+    def __init__(self, keywords: Iterable[Tuple[str, str]]) -> None:
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[Tuple[int, str]]] = [[]]
+        for keyword, payload in keywords:
+            if keyword:
+                self._add(keyword, payload)
+        self._build()
+
+    def _add(self, keyword: str, payload: str) -> None:
+        state = 0
+        for char in keyword:
+            nxt = self._goto[state].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = nxt
+        self._output[state].append((len(keyword), payload))
+
+    def _build(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(char, 0)
+                self._output[nxt].extend(self._output[self._fail[nxt]])
+
+    def iter_matches(self, text: str) -> Iterable[Tuple[int, int, str]]:
+        """Yield ``(start, end, payload)`` for every keyword occurrence in ``text``."""
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for length, payload in self._output[state]:
+                yield index + 1 - length, index + 1, payload
+
+    def find_longest(self, text: str) -> List[Tuple[int, int, str]]:
+        """Leftmost-longest, non-overlapping matches."""
+        matches = sorted(self.iter_matches(text), key=lambda m: (m[0], -(m[1] - m[0])))
+        selected: List[Tuple[int, int, str]] = []
+        position = 0
+        for start, end, payload in matches:
+            if start >= position:
+                selected.append((start, end, payload))
+                position = end
+        return selected
+
+
+@dataclass(frozen=True)
+class MenuSnapshot:
+    prices: Dict[str, int]
+    aliases: Dict[str, List[str]]
+    matcher: AhoCorasick
+    fingerprint: Tuple = field(default=())
+
+
+def _build_snapshot(items: Dict[str, Tuple[int, List[str]]], fingerprint: Tuple = ()) -> MenuSnapshot:
+    keywords = []
+    for name, (_, aliases) in items.items():
+        keywords.append((name, name))
+        keywords.extend((alias.translate(_FULLWIDTH_DIGITS).lower(), name) for alias in aliases)
+    return MenuSnapshot(
+        prices={name: price for name, (price, _) in items.items()},
+        aliases={name: list(aliases) for name, (_, aliases) in items.items()},
+        matcher=AhoCorasick(keywords),
+        fingerprint=fingerprint,
+    )
+
+
+def match_order(text: str, snapshot: MenuSnapshot) -> Optional[dict]:
+    """Parse an order such as ``3個椒麻雞飯1個鱈魚排飯`` without an LLM.
+
+    Returns the same ``{"meal": [{"name", "price", "quantity"}]}`` shape as the
+    LLM order parser, or ``None`` when the message contains anything other than
+    dishes, quantities and filler words, so the caller can fall back to the LLM.
+    Quantities are read either before every dish (``3個椒麻雞飯``) or after
+    every dish (``椒麻雞飯3個``), decided by whether the message starts with one.
+    """
+    normalized = text.translate(_FULLWIDTH_DIGITS).lower()
+    dishes = snapshot.matcher.find_longest(normalized)
+    if not dishes:
+        return None
+
+    gaps: List[Optional[int]] = []
+    position = 0
+    for start, end, _ in dishes + [(len(normalized), len(normalized), "")]:
+        leftover = _FILLER_RE.sub("", normalized[position:start])
+        if not leftover:
+            gaps.append(None)
+        else:
+            quantity = parse_quantity(leftover)
+            if quantity is None:
+                return None
+            gaps.append(quantity)
+        position = end
+
+    if gaps[0] is not None:
+        # Quantities precede dishes, nothing may follow the last dish
+        if gaps[-1] is not None:
+            return None
+        quantities = gaps[:-1]
+    else:
+        quantities = gaps[1:]
+
+    totals: Dict[str, int] = {}
+    for (_, _, name), quantity in zip(dishes, quantities):
+        totals[name] = totals.get(name, 0) + (1 if quantity is None else quantity)
+    if any(quantity <= 0 for quantity in totals.values()):
+        return None
+    return {
+        "meal": [
+            {"name": name, "price": snapshot.prices[name], "quantity": quantity}
+            for name, quantity in totals.items()
+        ]
+    }
+
+
+class MenuCatalog:
+    """In-memory view of the ``menu_items`` table.
+
+    The snapshot is rebuilt on ``load`` and swapped atomically, so readers on
+    the request path never touch the database. ``refresh_if_changed`` compares
+    a cheap ``count``/``max(updated_at)`` fingerprint and is meant to be polled
+    from a background task.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session]) -> None:
+        self._session_factory = session_factory
+        self._lock = threading.Lock()
+        self._snapshot = _build_snapshot(
+            {name: (price, DEFAULT_MENU_ALIASES.get(name, [])) for name, price in MENU_PRICES.items()}
+        )
+
+    @property
+    def snapshot(self) -> MenuSnapshot:
+        return self._snapshot
+
+    @property
+    def prices(self) -> Dict[str, int]:
+        return self._snapshot.prices
+
+    def _fingerprint(self, db: Session) -> Tuple:
+        return tuple(
+            db.query(func.count(models.MenuItem.id), func.max(models.MenuItem.updated_at)).one()
+        )
+
+    def seed_defaults(self) -> None:
+        with self._session_factory() as db:
+            if db.query(models.MenuItem.id).first() is not None:
+                return
+            db.add_all(
+                models.MenuItem(name=name, price=price, aliases=DEFAULT_MENU_ALIASES.get(name, []))
+                for name, price in MENU_PRICES.items()
+            )
+            db.commit()
+
+    def load(self) -> MenuSnapshot:
+        with self._lock, self._session_factory() as db:
+            fingerprint = self._fingerprint(db)
+            rows = db.query(models.MenuItem).filter(models.MenuItem.available.is_(True)).all()
+            items = {row.name: (row.price, list(row.aliases or [])) for row in rows}
+            self._snapshot = _build_snapshot(items, fingerprint)
+        print(f"Menu catalog loaded: {len(items)} items")
+        return self._snapshot
+
+    def refresh_if_changed(self) -> bool:
+        with self._session_factory() as db:
+            fingerprint = self._fingerprint(db)
+        if fingerprint == self._snapshot.fingerprint:
+            return False
+        self.load()
+        return True
+
+    def match(self, text: str) -> Optional[dict]:
+        return match_order(text, self._snapshot)
+
+    def prompt_menu(self) -> str:
+        return "\n".join(f"{name} 價格{price}元," for name, price in self._snapshot.prices.items())
+
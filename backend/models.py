@@ -1,5 +1,5 @@
 from database import Base
-from sqlalchemy import Column, Integer, String, Float, Boolean
+from sqlalchemy import Column, Integer, String, Float, Boolean, Date, DateTime, JSON, ForeignKey, Index, func
 from pgvector.sqlalchemy import Vector
 
 N_DIM = 1024
@@ -9,7 +9,21 @@ class Transcation(Base):
     id = Column(Integer, primary_key=True, index=True)
     amount = Column(Float)
     category = Column(String)
-    date = Column(String)
+    date = Column(Date)
+    # Original text of dates that were not ISO dates when the column became DATE
+    date_legacy = Column(String)
+    __table_args__ = (
+        Index('ix_transcations_date', 'date'),
+        Index('ix_transcations_category_date', 'category', 'date'),
+    )
+
+class TransactionRollup(Base):
+    # Per-day, per-category totals, updated in the same transaction as each insert
+    __tablename__ = 'transaction_rollups'
+    day = Column(Date, primary_key=True)
+    category = Column(String, primary_key=True)
+    total = Column(Float, nullable=False, default=0)
+    count = Column(Integer, nullable=False, default=0)
 
 class TextEmbedding(Base):
     __tablename__ = 'text_embeddings'
@@ -20,4 +34,65 @@ class Message(Base):
     __tablename__ = 'user_message'
     id = Column(Integer, primary_key=True, autoincrement=True)
     is_user = Column(Boolean)
-    content = Column(String)
\ No newline at end of file
+    content = Column(String)
+
+class MenuItem(Base):
+    __tablename__ = 'menu_items'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String, unique=True, nullable=False)
+    price = Column(Integer, nullable=False)
+    aliases = Column(JSON, nullable=False, default=list)
+    available = Column(Boolean, nullable=False, default=True)
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
+
+class EmbeddingCache(Base):
+    __tablename__ = 'embedding_cache'
+    model = Column(String, primary_key=True)
+    text_hash = Column(String(64), primary_key=True)
+    # No fixed dimension so cached vectors of other models fit too
+    embedding = Column(Vector(), nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+class CorpusDocument(Base):
+    __tablename__ = 'corpus_documents'
+    doc_hash = Column(String(64), primary_key=True)
+    file_name = Column(String, nullable=False)
+    parent_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+class SessionDocument(Base):
+    __tablename__ = 'session_documents'
+    session_id = Column(String, primary_key=True)
+    doc_hash = Column(String(64), ForeignKey('corpus_documents.doc_hash', ondelete='CASCADE'), primary_key=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+class CorpusPage(Base):
+    __tablename__ = 'corpus_pages'
+    doc_hash = Column(String(64), ForeignKey('corpus_documents.doc_hash', ondelete='CASCADE'), primary_key=True)
+    page_number = Column(Integer, primary_key=True)
+    page_hash = Column(String(64), nullable=False)
+    # IDs of the page's parent chunks; child chunks reference them as ``doc_id``
+    parent_ids = Column(JSON, nullable=False, default=list)
+
+class SessionFile(Base):
+    __tablename__ = 'session_files'
+    session_id = Column(String, primary_key=True)
+    file_name = Column(String, primary_key=True)
+    doc_hash = Column(String(64), ForeignKey('corpus_documents.doc_hash', ondelete='CASCADE'), nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
+
+class IngestJob(Base):
+    __tablename__ = 'ingest_jobs'
+    id = Column(String(36), primary_key=True)
+    session_id = Column(String, nullable=False, index=True)
+    file_name = Column(String, nullable=False)
+    file_path = Column(String, nullable=False)
+    status = Column(String, nullable=False, index=True)
+    pages_total = Column(Integer)
+    pages_processed = Column(Integer, nullable=False, default=0)
+    chunks_processed = Column(Integer, nullable=False, default=0)
+    doc_hash = Column(String(64))
+    error = Column(String)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    started_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True))
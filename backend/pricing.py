@@ -0,0 +1,136 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Mapping, Optional, Sequence
+
+# Default menu, used to seed ``menu_items``. Prices are whole NT dollars; all
+# arithmetic below stays in ints so totals are exact.
+MENU_PRICES: Dict[str, int] = {
+    "椒麻雞飯": 100,
+    "炸排骨飯": 120,
+    "炸雞腿飯": 110,
+    "鱈魚排飯": 118,
+    "炸紅糟肉飯": 90,
+    "焢肉飯": 90,
+    "玫瑰油雞飯": 130,
+    "鹽酥雞飯": 80,
+}
+
+# Keys the order parser has been seen to use for the dish name
+_NAME_KEYS = ("name", "meal", "item", "dish")
+
+
+@dataclass(frozen=True)
+class LineItem:
+    meal: str
+    unit_price: int
+    quantity: int
+
+    @property
+    def total(self) -> int:
+        return self.unit_price * self.quantity
+
+
+@dataclass(frozen=True)
+class AppliedDiscount:
+    name: str
+    amount: int
+
+
+@dataclass(frozen=True)
+class QuantityDiscount:
+    """Take ``percent_off`` percent off the subtotal once ``min_quantity`` meals are ordered.
+
+    The discount is rounded down to a whole dollar so the customer is never
+    charged a fractional amount.
+    """
+
+    name: str
+    min_quantity: int
+    percent_off: int
+
+    def apply(self, items: Sequence[LineItem], subtotal: int) -> Optional[AppliedDiscount]:
+        if sum(item.quantity for item in items) < self.min_quantity:
+            return None
+        return AppliedDiscount(self.name, subtotal * self.percent_off // 100)
+
+
+@dataclass(frozen=True)
+class OrderQuote:
+    items: List[LineItem]
+    discounts: List[AppliedDiscount] = field(default_factory=list)
+    unknown: List[str] = field(default_factory=list)
+
+    @property
+    def subtotal(self) -> int:
+        return sum(item.total for item in self.items)
+
+    @property
+    def total(self) -> int:
+        return max(self.subtotal - sum(d.amount for d in self.discounts), 0)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "items": [
+                {
+                    "meal": item.meal,
+                    "unit_price": item.unit_price,
+                    "quantity": item.quantity,
+                    "total": item.total,
+                }
+                for item in self.items
+            ],
+            "subtotal": self.subtotal,
+            "discounts": [{"name": d.name, "amount": d.amount} for d in self.discounts],
+            "total": self.total,
+            "unknown": self.unknown,
+        }
+
+
+def _to_int(value: Any) -> Optional[int]:
+    try:
+        return int(str(value).strip().rstrip("元"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _iter_order_lines(order: Mapping[str, Any]):
+    """Yield ``(name, line)`` pairs from the shapes the order parser returns.
+
+    ``meal`` is either a list of ``{"name", "price", "quantity"}`` dicts or a
+    mapping of dish name to ``{"price", "quantity"}``.
+    """
+    meals = order.get("meal") or []
+    if isinstance(meals, Mapping):
+        for name, line in meals.items():
+            yield name, line if isinstance(line, Mapping) else {"quantity": line}
+        return
+    for line in meals:
+        if not isinstance(line, Mapping):
+            continue
+        name = next((line[k] for k in _NAME_KEYS if isinstance(line.get(k), str)), None)
+        yield name, line
+
+
+def price_order(
+    order: Mapping[str, Any],
+    prices: Mapping[str, int] = MENU_PRICES,
+    discounts: Sequence[QuantityDiscount] = (),
+) -> OrderQuote:
+    """Price a parsed order against the menu price table.
+
+    Unit prices come only from ``prices``; any price in the parsed order is
+    ignored. Dishes the table does not know, and lines without a positive
+    quantity, are reported in ``OrderQuote.unknown`` instead of being charged.
+    """
+    items: List[LineItem] = []
+    unknown: List[str] = []
+    for name, line in _iter_order_lines(order):
+        quantity = _to_int(line.get("quantity", 1))
+        unit_price = prices.get(name) if name else None
+        if unit_price is None or not quantity or quantity < 0:
+            unknown.append(name or str(dict(line)))
+            continue
+        items.append(LineItem(meal=name or "", unit_price=unit_price, quantity=quantity))
+
+    subtotal = sum(item.total for item in items)
+    applied = [d for d in (rule.apply(items, subtotal) for rule in discounts) if d and d.amount]
+    return OrderQuote(items=items, discounts=applied, unknown=unknown)
@@ -0,0 +1,33 @@
+import asyncio
+from typing import List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from concurrency import run_blocking
+
+
+class QueryContext:
+    """Per-request state of a chat query.
+
+    The query embedding is computed on first use and then shared by every
+    consumer in the request (intent tier, history lookup, answer cache,
+    retrieval and the history write), so the model runs at most once.
+    """
+
+    def __init__(self, text: str, embeddings: Embeddings) -> None:
+        self.text = text
+        self.embeddings = embeddings
+        self._embedding: Optional[List[float]] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def embedding(self) -> Optional[List[float]]:
+        """The embedding if it has been computed, without computing it."""
+        return self._embedding
+
+    async def aembedding(self) -> List[float]:
+        if self._embedding is None:
+            async with self._lock:
+                if self._embedding is None:
+                    self._embedding = await run_blocking(self.embeddings.embed_query, self.text)
+        return self._embedding
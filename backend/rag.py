@@ -1,11 +1,14 @@
+import asyncio
 import os
+import time
 from pprint import pprint
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional, Tuple
 
 from dotenv import load_dotenv
 from langchain_core.documents import Document
 from langchain_core.output_parsers import JsonOutputParser, StrOutputParser
 from langchain_core.prompts import PromptTemplate
+from langchain_core.runnables import RunnableLambda
 from langchain_groq import ChatGroq
 from langchain_community.tools.tavily_search import TavilySearchResults
 from langgraph.graph import END, StateGraph
@@ -13,14 +16,33 @@ from typing_extensions import TypedDict
 
 load_dotenv()
 
+# Tag on the generation chain, used to pick its tokens out of the event stream
+GENERATION_TAG = "rag_generation"
+# Runs reported as pipeline stages by ``astream``, keyed by run name
+STAGE_RUNS = {
+    "rag.route": "routing",
+    "rag.grade_documents": "grading",
+    "rag.websearch": "web_search",
+    "rag.generate": "generation",
+    "rag.verify": "verification",
+}
+
 class GraphState(TypedDict):
     question: str
     generation: Optional[str]
     web_search: str
     documents: List[Document]
+    # Seconds spent grading each retrieved document, in retrieval order
+    grading_latency: List[float]
 
 class RAGService:
-    def __init__(self, groq_api_key: str, tavily_api_key: Optional[str] = None, model_name: str = "llama3-70b-8192"):
+    def __init__(
+        self,
+        groq_api_key: str,
+        tavily_api_key: Optional[str] = None,
+        model_name: str = "llama3-70b-8192",
+        grading_concurrency: int = 4,
+    ):
         if not groq_api_key:
             raise RuntimeError(
                 "GROQ_API_KEY is required for RAG operations. "
@@ -33,6 +55,8 @@ class RAGService:
             model_name=model_name,
         )
         self.web_search_tool = TavilySearchResults(k=3) if tavily_api_key else None
+        # Maximum number of retrieval-grader calls in flight for one question
+        self.grading_concurrency = max(1, grading_concurrency)
         
         # Initialize prompts and chains
         self._init_chains()
@@ -66,7 +90,9 @@ class RAGService:
             Answer: <|eot_id|><|start_header_id|>assistant<|end_header_id|>""",
             input_variables=["question", "context"],
         )
-        self.rag_chain = self.generation_prompt | self.llm | StrOutputParser()
+        self.rag_chain = (self.generation_prompt | self.llm | StrOutputParser()).with_config(
+            tags=[GENERATION_TAG]
+        )
 
         # Hallucination Grader
         self.hallucination_prompt = PromptTemplate(
@@ -118,53 +144,73 @@ class RAGService:
         documents = state.get("documents", [])
         return {"documents": documents, "question": question}
 
-    def generate(self, state: GraphState) -> GraphState:
+    async def generate(self, state: GraphState) -> GraphState:
         print("---GENERATE---")
         question = state["question"]
         documents = state.get("documents", [])
         context = self._documents_to_text(documents)
-        generation = self.rag_chain.invoke({"context": context, "question": question})
+        generation = await self.rag_chain.ainvoke({"context": context, "question": question})
         print(generation)
         return {"documents": documents, "question": question, "generation": generation}
 
-    def grade_documents(self, state: GraphState) -> GraphState:
-        print("---CHECK DOCUMENT RELEVANCE TO QUESTION---")
-        question = state["question"]
-        documents = state.get("documents", [])
-        if not documents:
-            return {"documents": [], "question": question, "web_search": "Yes"}
+    async def _grade_document(
+        self, question: str, document: Document, semaphore: asyncio.Semaphore
+    ) -> Tuple[bool, float]:
+        async with semaphore:
+            start = time.perf_counter()
+            score = await self.retrieval_grader.ainvoke(
+                {"question": question, "document": document.page_content}
+            )
+            return score["score"].lower() == "yes", time.perf_counter() - start
 
+    def _filter_graded(
+        self, question: str, documents: List[Document], grades: List[Tuple[bool, float]]
+    ) -> GraphState:
         filtered_docs = []
         web_search = "No"
-        for d in documents:
-            score = self.retrieval_grader.invoke(
-                {"question": question, "document": d.page_content}
-            )
-            grade = score["score"]
-            if grade.lower() == "yes":
-                print("---GRADE: DOCUMENT RELEVANT---")
+        for d, (relevant, latency) in zip(documents, grades):
+            if relevant:
+                print(f"---GRADE: DOCUMENT RELEVANT ({latency:.2f}s)---")
                 filtered_docs.append(d)
             else:
-                print("---GRADE: DOCUMENT NOT RELEVANT---")
+                print(f"---GRADE: DOCUMENT NOT RELEVANT ({latency:.2f}s)---")
                 web_search = "Yes"
-        return {"documents": filtered_docs, "question": question, "web_search": web_search}
+        return {
+            "documents": filtered_docs,
+            "question": question,
+            "web_search": web_search,
+            "grading_latency": [latency for _, latency in grades],
+        }
 
-    def web_search(self, state: GraphState) -> GraphState:
+    async def grade_documents(self, state: GraphState) -> GraphState:
+        print("---CHECK DOCUMENT RELEVANCE TO QUESTION---")
+        question = state["question"]
+        documents = state.get("documents", [])
+        if not documents:
+            return {"documents": [], "question": question, "web_search": "Yes", "grading_latency": []}
+
+        semaphore = asyncio.Semaphore(self.grading_concurrency)
+        grades = await asyncio.gather(
+            *(self._grade_document(question, d, semaphore) for d in documents)
+        )
+        return self._filter_graded(question, documents, list(grades))
+
+    async def web_search(self, state: GraphState) -> GraphState:
         print("---WEB SEARCH---")
         if self.web_search_tool is None:
             raise RuntimeError("TAVILY_API_KEY is required to use the web search tool.")
 
         question = state["question"]
         documents = state.get("documents", [])
-        docs = self.web_search_tool.invoke({"query": question})
+        docs = await self.web_search_tool.ainvoke({"query": question})
         web_results = "\n".join([d["content"] for d in docs])
         documents.append(Document(page_content=web_results))
         return {"documents": documents, "question": question}
 
-    def route_question(self, state: GraphState) -> str:
+    async def route_question(self, state: GraphState) -> str:
         print("---ROUTE QUESTION---")
         question = state["question"]
-        source = self.question_router.invoke({"question": question})
+        source = await self.question_router.ainvoke({"question": question})
         print(source)
         datasource = source.get("datasource")
         if datasource == "web_search":
@@ -184,14 +230,14 @@ class RAGService:
         print("---DECISION: GENERATE---")
         return "generate"
 
-    def grade_generation_v_documents_and_question(self, state: GraphState) -> str:
+    async def grade_generation_v_documents_and_question(self, state: GraphState) -> str:
         print("---CHECK HALLUCINATIONS---")
         question = state["question"]
         documents = state.get("documents", [])
         generation = state.get("generation") or ""
         documents_text = self._documents_to_text(documents)
 
-        score = self.hallucination_grader.invoke(
+        score = await self.hallucination_grader.ainvoke(
             {"documents": documents_text, "generation": generation}
         )
         grade = score["score"]
@@ -199,7 +245,7 @@ class RAGService:
         if grade == "yes":
             print("---DECISION: GENERATION IS GROUNDED IN DOCUMENTS---")
             print("---GRADE GENERATION vs QUESTION---")
-            score = self.answer_grader.invoke({"question": question, "generation": generation})
+            score = await self.answer_grader.ainvoke({"question": question, "generation": generation})
             grade = score["score"]
             if grade == "yes":
                 print("---DECISION: GENERATION ADDRESSES QUESTION---")
@@ -211,14 +257,16 @@ class RAGService:
         return "not supported"
 
     def _build_workflow(self):
+        # LLM-backed steps are async only; the graph is driven with ``astream``
         workflow = StateGraph(GraphState)
-        workflow.add_node("websearch", self.web_search)
+        workflow.add_node("websearch", RunnableLambda(self.web_search, name="rag.websearch"))
         workflow.add_node("retrieve", self.retrieve)
-        workflow.add_node("grade_documents", self.grade_documents)
-        workflow.add_node("generate", self.generate)
+        workflow.add_node("grade_documents", RunnableLambda(self.grade_documents, name="rag.grade_documents"))
+        workflow.add_node("generate", RunnableLambda(self.generate, name="rag.generate"))
 
         workflow.set_conditional_entry_point(
-            self.route_question,
+            # Named through the config: this langgraph cannot inspect an async-only lambda as a branch
+            RunnableLambda(self.route_question).with_config(run_name="rag.route"),
             {
                 "websearch": "websearch",
                 "vectorstore": "retrieve",
@@ -236,7 +284,7 @@ class RAGService:
         workflow.add_edge("websearch", "generate")
         workflow.add_conditional_edges(
             "generate",
-            self.grade_generation_v_documents_and_question,
+            RunnableLambda(self.grade_generation_v_documents_and_question).with_config(run_name="rag.verify"),
             {
                 "not supported": "generate",
                 "useful": END,
@@ -259,16 +307,20 @@ class RAGService:
         texts.append(f"<|start_header_id|>user<|end_header_id|> {message} <|eot_id|>")
         return "".join(texts)
 
-    def run(self, message: str, documents: List[Document], chat_history: List[tuple[str, str]]) -> str:
+    def _get_inputs(self, message: str, documents: List[Document], chat_history: List[tuple[str, str]]) -> GraphState:
         question = self._get_prompt(message, chat_history)
-        inputs: GraphState = {
+        return {
             "question": question,
             "documents": documents or [],
             "web_search": "No",
             "generation": None,
+            "grading_latency": [],
         }
+
+    async def arun(self, message: str, documents: List[Document], chat_history: List[tuple[str, str]]) -> str:
+        inputs = self._get_inputs(message, documents, chat_history)
         result = None
-        for output in self.app.stream(inputs):
+        async for output in self.app.astream(inputs):
             for key, value in output.items():
                 pprint(f"Node '{key}':")
                 result = value
@@ -277,3 +329,52 @@ class RAGService:
             return result["generation"]
         return ""
 
+    async def astream(
+        self, message: str, documents: List[Document], chat_history: List[tuple[str, str]]
+    ) -> AsyncIterator[dict]:
+        """Run the graph, yielding events as they happen.
+
+        Yields ``{"event": "stage", ...}`` when a pipeline stage starts or ends,
+        ``{"event": "token", "text": ...}`` for each generated token and one
+        final ``{"event": "result", "answer": ..., "verification": ...}``. If
+        verification sends the answer back to generation, a new ``generation``
+        stage starts with a higher ``attempt`` and the client should discard
+        the tokens of the previous attempt.
+        """
+        inputs = self._get_inputs(message, documents, chat_history)
+        generation = ""
+        verification = None
+        attempts = 0
+        async for event in self.app.astream_events(inputs, version="v2"):
+            kind = event["event"]
+            if kind == "on_chat_model_stream" and GENERATION_TAG in event.get("tags", []):
+                text = event["data"]["chunk"].content
+                if text:
+                    yield {"event": "token", "text": text}
+                continue
+
+            stage = STAGE_RUNS.get(event["name"])
+            if stage is None or kind not in ("on_chain_start", "on_chain_end"):
+                continue
+            if kind == "on_chain_start":
+                payload = {"event": "stage", "stage": stage, "status": "start"}
+                if stage == "generation":
+                    attempts += 1
+                    payload["attempt"] = attempts
+                yield payload
+                continue
+
+            output = event["data"].get("output")
+            payload = {"event": "stage", "stage": stage, "status": "end"}
+            if stage in ("routing", "verification"):
+                payload["decision"] = output
+            if stage == "verification":
+                verification = output
+            elif stage == "grading":
+                payload["relevant"] = len(output.get("documents", []))
+                payload["grading_latency"] = output.get("grading_latency", [])
+            elif stage == "generation":
+                generation = output.get("generation") or ""
+            yield payload
+
+        yield {"event": "result", "answer": generation, "verification": verification}
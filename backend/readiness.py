@@ -0,0 +1,62 @@
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from concurrency import run_blocking
+
+PENDING = "pending"
+RUNNING = "running"
+READY = "ready"
+FAILED = "failed"
+
+WarmUpStep = Tuple[str, Callable[[], Any]]
+
+
+class Readiness:
+    """Tracks the warm-up of heavy resources behind ``/ready``.
+
+    The application is ready once every step in ``required`` has succeeded.
+    Optional steps (priming remote LLMs, for example) are reported but do not
+    hold readiness back. Each step records its status, duration and error.
+    """
+
+    def __init__(self, required: Sequence[str]) -> None:
+        self.required = list(required)
+        self._components: Dict[str, dict] = {name: {"status": PENDING} for name in self.required}
+        self._lock = threading.Lock()
+
+    def _set(self, name: str, **state: Any) -> None:
+        with self._lock:
+            self._components[name] = state
+
+    @property
+    def ready(self) -> bool:
+        with self._lock:
+            return all(self._components.get(name, {}).get("status") == READY for name in self.required)
+
+    def status(self) -> dict:
+        with self._lock:
+            components = {name: dict(state) for name, state in self._components.items()}
+        return {"ready": self.ready, "components": components}
+
+    async def run(self, steps: List[WarmUpStep]) -> None:
+        """Run blocking warm-up steps in order on the shared executor.
+
+        A failing step is recorded and logged; the remaining steps still run,
+        and the resources of the failed one are built lazily on first use.
+        """
+        for name, step in steps:
+            self._set(name, status=RUNNING)
+            start = time.perf_counter()
+            error: Optional[str] = None
+            try:
+                await run_blocking(step)
+            except Exception as e:
+                error = str(e)
+            seconds = round(time.perf_counter() - start, 3)
+            if error is None:
+                self._set(name, status=READY, seconds=seconds)
+                print(f"Warm-up {name} done in {seconds:.1f}s")
+            else:
+                self._set(name, status=FAILED, seconds=seconds, error=error)
+                print(f"Warm-up {name} failed after {seconds:.1f}s: {error}")
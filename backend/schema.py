@@ -0,0 +1,27 @@
+"""Create or migrate the database schema.
+
+Run once per deployment, before the API starts (from ``backend/``)::
+
+    python schema.py
+
+The API only does this itself when ``CREATE_SCHEMA_ON_STARTUP`` is set.
+"""
+from sqlalchemy.engine import Engine
+
+import models
+from transactions import ensure_transaction_schema
+from vector_index import create_vector_indexes
+
+
+def create_schema(engine: Engine) -> None:
+    # Runs before create_all so a newly created rollup table is backfilled
+    ensure_transaction_schema(engine)
+    models.Base.metadata.create_all(bind=engine)
+    create_vector_indexes(engine)
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    create_schema(engine)
+    print("Schema is up to date")
@@ -0,0 +1,195 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Generic, Iterator, Optional, Tuple, TypeVar
+
+S = TypeVar("S")
+
+
+def resident_memory_bytes() -> int:
+    """Current resident set size of this process (0 where ``/proc`` is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def query_key(query: str) -> str:
+    """Key of a chat turn in the history index and the query vector store."""
+    return hashlib.sha1(query.encode("utf-8")).hexdigest()
+
+
+class ChatHistory:
+    """Bounded chat history indexed by query key.
+
+    Turns are kept in order, oldest first; asking the same question again
+    replaces the earlier turn. ``get`` resolves a query-store hit to its
+    ``(user, ai)`` pair without scanning the history.
+    """
+
+    def __init__(self, maxlen: int) -> None:
+        self.maxlen = maxlen
+        self._turns: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()
+
+    def append(self, query: str, answer: str) -> str:
+        key = query_key(query)
+        self._turns.pop(key, None)
+        self._turns[key] = (query, answer)
+        while len(self._turns) > self.maxlen:
+            self._turns.popitem(last=False)
+        return key
+
+    def get(self, key: str) -> Optional[Tuple[str, str]]:
+        return self._turns.get(key)
+
+    def clear(self) -> None:
+        self._turns.clear()
+
+    def __iter__(self) -> Iterator[Tuple[str, str]]:
+        return iter(list(self._turns.values()))
+
+    def __len__(self) -> int:
+        return len(self._turns)
+
+
+class SessionRegistry(Generic[S]):
+    """Bounded registry of per-session state.
+
+    Sessions are evicted when idle for longer than ``ttl_seconds``, when more
+    than ``max_sessions`` are live (least recently used first) and, if
+    ``memory_budget_bytes`` is set, one per check while the process RSS is
+    above the budget.
+    Evicted sessions are passed to ``on_evict`` so they can release resources.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[str], S],
+        ttl_seconds: float = 1800,
+        max_sessions: int = 500,
+        memory_budget_bytes: int = 0,
+        on_evict: Optional[Callable[[S], None]] = None,
+    ) -> None:
+        self.factory = factory
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.memory_budget_bytes = memory_budget_bytes
+        self.on_evict = on_evict
+        self._sessions: "OrderedDict[str, S]" = OrderedDict()
+        self._last_used: Dict[str, float] = {}
+        self._evicted_ids: "OrderedDict[str, None]" = OrderedDict()
+        # get is called from executor threads, so every mutation is guarded
+        self._lock = threading.RLock()
+        self._metrics = {
+            "created": 0,
+            "rebuilt": 0,
+            "build_seconds_total": 0.0,
+            "evicted_ttl": 0,
+            "evicted_lru": 0,
+            "evicted_memory": 0,
+        }
+
+    def get(self, session_id: str) -> S:
+        with self._lock:
+            session = self._touch(session_id)
+        if session is not None:
+            return session
+
+        # Built outside the lock: the factory may hit the database, and other
+        # lookups should not wait behind it
+        start = time.perf_counter()
+        built = self.factory(session_id)
+        seconds = time.perf_counter() - start
+
+        with self._lock:
+            self._metrics["build_seconds_total"] += seconds
+            # Another thread may have built the same session in the meantime
+            session = self._touch(session_id)
+            if session is not None:
+                return session
+            self._metrics["created"] += 1
+            if session_id in self._evicted_ids:
+                del self._evicted_ids[session_id]
+                self._metrics["rebuilt"] += 1
+
+            self._sessions[session_id] = built
+            self._last_used[session_id] = time.monotonic()
+            self.evict()
+            return built
+
+    def _touch(self, session_id: str) -> Optional[S]:
+        session = self._sessions.get(session_id)
+        if session is not None:
+            self._sessions.move_to_end(session_id)
+            self._last_used[session_id] = time.monotonic()
+        return session
+
+    def peek(self, session_id: str) -> Optional[S]:
+        """Return a live session without building it or refreshing its TTL."""
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def _evict_one(self, session_id: str, reason: str) -> None:
+        session = self._sessions.pop(session_id)
+        self._last_used.pop(session_id, None)
+        self._metrics[f"evicted_{reason}"] += 1
+        # Remember recently evicted IDs (bounded) to count rebuilds
+        self._evicted_ids[session_id] = None
+        while len(self._evicted_ids) > max(self.max_sessions, 1) * 4:
+            self._evicted_ids.popitem(last=False)
+        print(f"Evicted session {session_id} ({reason})")
+        if self.on_evict is not None:
+            try:
+                self.on_evict(session)
+            except Exception as e:
+                print(f"Error releasing session {session_id}: {e}")
+
+    def evict(self) -> int:
+        """Apply the TTL, LRU and memory limits; returns the number of evicted sessions."""
+        evicted = 0
+        with self._lock:
+            now = time.monotonic()
+            for session_id in list(self._sessions):
+                if now - self._last_used[session_id] > self.ttl_seconds:
+                    self._evict_one(session_id, "ttl")
+                    evicted += 1
+            while len(self._sessions) > self.max_sessions:
+                self._evict_one(next(iter(self._sessions)), "lru")
+                evicted += 1
+            # RSS only shrinks after the allocator returns memory, so evict at
+            # most one session per check instead of draining the registry
+            if (
+                self.memory_budget_bytes
+                and len(self._sessions) > 1
+                and resident_memory_bytes() > self.memory_budget_bytes
+            ):
+                self._evict_one(next(iter(self._sessions)), "memory")
+                evicted += 1
+        return evicted
+
+    def record_component_build(self, name: str, seconds: float) -> None:
+        """Account the cost of a lazily built session component."""
+        with self._lock:
+            builds = self._metrics.setdefault("component_builds", {})
+            count, total = builds.get(name, (0, 0.0))
+            builds[name] = (count + 1, total + seconds)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            metrics = dict(self._metrics)
+            live = len(self._sessions)
+        created = metrics["created"]
+        metrics["build_seconds_avg"] = metrics["build_seconds_total"] / created if created else 0.0
+        metrics["component_builds"] = {
+            name: {"count": count, "seconds_total": total}
+            for name, (count, total) in metrics.get("component_builds", {}).items()
+        }
+        metrics["live"] = live
+        metrics["resident_memory_bytes"] = resident_memory_bytes()
+        return metrics
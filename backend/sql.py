@@ -1,5 +1,6 @@
+import threading
 import uuid
-from typing import Any, Generic, Iterator, List, Optional, Sequence, Tuple, TypeVar
+from typing import Any, Dict, Generic, Iterator, List, Optional, Sequence, Tuple, TypeVar
 
 import sqlalchemy
 from sqlalchemy import JSON, UUID
@@ -18,11 +19,41 @@ V = TypeVar("V")
 
 ITERATOR_WINDOW_SIZE = 1000
 
+# Rows per multi-row INSERT in ``mset``; keeps each statement well below the
+# driver's bind-parameter limit.
+MSET_BATCH_SIZE = 1000
+
 Base = declarative_base()  # type: Any
 
 
 _LANGCHAIN_DEFAULT_COLLECTION_NAME = "langchain"
 
+_KEYSET_INDEX_NAME = "ix_langchain_storage_items_collection_custom_id_c"
+
+_DEFAULT_ENGINE_ARGS: Dict[str, Any] = {
+    "pool_size": 10,
+    "max_overflow": 20,
+    "pool_pre_ping": True,
+}
+
+# Engines shared by every store created from the same connection string, and the
+# engines whose schema has already been created in this process.
+_engines: Dict[Tuple[str, Tuple], sqlalchemy.engine.Engine] = {}
+_schema_ready: set = set()
+_engines_lock = threading.Lock()
+
+
+def _get_engine(connection_string: str, engine_args: Dict[str, Any]) -> sqlalchemy.engine.Engine:
+    key = (connection_string, tuple(sorted((k, repr(v)) for k, v in engine_args.items())))
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            engine = sqlalchemy.create_engine(
+                connection_string, **{**_DEFAULT_ENGINE_ARGS, **engine_args}
+            )
+            _engines[key] = engine
+        return engine
+
 
 class BaseModel(Base):
     """Base model for the SQL stores."""
@@ -101,6 +132,23 @@ def _get_storage_stores() -> Any:
         # custom_id : any user defined id
         custom_id = sqlalchemy.Column(sqlalchemy.String, nullable=True)
 
+        # One value per key and collection; backs the upsert in ``mset``.
+        # The "C"-collated index orders keys bytewise, which serves both the
+        # keyset pagination and ``LIKE 'prefix%'`` filters in ``yield_keys``.
+        __table_args__ = (
+            sqlalchemy.Index(
+                "ix_langchain_storage_items_collection_custom_id",
+                "collection_id",
+                "custom_id",
+                unique=True,
+            ),
+            sqlalchemy.Index(
+                _KEYSET_INDEX_NAME,
+                "collection_id",
+                sqlalchemy.text('custom_id COLLATE "C"'),
+            ).ddl_if(dialect="postgresql"),
+        )
+
     _classes = (ItemStore, CollectionStore)
 
     return _classes
@@ -118,7 +166,13 @@ class SQLBaseStore(BaseStore[str, V], Generic[V]):
             So, make sure the user has the right permissions to create tables.
         pre_delete_collection: If True, will delete the collection if it exists.
             (default: False). Useful for testing.
-        engine_args: SQLAlchemy's create engine arguments.
+        connection: An existing connection to use for every operation. Mostly
+            useful for tests running inside a transaction.
+        engine: A shared SQLAlchemy engine. Each operation borrows a
+            connection from its pool for the duration of the call.
+        engine_args: SQLAlchemy's create engine arguments, used when neither
+            ``connection`` nor ``engine`` is given. Stores created with the
+            same connection string and arguments share one pooled engine.
 
     Example:
         .. code-block:: python
@@ -169,6 +223,7 @@ class SQLBaseStore(BaseStore[str, V], Generic[V]):
         collection_metadata: Optional[dict] = None,
         pre_delete_collection: bool = False,
         connection: Optional[sqlalchemy.engine.Connection] = None,
+        engine: Optional[sqlalchemy.engine.Engine] = None,
         engine_args: Optional[dict[str, Any]] = None,
     ) -> None:
         self.connection_string = connection_string
@@ -176,40 +231,81 @@ class SQLBaseStore(BaseStore[str, V], Generic[V]):
         self.collection_metadata = collection_metadata
         self.pre_delete_collection = pre_delete_collection
         self.engine_args = engine_args or {}
-        # Create a connection if not provided, otherwise use the provided connection
-        self._conn = connection if connection else self.__connect()
+        # Use the provided connection or engine, otherwise the shared pooled engine
+        # for this connection string. No connection is held between operations.
+        self._bind: Any = connection or engine or self.__connect()
         self.__post_init__()
 
     def __post_init__(
         self,
     ) -> None:
         """Initialize the store."""
+        self._collection_uuid: Optional[uuid.UUID] = None
         ItemStore, CollectionStore = _get_storage_stores()
         self.CollectionStore = CollectionStore
         self.ItemStore = ItemStore
         self.__create_tables_if_not_exists()
         self.__create_collection()
 
-    def __connect(self) -> sqlalchemy.engine.Connection:
-        engine = sqlalchemy.create_engine(self.connection_string, **self.engine_args)
-        conn = engine.connect()
-        return conn
+    def __connect(self) -> sqlalchemy.engine.Engine:
+        return _get_engine(self.connection_string, self.engine_args)
+
+    def __create_schema(self, conn: sqlalchemy.engine.Connection) -> None:
+        """Create the tables and indexes.
+
+        Tables created before the unique ``(collection_id, custom_id)`` index
+        existed may hold duplicate keys, which are deleted so the index can be
+        built. Items have no timestamp or sequence column (the primary key is
+        a random UUID), so which duplicate survives is arbitrary: the one with
+        the highest ``ctid``, i.e. physical position, not the newest write.
+        """
+        Base.metadata.create_all(conn)
+        for index in self.ItemStore.__table__.indexes:
+            if index.name == _KEYSET_INDEX_NAME:
+                if conn.dialect.name == "postgresql":
+                    index.create(conn, checkfirst=True)
+                continue
+            if conn.dialect.name == "postgresql" and not sqlalchemy.inspect(conn).has_index(
+                self.ItemStore.__tablename__, index.name
+            ):
+                conn.execute(
+                    sqlalchemy.text(
+                        f"DELETE FROM {self.ItemStore.__tablename__} a "
+                        f"USING {self.ItemStore.__tablename__} b "
+                        "WHERE a.collection_id = b.collection_id "
+                        "AND a.custom_id = b.custom_id AND a.ctid < b.ctid"
+                    )
+                )
+            index.create(conn, checkfirst=True)
 
     def __create_tables_if_not_exists(self) -> None:
-        with self._conn.begin():
-            Base.metadata.create_all(self._conn)
+        engine = self._bind.engine
+        if engine in _schema_ready:
+            return
+        with _engines_lock:
+            if engine in _schema_ready:
+                return
+            if isinstance(self._bind, sqlalchemy.engine.Connection):
+                with self._bind.begin():
+                    self.__create_schema(self._bind)
+            else:
+                with self._bind.begin() as conn:
+                    self.__create_schema(conn)
+            _schema_ready.add(engine)
 
     def __create_collection(self) -> None:
         if self.pre_delete_collection:
             self.delete_collection()
-        with Session(self._conn) as session:
-            self.CollectionStore.get_or_create(
+        with Session(self._bind) as session:
+            collection, _ = self.CollectionStore.get_or_create(
                 session, self.collection_name, cmetadata=self.collection_metadata
             )
+            self._collection_uuid = collection.uuid
 
     def delete_collection(self) -> None:
-        with Session(self._conn) as session:
+        with Session(self._bind) as session:
             collection = self.__get_collection(session)
+            self._collection_uuid = None
             if not collection:
                 return
             session.delete(collection)
@@ -218,9 +314,19 @@ class SQLBaseStore(BaseStore[str, V], Generic[V]):
     def __get_collection(self, session: Session) -> Any:
         return self.CollectionStore.get_by_name(session, self.collection_name)
 
-    def __del__(self) -> None:
-        if self._conn:
-            self._conn.close()
+    def __get_collection_uuid(self, session: Session) -> Optional[uuid.UUID]:
+        # The collection row never changes once created, so it is resolved once
+        if self._collection_uuid is None:
+            collection = self.__get_collection(session)
+            self._collection_uuid = collection.uuid if collection else None
+        return self._collection_uuid
+
+    def __insert(self) -> Any:
+        if self._bind.dialect.name == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        return insert(self.ItemStore)
 
     def __serialize_value(self, obj: V) -> str:
         if isinstance(obj, Serializable):
@@ -243,15 +349,17 @@ class SQLBaseStore(BaseStore[str, V], Generic[V]):
             A sequence of optional values associated with the keys.
             If a key is not found, the corresponding value will be None.
         """
-        with Session(self._conn) as session:
-            collection = self.__get_collection(session)
+        with Session(self._bind) as session:
+            collection_uuid = self.__get_collection_uuid(session)
+            if collection_uuid is None or not keys:
+                return [None for _ in keys]
 
             items = (
                 session.query(self.ItemStore.content, self.ItemStore.custom_id)
                 .where(
                     sqlalchemy.and_(
                         self.ItemStore.custom_id.in_(keys),
-                        self.ItemStore.collection_id == (collection.uuid),
+                        self.ItemStore.collection_id == collection_uuid,
                     )
                 )
                 .all()
@@ -275,18 +383,29 @@ class SQLBaseStore(BaseStore[str, V], Generic[V]):
         Returns:
             None
         """
-        with Session(self._conn) as session:
-            collection = self.__get_collection(session)
-            if not collection:
+        with Session(self._bind) as session:
+            collection_uuid = self.__get_collection_uuid(session)
+            if collection_uuid is None:
                 raise ValueError("Collection not found")
-            for id, item in key_value_pairs:
-                content = self.__serialize_value(item)
-                item_store = self.ItemStore(
-                    content=content,
-                    custom_id=id,
-                    collection_id=collection.uuid,
+            # ON CONFLICT cannot touch the same row twice in one statement,
+            # so repeated keys keep their last value
+            rows = {
+                id: {
+                    "uuid": uuid.uuid4(),
+                    "collection_id": collection_uuid,
+                    "custom_id": id,
+                    "content": self.__serialize_value(item),
+                }
+                for id, item in key_value_pairs
+            }
+            values = list(rows.values())
+            for start in range(0, len(values), MSET_BATCH_SIZE):
+                stmt = self.__insert().values(values[start : start + MSET_BATCH_SIZE])
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=["collection_id", "custom_id"],
+                    set_={"content": stmt.excluded.content},
                 )
-                session.add(item_store)
+                session.execute(stmt)
             session.commit()
 
     def mdelete(self, keys: Sequence[str]) -> None:
@@ -295,47 +414,72 @@ class SQLBaseStore(BaseStore[str, V], Generic[V]):
         Args:
             keys (Sequence[str]): A sequence of keys to delete.
         """
-        with Session(self._conn) as session:
-            collection = self.__get_collection(session)
-            if not collection:
+        with Session(self._bind) as session:
+            collection_uuid = self.__get_collection_uuid(session)
+            if collection_uuid is None:
                 raise ValueError("Collection not found")
             if keys is not None:
                 stmt = sqlalchemy.delete(self.ItemStore).where(
                     sqlalchemy.and_(
                         self.ItemStore.custom_id.in_(keys),
-                        self.ItemStore.collection_id == (collection.uuid),
+                        self.ItemStore.collection_id == collection_uuid,
                     )
                 )
                 session.execute(stmt)
             session.commit()
 
-    def yield_keys(self, prefix: Optional[str] = None) -> Iterator[str]:
+    def __key_column(self) -> Any:
+        # Bytewise ordering on Postgres so the "C"-collated index is used
+        if self._bind.dialect.name == "postgresql":
+            return self.ItemStore.custom_id.collate("C")
+        return self.ItemStore.custom_id
+
+    def yield_keys(self, prefix: Optional[str] = None, stream: bool = False) -> Iterator[str]:
         """Get an iterator over keys that match the given prefix.
 
+        Keys are returned in byte order. By default they are read in windows of
+        ``ITERATOR_WINDOW_SIZE`` using keyset pagination on
+        ``(collection_id, custom_id)``, so each window is an index range scan
+        regardless of how many keys came before it.
+
         Args:
             prefix (str, optional): The prefix to match. Defaults to None.
+            stream (bool): Read all keys with one query through a server-side
+                cursor instead of one query per window. Defaults to False.
 
         Returns:
             Iterator[str]: An iterator over keys that match the given prefix.
         """
-        with Session(self._conn) as session:
-            collection = self.__get_collection(session)
-            start = 0
-            while True:
-                stop = start + ITERATOR_WINDOW_SIZE
-                query = session.query(self.ItemStore.custom_id).where(
-                    self.ItemStore.collection_id == (collection.uuid)
-                )
-                if prefix is not None:
-                    query = query.filter(self.ItemStore.custom_id.startswith(prefix))
-                items = query.slice(start, stop).all()
+        key = self.__key_column()
+        with Session(self._bind) as session:
+            collection_uuid = self.__get_collection_uuid(session)
+            if collection_uuid is None:
+                return
+            query = session.query(self.ItemStore.custom_id).where(
+                self.ItemStore.collection_id == collection_uuid,
+                self.ItemStore.custom_id.isnot(None),
+            )
+            if prefix is not None:
+                # Pass the whole 'prefix%' pattern as one value (not param || '%') so the index can be used
+                escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+                query = query.filter(key.like(escaped + "%", escape="\\"))
+            query = query.order_by(key)
+
+            if stream:
+                for item in query.execution_options(yield_per=ITERATOR_WINDOW_SIZE):
+                    yield item[0]
+                return
 
-                if len(items) == 0:
-                    break
+            last_key: Optional[str] = None
+            while True:
+                window = query if last_key is None else query.filter(key > last_key)
+                items = window.limit(ITERATOR_WINDOW_SIZE).all()
                 for item in items:
                     yield item[0]
-                start += ITERATOR_WINDOW_SIZE
+                if len(items) < ITERATOR_WINDOW_SIZE:
+                    break
+                last_key = items[-1][0]
 
 
 SQLDocStore = SQLBaseStore[Document]
-SQLStrStore = SQLBaseStore[str]
\ No newline at end of file
+SQLStrStore = SQLBaseStore[str]
@@ -0,0 +1,380 @@
+import codecs
+import csv
+import datetime
+import json
+from typing import Any, AsyncIterator, Iterable, List, Optional, Tuple
+
+from sqlalchemy import Date, and_, func, inspect, literal_column, or_, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+import models
+
+GROUP_BY = ("category", "day", "month")
+# Rollup rows need a category key; transactions without one are grouped under ""
+NO_CATEGORY = ""
+
+
+def _category_key(column):
+    # Inlined so a GROUP BY on the expression matches the selected one
+    return func.coalesce(column, literal_column(f"'{NO_CATEGORY}'"))
+
+
+def migrate_transaction_dates(engine: Engine) -> None:
+    """Convert ``transcations.date`` from the legacy text column to ``date``.
+
+    Values that are not ISO dates are copied to ``date_legacy`` before the
+    conversion, which stores NULL for them.
+    """
+    if engine.dialect.name != "postgresql":
+        return
+    inspector = inspect(engine)
+    if not inspector.has_table(models.Transcation.__tablename__):
+        return
+    columns = {c["name"]: c["type"] for c in inspector.get_columns(models.Transcation.__tablename__)}
+    if isinstance(columns.get("date"), Date):
+        return
+
+    iso_date = r"^\d{4}-\d{2}-\d{2}$"
+    with engine.begin() as conn:
+        invalid = conn.execute(
+            text("SELECT count(*) FROM transcations WHERE date IS NOT NULL AND date !~ :pattern"),
+            {"pattern": iso_date},
+        ).scalar()
+        if invalid:
+            print(f"Keeping {invalid} non-ISO transaction dates in transcations.date_legacy")
+            conn.execute(text("ALTER TABLE transcations ADD COLUMN IF NOT EXISTS date_legacy VARCHAR"))
+            conn.execute(
+                text("UPDATE transcations SET date_legacy = date WHERE date IS NOT NULL AND date !~ :pattern"),
+                {"pattern": iso_date},
+            )
+        conn.execute(
+            text(
+                "ALTER TABLE transcations ALTER COLUMN date TYPE date "
+                "USING CASE WHEN date ~ :pattern THEN date::date END"
+            ).bindparams(pattern=iso_date)
+        )
+    print("Migrated transcations.date to DATE")
+
+
+def ensure_transaction_schema(engine: Engine) -> None:
+    """Migrate legacy columns, create the indexes on existing tables and
+    backfill the rollup table the first time it is created."""
+    migrate_transaction_dates(engine)
+    rollup_existed = inspect(engine).has_table(models.TransactionRollup.__tablename__)
+    models.Base.metadata.create_all(
+        bind=engine, tables=[models.Transcation.__table__, models.TransactionRollup.__table__]
+    )
+    # create_all skips columns and indexes of tables that already exist
+    columns = {c["name"] for c in inspect(engine).get_columns(models.Transcation.__tablename__)}
+    if "date_legacy" not in columns:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE transcations ADD COLUMN date_legacy VARCHAR"))
+    for index in models.Transcation.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+    if not rollup_existed:
+        with Session(engine) as db:
+            rebuild_rollups(db)
+            db.commit()
+
+
+def rebuild_rollups(db: Session) -> None:
+    Transaction = models.Transcation
+    category = _category_key(Transaction.category)
+    db.query(models.TransactionRollup).delete()
+    db.execute(
+        insert(models.TransactionRollup).from_select(
+            ["day", "category", "total", "count"],
+            select(Transaction.date, category, func.sum(Transaction.amount), func.count())
+            .where(Transaction.date.isnot(None))
+            .group_by(Transaction.date, category),
+        )
+    )
+
+
+def record_rollups(db: Session, rows: Iterable[Tuple[Optional[datetime.date], Optional[str], float]]) -> None:
+    """Add ``(date, category, amount)`` rows to the rollup, in the caller's transaction."""
+    totals = {}
+    for day, category, amount in rows:
+        if day is None:
+            continue
+        key = (day, category or NO_CATEGORY)
+        total, count = totals.get(key, (0.0, 0))
+        totals[key] = (total + (amount or 0.0), count + 1)
+    if not totals:
+        return
+    Rollup = models.TransactionRollup
+    stmt = insert(Rollup).values(
+        [
+            {"day": day, "category": category, "total": total, "count": count}
+            for (day, category), (total, count) in totals.items()
+        ]
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Rollup.day, Rollup.category],
+        set_={"total": Rollup.total + stmt.excluded.total, "count": Rollup.count + stmt.excluded.count},
+    )
+    db.execute(stmt)
+
+
+# Cursor date of rows without a date, which are listed after every dated row
+NULL_CURSOR_DATE = "null"
+
+
+def parse_cursor(cursor: str) -> Tuple[Optional[datetime.date], int]:
+    """Parse a ``<date>_<id>`` listing cursor; raises ``ValueError`` if malformed.
+
+    The date is ``None`` for a cursor on an undated row (``null_<id>``).
+    """
+    day, _, transaction_id = cursor.partition("_")
+    if day == NULL_CURSOR_DATE:
+        return None, int(transaction_id)
+    return datetime.date.fromisoformat(day), int(transaction_id)
+
+
+def list_transactions(
+    db: Session,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    start: Optional[datetime.date] = None,
+    end: Optional[datetime.date] = None,
+    category: Optional[str] = None,
+    skip: int = 0,
+) -> Tuple[List[models.Transcation], Optional[str]]:
+    """Transactions ordered by ``(date, id)``, after ``cursor`` if given.
+
+    Returns the page and the cursor of its last row, or ``None`` on the last
+    page. Rows without a date (legacy dates kept in ``date_legacy``) come
+    after all dated rows, and are left out when ``start`` or ``end`` is set.
+    """
+    Transaction = models.Transcation
+    query = db.query(Transaction)
+    if start is not None:
+        query = query.filter(Transaction.date >= start)
+    if end is not None:
+        query = query.filter(Transaction.date <= end)
+    if category is not None:
+        query = query.filter(Transaction.category == category)
+    if cursor:
+        after_date, after_id = parse_cursor(cursor)
+        if after_date is None:
+            query = query.filter(Transaction.date.is_(None), Transaction.id > after_id)
+        else:
+            query = query.filter(
+                or_(
+                    Transaction.date > after_date,
+                    and_(Transaction.date == after_date, Transaction.id > after_id),
+                    Transaction.date.is_(None),
+                )
+            )
+    elif skip:
+        query = query.offset(skip)
+    # Ascending btree indexes already keep NULLs last, so ix_transcations_date still applies
+    rows = query.order_by(Transaction.date.asc().nulls_last(), Transaction.id).limit(limit).all()
+    next_cursor = None
+    if rows and len(rows) == limit:
+        last = rows[-1]
+        next_cursor = f"{last.date.isoformat() if last.date else NULL_CURSOR_DATE}_{last.id}"
+    return rows, next_cursor
+
+
+def summarize(
+    db: Session,
+    group_by: str = "category",
+    start: Optional[datetime.date] = None,
+    end: Optional[datetime.date] = None,
+    category: Optional[str] = None,
+    use_rollup: bool = True,
+) -> List[dict]:
+    """Sum and count transactions per category, day or month, in SQL.
+
+    With ``use_rollup`` the per-day rollup table is aggregated instead of the
+    transactions themselves.
+    """
+    if group_by not in GROUP_BY:
+        raise ValueError(f"group_by must be one of {', '.join(GROUP_BY)}")
+
+    if use_rollup:
+        Rollup = models.TransactionRollup
+        day, category_column = Rollup.day, Rollup.category
+        total, count = func.sum(Rollup.total), func.sum(Rollup.count)
+    else:
+        Transaction = models.Transcation
+        day, category_column = Transaction.date, _category_key(Transaction.category)
+        total, count = func.sum(Transaction.amount), func.count()
+
+    if group_by == "category":
+        key = category_column
+    elif group_by == "day":
+        key = day
+    else:
+        # Constants inlined for the same reason as in _category_key
+        key = func.to_char(func.date_trunc(literal_column("'month'"), day), literal_column("'YYYY-MM'"))
+
+    query = select(key.label("key"), total.label("total"), count.label("count")).where(day.isnot(None))
+    if start is not None:
+        query = query.where(day >= start)
+    if end is not None:
+        query = query.where(day <= end)
+    if category is not None:
+        query = query.where(category_column == category)
+    query = query.group_by(key).order_by(key)
+    return [
+        {"key": row.key, "total": float(row.total or 0.0), "count": int(row.count or 0)}
+        for row in db.execute(query)
+    ]
+
+
+BULK_CONTENT_TYPES = ("application/json", "application/x-ndjson", "text/csv")
+# Longest single element of a JSON array body; also bounds what a malformed body buffers
+MAX_JSON_RECORD_CHARS = 1024 * 1024
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Decode a byte stream into lines without holding more than one chunk."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+async def iter_json_array(chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    """Yield the elements of a JSON array as the body arrives.
+
+    Only the element being decoded is buffered, up to
+    ``MAX_JSON_RECORD_CHARS``. An empty body is an empty array. Raises
+    ``ValueError`` if the body is not a JSON array.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    json_decoder = json.JSONDecoder()
+    chunks = chunks.__aiter__()
+    buffer, position, eof = "", 0, False
+    # "[" at the start, "first" right after it, "value" after a comma, "," after a value
+    expect = "["
+
+    async def read_more() -> None:
+        nonlocal buffer, position, eof
+        # Drop what has been consumed so the buffer holds one element at most
+        buffer, position = buffer[position:], 0
+        try:
+            buffer += decoder.decode(await chunks.__anext__())
+        except StopAsyncIteration:
+            buffer += decoder.decode(b"", final=True)
+            eof = True
+
+    while True:
+        while position < len(buffer) and buffer[position].isspace():
+            position += 1
+        if position == len(buffer):
+            if eof:
+                if expect == "[":
+                    return
+                raise ValueError("Unterminated JSON array")
+            await read_more()
+            continue
+
+        char = buffer[position]
+        if expect == "[":
+            if char != "[":
+                raise ValueError("Expected a JSON array of transactions")
+            position += 1
+            expect = "first"
+        elif expect in ("first", ",") and char == "]":
+            return
+        elif expect == ",":
+            if char != ",":
+                raise ValueError(f"Expected ',' or ']' in JSON array, got {char!r}")
+            position += 1
+            expect = "value"
+        else:
+            try:
+                value, end = json_decoder.raw_decode(buffer, position)
+            except ValueError:
+                end = None
+            # A value ending at the buffer's end (e.g. a number) may continue in the next chunk
+            if end is None or (end == len(buffer) and not eof):
+                if eof:
+                    raise ValueError("Invalid JSON in array")
+                if len(buffer) - position > MAX_JSON_RECORD_CHARS:
+                    raise ValueError(f"JSON array element longer than {MAX_JSON_RECORD_CHARS} characters")
+                await read_more()
+                continue
+            yield value
+            position = end
+            expect = ","
+
+
+async def iter_records(chunks: AsyncIterator[bytes], content_type: str) -> AsyncIterator[Tuple[int, Any]]:
+    """Yield ``(row_number, record)`` from a JSON array, NDJSON or CSV body.
+
+    All three are parsed as the body arrives: a JSON array element by
+    element, NDJSON and CSV line by line; CSV needs a header row and one
+    record per line. A record that cannot be parsed is yielded as the
+    exception instead of a dict, except in a JSON array, where a syntax
+    error ends the body with ``ValueError``. Row numbers start at 1.
+    """
+    if content_type == "application/json":
+        number = 0
+        async for record in iter_json_array(chunks):
+            number += 1
+            yield number, record
+        return
+
+    number = 0
+    header: Optional[List[str]] = None
+    async for line in iter_lines(chunks):
+        if not line.strip():
+            continue
+        if content_type == "text/csv":
+            fields = next(csv.reader([line]))
+            if header is None:
+                header = [field.strip() for field in fields]
+                continue
+            number += 1
+            if len(fields) != len(header):
+                yield number, ValueError(f"Expected {len(header)} fields, got {len(fields)}")
+            else:
+                yield number, dict(zip(header, fields))
+        else:
+            number += 1
+            try:
+                yield number, json.loads(line)
+            except ValueError as e:
+                yield number, e
+
+
+class BulkInserter:
+    """Writes validated transactions in batched multi-row inserts on one
+    session; nothing is visible to other sessions until ``commit``."""
+
+    def __init__(self, db: Session) -> None:
+        self.db = db
+        self.inserted = 0
+        self.first_id: Optional[int] = None
+        self.last_id: Optional[int] = None
+
+    def write(self, rows: List[dict]) -> None:
+        if not rows:
+            return
+        Transaction = models.Transcation
+        # executemany with RETURNING; SQLAlchemy batches it into multi-row INSERTs
+        ids = self.db.execute(insert(Transaction).returning(Transaction.id), rows).scalars().all()
+        record_rollups(self.db, ((r["date"], r["category"], r["amount"]) for r in rows))
+        self.inserted += len(ids)
+        self.first_id = min(ids) if self.first_id is None else min(self.first_id, *ids)
+        self.last_id = max(ids) if self.last_id is None else max(self.last_id, *ids)
+
+    def commit(self) -> None:
+        self.db.commit()
+
+    def rollback(self) -> None:
+        self.db.rollback()
+        self.inserted = 0
+        self.first_id = self.last_id = None
@@ -0,0 +1,296 @@
+"""ANN indexes on the embedding tables and per-query search parameters.
+
+The PGVector collections (``langchain_pg_embedding``) and
+``text_embeddings`` get an HNSW or IVFFlat index with cosine ops, so
+similarity searches stop scanning every row. ``search_params`` sets
+``hnsw.ef_search`` / ``ivfflat.probes`` for the searches run inside it.
+
+Admin commands (from ``backend/``)::
+
+    python vector_index.py status
+    python vector_index.py create --kind hnsw --m 16 --ef-construction 64
+    python vector_index.py rebuild --kind ivfflat --lists 200
+"""
+import argparse
+import contextlib
+import contextvars
+import math
+import os
+import re
+from typing import Iterator, List, Optional, Tuple
+
+from sqlalchemy import event, inspect, text
+from sqlalchemy.engine import Engine
+
+import models
+
+INDEX_KINDS = ("hnsw", "ivfflat")
+# What the ANN index holds: the float32 vectors, or a compact copy of them for
+# a first pass that is re-ranked against the float32 column (see vector_storage.py)
+STORAGE_MODES = ("full", "halfvec", "binary")
+# (table, vector column) pairs that get an ANN index
+INDEXED_TABLES: Tuple[Tuple[str, str], ...] = (
+    ("langchain_pg_embedding", "embedding"),
+    (models.TextEmbedding.__tablename__, "embedding"),
+)
+# Every collection shares langchain_pg_embedding; small per-session
+# collections are cheaper to scan through this index than through the ANN one
+COLLECTION_INDEX = ("langchain_pg_embedding", "collection_id")
+
+VECTOR_INDEX_KIND = os.getenv("VECTOR_INDEX_KIND", "hnsw")
+VECTOR_STORAGE = os.getenv("VECTOR_STORAGE", "full")
+VECTOR_EF_SEARCH = int(os.getenv("VECTOR_EF_SEARCH", "0")) or None
+VECTOR_PROBES = int(os.getenv("VECTOR_PROBES", "0")) or None
+
+# Held while missing indexes are created, so concurrently starting workers do not race
+_ADVISORY_LOCK = 0x7665_6374
+
+_search_params: "contextvars.ContextVar[Optional[Tuple[Optional[int], Optional[int]]]]" = contextvars.ContextVar(
+    "vector_search_params", default=None
+)
+
+
+def index_name(table: str, column: str, kind: str, storage: str = "full") -> str:
+    suffix = "" if storage == "full" else f"_{storage}"
+    return f"ix_{table}_{column}_{kind}{suffix}"
+
+
+def index_expression(column: str, storage: str, dimension: int = models.N_DIM) -> Tuple[str, str]:
+    """Indexed expression and operator class of a storage mode.
+
+    Searches must order by the same expression for the index to be used.
+    """
+    if storage == "halfvec":
+        return f"({column}::halfvec({dimension}))", "halfvec_cosine_ops"
+    if storage == "binary":
+        return f"(binary_quantize({column})::bit({dimension}))", "bit_hamming_ops"
+    return column, "vector_cosine_ops"
+
+
+def ivfflat_lists(rows: int) -> int:
+    # pgvector's guidance: rows / 1000 up to 1M rows, sqrt(rows) beyond
+    return max(10, rows // 1000 if rows <= 1_000_000 else int(math.sqrt(rows)))
+
+
+def _vector_type(conn, table: str, column: str) -> Optional[str]:
+    return conn.execute(
+        text(
+            "SELECT format_type(a.atttypid, a.atttypmod) FROM pg_attribute a "
+            "WHERE a.attrelid = CAST(:table AS regclass) AND a.attname = :column AND NOT a.attisdropped"
+        ),
+        {"table": table, "column": column},
+    ).scalar()
+
+
+def ensure_vector_dimension(
+    conn, table: str, column: str, dimension: int = models.N_DIM, retype: bool = True
+) -> bool:
+    """Give an untyped ``vector`` column its dimension, which ANN indexes require.
+
+    Returns False if the column holds vectors of another size, or if it is
+    untyped and ``retype`` is off (the ALTER rewrites the table under an
+    exclusive lock).
+    """
+    current = _vector_type(conn, table, column)
+    if current == f"vector({dimension})":
+        return True
+    if current != "vector" or not retype:
+        print(f"{table}.{column} is {current}, expected vector({dimension}); not indexing it")
+        return False
+    other = conn.execute(
+        text(f"SELECT count(*) FROM {table} WHERE vector_dims({column}) <> :dimension"),
+        {"dimension": dimension},
+    ).scalar()
+    if other:
+        print(f"{table}.{column} has {other} vectors that are not {dimension}-dimensional; not indexing it")
+        return False
+    conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE vector({dimension})"))
+    print(f"Typed {table}.{column} as vector({dimension})")
+    return True
+
+
+def create_vector_indexes(
+    engine: Engine,
+    kind: str = VECTOR_INDEX_KIND,
+    m: int = 16,
+    ef_construction: int = 64,
+    lists: Optional[int] = None,
+    rebuild: bool = False,
+    concurrently: bool = False,
+    retype: bool = True,
+    storage: str = VECTOR_STORAGE,
+    replace: bool = False,
+) -> List[str]:
+    """Create the ANN index of each embedding table that exists.
+
+    The index covers the float32 vectors, or their ``halfvec`` or binary
+    quantization depending on ``storage``. By default only tables without
+    any ANN index get one and nothing is dropped, so the schema step and the
+    API warm-up keep whatever kind and storage an admin chose. With
+    ``replace`` (the admin commands) indexes of any other kind or storage are
+    dropped, and an invalid index left by an interrupted build is rebuilt;
+    with ``rebuild`` the index is also rebuilt with the given parameters,
+    which IVFFlat needs after the table has grown, because its ``lists`` are
+    fixed when the index is built. ``concurrently`` avoids blocking writes
+    while an index builds, and ``retype`` allows typing untyped vector
+    columns first. Returns the names of the indexes created.
+    """
+    if kind not in INDEX_KINDS:
+        raise ValueError(f"kind must be one of {', '.join(INDEX_KINDS)}")
+    if storage not in STORAGE_MODES:
+        raise ValueError(f"storage must be one of {', '.join(STORAGE_MODES)}")
+    if engine.dialect.name != "postgresql":
+        return []
+    created = []
+    tables = set(inspect(engine).get_table_names())
+    option = "CONCURRENTLY " if concurrently else ""
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        # One API worker creates missing indexes; the others skip rather than race it
+        if not replace and not conn.execute(text(f"SELECT pg_try_advisory_lock({_ADVISORY_LOCK})")).scalar():
+            print("Another process is creating the vector indexes; skipping")
+            return created
+        try:
+            table, column = COLLECTION_INDEX
+            if table in tables:
+                conn.execute(
+                    text(f"CREATE INDEX {option}IF NOT EXISTS ix_{table}_{column} ON {table} ({column})")
+                )
+            for table, column in INDEXED_TABLES:
+                if table not in tables or not ensure_vector_dimension(conn, table, column, retype=retype):
+                    continue
+                name = index_name(table, column, kind, storage)
+                existing = conn.execute(
+                    text(
+                        "SELECT c.relname, x.indisvalid FROM pg_class c JOIN pg_index x ON x.indexrelid = c.oid "
+                        "WHERE c.relname = ANY(:names)"
+                    ),
+                    {"names": [index_name(table, column, k, s) for k in INDEX_KINDS for s in STORAGE_MODES]},
+                ).all()
+                # Any index, even one still building, is left alone unless replacing
+                if existing and not replace:
+                    continue
+                valid = dict(existing).get(name)
+                # An interrupted concurrent build leaves an invalid index behind
+                if rebuild or valid is False:
+                    conn.execute(text(f"DROP INDEX {option}IF EXISTS {name}"))
+                if rebuild or not valid:
+                    if kind == "hnsw":
+                        params = f"m = {int(m)}, ef_construction = {int(ef_construction)}"
+                    else:
+                        rows = conn.execute(text(f"SELECT count(*) FROM {table}")).scalar() or 0
+                        params = f"lists = {int(lists or ivfflat_lists(rows))}"
+                    expression, opclass = index_expression(column, storage)
+                    conn.execute(
+                        text(
+                            f"CREATE INDEX {option}IF NOT EXISTS {name} ON {table} "
+                            f"USING {kind} ({expression} {opclass}) WITH ({params})"
+                        )
+                    )
+                    print(f"Created {kind} index {name} ({params})")
+                    created.append(name)
+                # Dropped only once the new index exists, so searches always have one
+                for other, _ in existing:
+                    if other != name:
+                        conn.execute(text(f"DROP INDEX {option}IF EXISTS {other}"))
+        finally:
+            if not replace:
+                conn.execute(text(f"SELECT pg_advisory_unlock({_ADVISORY_LOCK})"))
+    return created
+
+
+def index_status(engine: Engine) -> List[dict]:
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text(
+                "SELECT i.relname AS name, t.relname AS table, am.amname AS kind, "
+                "pg_relation_size(i.oid) AS bytes, pg_get_indexdef(i.oid) AS definition "
+                "FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid "
+                "JOIN pg_class t ON t.oid = x.indrelid JOIN pg_am am ON am.oid = i.relam "
+                "WHERE am.amname IN ('hnsw', 'ivfflat') ORDER BY t.relname, i.relname"
+            )
+        )
+        return [dict(row._mapping) for row in rows]
+
+
+@contextlib.contextmanager
+def search_params(ef_search: Optional[int] = None, probes: Optional[int] = None) -> Iterator[None]:
+    """Use these ANN parameters for the vector searches run inside the block.
+
+    Must be entered on the thread that runs the search (inside the function
+    passed to ``run_blocking``), since executor threads do not inherit
+    context variables.
+    """
+    token = _search_params.set((ef_search, probes))
+    try:
+        yield
+    finally:
+        _search_params.reset(token)
+
+
+def install_search_params(
+    engine: Engine, ef_search: Optional[int] = VECTOR_EF_SEARCH, probes: Optional[int] = VECTOR_PROBES
+) -> None:
+    """Apply ``ef_search``/``probes`` (the defaults, or those of ``search_params``)
+    to every cosine-distance query on ``engine``.
+
+    The settings are made transaction-local with ``set_config`` right before
+    the query, so pooled connections keep their defaults. On pgvector 0.8+,
+    filtered searches also use iterative index scans, so a collection or
+    document filter does not leave the result short of ``k`` rows.
+    """
+    if engine.dialect.name != "postgresql":
+        return
+    state = {"iterative_scan": None}
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _apply(conn, cursor, statement, parameters, context, executemany):
+        # Only cosine-distance searches
+        if executemany or "<=>" not in statement:
+            return
+        ef, nprobes = _search_params.get() or (None, None)
+        ef, nprobes = ef or ef_search, nprobes or probes
+        if state["iterative_scan"] is None:
+            cursor.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+            row = cursor.fetchone()
+            version = tuple(int(part) for part in re.findall(r"\d+", row[0])[:2]) if row else (0, 0)
+            state["iterative_scan"] = version >= (0, 8)
+        settings = []
+        if ef:
+            settings.append(("hnsw.ef_search", str(int(ef))))
+        if nprobes:
+            settings.append(("ivfflat.probes", str(int(nprobes))))
+        if state["iterative_scan"]:
+            settings += [("hnsw.iterative_scan", "relaxed_order"), ("ivfflat.iterative_scan", "relaxed_order")]
+        if settings:
+            calls = ", ".join("set_config(%s, %s, true)" for _ in settings)
+            cursor.execute(f"SELECT {calls}", [value for setting in settings for value in setting])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the ANN indexes of the embedding tables")
+    parser.add_argument("command", choices=["status", "create", "rebuild"])
+    parser.add_argument("--kind", default=VECTOR_INDEX_KIND, choices=INDEX_KINDS)
+    parser.add_argument("--storage", default=VECTOR_STORAGE, choices=STORAGE_MODES)
+    parser.add_argument("--m", type=int, default=16)
+    parser.add_argument("--ef-construction", type=int, default=64)
+    parser.add_argument("--lists", type=int, default=None, help="IVFFlat lists (default from the row count)")
+    parser.add_argument("--blocking", action="store_true", help="build without CONCURRENTLY (faster, blocks writes)")
+    args = parser.parse_args()
+
+    from database import engine
+
+    if args.command != "status":
+        create_vector_indexes(
+            engine,
+            kind=args.kind,
+            m=args.m,
+            ef_construction=args.ef_construction,
+            lists=args.lists,
+            rebuild=args.command == "rebuild",
+            concurrently=not args.blocking,
+            storage=args.storage,
+            replace=True,
+        )
+    for index in index_status(engine):
+        print(f"{index['table']:<28} {index['name']:<48} {index['kind']:<8} {index['bytes'] / 2**20:8.1f} MB")
@@ -0,0 +1,116 @@
+"""Compact vector storage: quantized first pass, exact re-ranking.
+
+With ``VECTOR_STORAGE=halfvec`` or ``binary`` the ANN index holds a
+``halfvec`` (2 bytes per dimension) or binary (1 bit per dimension)
+quantization of each embedding instead of the float32 vector, so the part
+that has to stay in the buffer cache shrinks by 2x or 32x. The float32
+vectors stay in the ``embedding`` column, which Postgres keeps out of line
+in TOAST (cold storage); a search takes ``k * rerank_factor`` candidates
+from the compact index and reads only their float32 vectors to re-rank them
+by exact cosine distance.
+
+Migration tool (from ``backend/``, with ``DATABASE_URL`` set)::
+
+    python vector_storage.py status
+    python vector_storage.py migrate --to binary
+    python vector_storage.py migrate --to full
+"""
+import argparse
+import os
+from typing import List
+
+from langchain_core.documents import Document
+from pgvector.sqlalchemy import BIT, HALFVEC, Vector
+from sqlalchemy import bindparam, cast, func, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+import models
+from vector_index import INDEXED_TABLES, STORAGE_MODES, VECTOR_STORAGE, create_vector_indexes
+
+VECTOR_RERANK_FACTOR = int(os.getenv("VECTOR_RERANK_FACTOR", "4"))
+
+
+def first_pass_distance(column, embedding: List[float], storage: str, dimension: int = models.N_DIM):
+    """Distance on the compact representation; matches ``index_expression``."""
+    query = bindparam(None, embedding, type_=Vector(dimension))
+    if storage == "halfvec":
+        return cast(column, HALFVEC(dimension)).op("<=>")(cast(query, HALFVEC(dimension)))
+    if storage == "binary":
+        return cast(func.binary_quantize(column), BIT(dimension)).op("<~>")(
+            func.binary_quantize(cast(query, Vector(dimension)))
+        )
+    return column.cosine_distance(embedding)
+
+
+def quantized_search(
+    db: Session,
+    embedding_store,
+    embedding: List[float],
+    k: int,
+    where: list,
+    storage: str = VECTOR_STORAGE,
+    rerank_factor: int = VECTOR_RERANK_FACTOR,
+) -> List[Document]:
+    """Nearest ``embedding_store`` rows (a PGVector ``EmbeddingStore``) matching ``where``.
+
+    Candidates come from the compact index and are re-ranked by exact
+    cosine distance on the float32 vectors. With ``full`` storage this is a
+    plain search on the float32 index.
+    """
+    candidates = (
+        select(embedding_store.id, embedding_store.document, embedding_store.cmetadata, embedding_store.embedding)
+        .where(*where)
+        .order_by(first_pass_distance(embedding_store.embedding, embedding, storage))
+        .limit(k if storage == "full" else k * max(1, rerank_factor))
+        .subquery()
+    )
+    rows = db.execute(
+        select(candidates.c.id, candidates.c.document, candidates.c.cmetadata)
+        .order_by(candidates.c.embedding.cosine_distance(embedding))
+        .limit(k)
+    )
+    return [Document(id=row.id, page_content=row.document or "", metadata=row.cmetadata or {}) for row in rows]
+
+
+def storage_status(engine: Engine) -> List[dict]:
+    """Heap, TOAST and index sizes of each embedding table."""
+    names = [table for table, _ in INDEXED_TABLES]
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text(
+                "SELECT c.relname AS table, c.reltuples::bigint AS rows, pg_relation_size(c.oid) AS heap_bytes, "
+                "COALESCE(pg_total_relation_size(NULLIF(c.reltoastrelid, 0)), 0) AS toast_bytes, "
+                "pg_indexes_size(c.oid) AS index_bytes FROM pg_class c "
+                "WHERE c.relname = ANY(:names) AND c.relkind = 'r'"
+            ),
+            {"names": names},
+        )
+        return [dict(row._mapping) for row in rows]
+
+
+def _print_status(engine: Engine) -> None:
+    for row in storage_status(engine):
+        print(
+            f"{row['table']:<28} rows={row['rows']:<10} heap={row['heap_bytes'] / 2**20:8.1f} MB "
+            f"toast={row['toast_bytes'] / 2**20:8.1f} MB indexes={row['index_bytes'] / 2**20:8.1f} MB"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Switch the embedding tables between full and compact index storage")
+    parser.add_argument("command", choices=["status", "migrate"])
+    parser.add_argument("--to", default=VECTOR_STORAGE, choices=STORAGE_MODES)
+    parser.add_argument("--kind", default=None, help="index kind (default VECTOR_INDEX_KIND)")
+    parser.add_argument("--blocking", action="store_true", help="build without CONCURRENTLY (faster, blocks writes)")
+    args = parser.parse_args()
+
+    from database import engine
+
+    if args.command == "migrate":
+        # The new index is built before the old one is dropped, so searches
+        # keep an index throughout; set VECTOR_STORAGE to match afterwards
+        kwargs = {"kind": args.kind} if args.kind else {}
+        create_vector_indexes(engine, storage=args.to, concurrently=not args.blocking, replace=True, **kwargs)
+        print(f"Index storage is now {args.to}; set VECTOR_STORAGE={args.to} for the API")
+    _print_status(engine)